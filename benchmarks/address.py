@@ -0,0 +1,41 @@
+from ipaddress import IPv4Network
+from itertools import islice
+from timeit import Timer
+
+from umps.hash import hash_v1
+from umps.interface import address_of_bin, count_bins
+
+
+def walk_hosts(network: IPv4Network, address_bin: int) -> str:
+    # the original lookup: step through hosts() up to the bin
+    return str(next(islice(network.hosts(), address_bin, None)))
+
+
+def bench(network: IPv4Network, topics, number: int):
+    nbins = count_bins(network)
+    bins = [hash_v1(topic, nbins) for topic in topics]
+
+    def run(lookup):
+        for address_bin in bins:
+            lookup(network, address_bin)
+
+    for name, lookup in (('hosts() walk', walk_hosts),
+                         ('arithmetic', address_of_bin)):
+        seconds = Timer(lambda: run(lookup)).timeit(number)
+        per_lookup = seconds / (number * len(bins)) * 1e6
+        print('{:>18}  {:<14} {:10.2f} us/lookup'.format(
+            str(network), name, per_lookup))
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument('-n', '--number', type=int, default=5,
+                   help='repetitions per network (default: %(default)d)')
+    p.add_argument('-t', '--topics', type=int, default=200,
+                   help='distinct topics (default: %(default)d)')
+    args = p.parse_args()
+
+    topics = ['topic-%d' % i for i in range(args.topics)]
+    for net in ('239.11.122.0/24', '239.11.0.0/16'):
+        bench(IPv4Network(net), topics, args.number)
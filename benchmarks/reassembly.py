@@ -0,0 +1,49 @@
+import random
+from timeit import Timer
+
+from umps import parse, reassembly
+
+
+def frames_of(length: int, max_datagram_size: int):
+    body = random.getrandbits(8 * length).to_bytes(length, 'little')
+    return [bytes(frame) for frame in parse.pack(1, 'bench', body,
+                                                 max_datagram_size)]
+
+
+def bench(message_type, frames, order, number: int) -> float:
+    def run():
+        message = message_type(len(frames))
+        for frame_number in order:
+            message.add_frame(frame_number, frames[frame_number])
+        message.assemble()
+
+    seconds = Timer(run).timeit(number)
+    return seconds / (number * len(order)) * 1e6
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument('-n', '--number', type=int, default=2000,
+                   help='messages per case (default: %(default)d)')
+    args = p.parse_args()
+
+    # Seed generator for reproducible benchmark.
+    random.seed(0)
+    implementations = [('python', reassembly._PartialMessage)]
+    if reassembly.PartialMessage is not reassembly._PartialMessage:
+        implementations.append(('cython', reassembly.PartialMessage))
+    else:
+        print('extension not built; timing the Python class only')
+
+    for size, length in ((1500, 2 ** 14), (1500, 2 ** 17), (9000, 2 ** 19)):
+        frames = frames_of(length, size)
+        for arrival in ('in order', 'shuffled'):
+            order = list(range(len(frames)))
+            if arrival == 'shuffled':
+                random.shuffle(order)
+            for name, message_type in implementations:
+                per_frame = bench(message_type, frames, order, args.number)
+                print('{:>5} B datagrams {:>7} B  {:<9} {:<7} '
+                      '{:8.3f} us/frame'.format(size, length, arrival, name,
+                                                per_frame))
@@ -0,0 +1,77 @@
+import asyncio
+from multiprocessing import Event, Process
+from socket import AF_INET, SOCK_DGRAM, socket
+from time import perf_counter
+
+from umps.parse import pack
+from umps.subscribe import SubscribeProtocol, create_subscribe_socket
+
+
+def blast(address, size: int, stop: Event):
+    # send single-frame messages as fast as possible until told to stop
+    frames = [bytes(pack(uid, 'bench', bytes(size))[0])
+              for uid in range(2**12)]
+    sock = socket(AF_INET, SOCK_DGRAM)
+    while not stop.is_set():
+        for frame in frames:
+            sock.sendto(frame, address)
+    sock.close()
+
+
+async def receive(loop, batch_receive: bool, address, size: int,
+                  seconds: float, senders: int) -> float:
+    received = 0
+
+    def count(topic, body):
+        nonlocal received
+        received += 1
+
+    # senders cycle through their uids, so only remember the last one
+    if batch_receive:
+        protocol = await create_subscribe_socket(
+            address, loop=loop, message_callback=count, duplicate_window=1,
+            batch_receive=True)
+    else:
+        # asyncio's transport, without the port reuse some Pythons refuse
+        _, protocol = await loop.create_datagram_endpoint(
+            lambda: SubscribeProtocol(loop=loop, message_callback=count,
+                                      duplicate_window=1),
+            local_addr=address)
+
+    stop = Event()
+    workers = [Process(target=blast, args=(address, size, stop))
+               for _ in range(senders)]
+    for worker in workers:
+        worker.start()
+    await asyncio.sleep(0.5)
+    received = 0
+    start = perf_counter()
+    await asyncio.sleep(seconds)
+    rate = received / (perf_counter() - start)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    protocol.close()
+    await asyncio.sleep(0.1)
+    return rate
+
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument('-p', '--port', type=int, default=19500,
+                   help='loopback port to receive on (default: %(default)d)')
+    p.add_argument('-s', '--size', type=int, default=64,
+                   help='message body size (default: %(default)d)')
+    p.add_argument('-t', '--seconds', type=float, default=3,
+                   help='measuring time per mode (default: %(default)g)')
+    p.add_argument('-n', '--senders', type=int, default=2,
+                   help='sending processes (default: %(default)d)')
+    args = p.parse_args()
+
+    loop = asyncio.get_event_loop()
+    for mode, batch in (('per-datagram', False), ('batch', True)):
+        rate = loop.run_until_complete(receive(
+            loop, batch, ('127.0.0.1', args.port), args.size, args.seconds,
+            args.senders))
+        print('{:<14} {:12,.0f} messages/s'.format(mode, rate))
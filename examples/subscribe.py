@@ -1,24 +1,16 @@
-from asyncio import CancelledError, Queue, get_event_loop
-from functools import partial
+from asyncio import CancelledError, get_event_loop
 from ipaddress import IPv4Network
 from umps import Interface
 
 
-def notify(queue: Queue, topic: str, message: bytes):
-    queue.put_nowait((topic, message))
-
-
 async def single_subscribe(network: IPv4Network, port: int, topic: str):
-    queue = Queue()
-    interface = Interface(network, port, timeout=0.1)
-    await interface.subscribe(topic, partial(notify, queue))
-    while True:
-        try:
-            topic, message = await queue.get()
-        except CancelledError:
-            break
-        else:
-            print(f"Received '{topic}' message: {message!r}")
+    interface = Interface(network, port)
+    try:
+        async with await interface.stream(topic, maxsize=100) as stream:
+            async for topic, message in stream:
+                print(f"Received '{topic}' message: {message!r}")
+    except CancelledError:
+        pass
     await interface.terminate()
 
 
@@ -31,6 +31,8 @@ if HAVE_CYTHON:
                   libraries=frame_libs),
         Extension("umps._parse", ["umps/_parse.pyx"], optional=True,
                   libraries=frame_libs),
+        Extension("umps._reassembly", ["umps/_reassembly.pyx"],
+                  optional=True, libraries=frame_libs),
     ])
 else:
     extensions = None
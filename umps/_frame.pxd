@@ -23,6 +23,9 @@ cdef uint8_t CONTINUATION_FRAME
 cdef uint8_t FRAME_REQUEST
 cdef uint8_t FRAME_RESPONSE
 cdef uint8_t MESSAGE_DROPPED
+cdef uint8_t FRAMES_REQUEST
+cdef uint8_t PARITY_FRAME
+cdef uint8_t COMPRESSED
 
 
 cdef union _u64_as_u32_array:
@@ -38,20 +41,39 @@ cdef packed struct frame_header_t:
     uint8_t  total_frames
 
 
+# version 2 frames number frames in two bytes
+cdef packed struct frame_header_v2_t:
+    uint16_t size
+    uint8_t  vt
+    uint64_t uid
+    uint16_t frame_number
+    uint16_t total_frames
+
+
 DEF MAX_UDP_SIZE = 512
 cdef uint16_t MAX_UDP_SIZE
+# largest UDP payload over IPv4
+DEF MAX_DATAGRAM_SIZE = 65507
+cdef uint16_t MAX_DATAGRAM_SIZE
 # This should use something safer, like sizeof(), but Cython doesn't support a
 # call to sizeof() in a DEF statement.
 DEF FRAME_HEADER_SIZE = 13
 cdef uint16_t FRAME_HEADER_SIZE
 DEF FRAME_BODY_SIZE = MAX_UDP_SIZE - FRAME_HEADER_SIZE
 cdef uint16_t FRAME_BODY_SIZE
+DEF MAX_FRAME_BODY_SIZE = MAX_DATAGRAM_SIZE - FRAME_HEADER_SIZE
 cdef uint8_t MAX_TOPIC_SIZE
+cdef uint8_t MAX_FRAMES
+# the first frame must fit the longest topic and at least one body byte
+DEF MIN_DATAGRAM_SIZE = FRAME_HEADER_SIZE + 1 + 255 + 1
+cdef uint16_t MIN_DATAGRAM_SIZE
 
 
+# Frames are only ever accessed through pointers into datagram buffers, so the
+# body is sized for the largest datagram rather than the one in use.
 cdef packed struct frame_t:
     frame_header_t hdr
-    uint8_t        body[FRAME_BODY_SIZE]
+    uint8_t        body[MAX_FRAME_BODY_SIZE]
 
 
 cdef uint64_t ntoh_u64(uint64_t net_u64) nogil
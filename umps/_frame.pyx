@@ -1,4 +1,4 @@
-TYPE_MASK = 0xF
+TYPE_MASK = 0x7
 VERSION_MASK = 0xF0
 # v1 message types
 START_FRAME = 0x1
@@ -6,11 +6,18 @@ CONTINUATION_FRAME = 0x2
 FRAME_REQUEST = 0x3
 FRAME_RESPONSE = 0x4
 MESSAGE_DROPPED = 0x5
+FRAMES_REQUEST = 0x6
+PARITY_FRAME = 0x7
+# set in every frame of a message whose body is compressed
+COMPRESSED = 0x8
 
 MAX_UDP_SIZE = 512
+MAX_DATAGRAM_SIZE = 65507
 FRAME_HEADER_SIZE = 13
 FRAME_BODY_SIZE = MAX_UDP_SIZE - FRAME_HEADER_SIZE
 MAX_TOPIC_SIZE = 255
+MAX_FRAMES = 255
+MIN_DATAGRAM_SIZE = FRAME_HEADER_SIZE + 1 + MAX_TOPIC_SIZE + 1
 
 
 cdef uint8_t _swapped_plat = (1 != htons(1))
@@ -4,42 +4,43 @@ from libc.string cimport memcpy
 from libc.stdint cimport uint8_t, uint16_t, uint64_t
 
 from ._frame cimport (START_FRAME, CONTINUATION_FRAME, FRAME_HEADER_SIZE,
-                      FRAME_BODY_SIZE, MAX_TOPIC_SIZE, htons, hton_u64,
+                      MAX_TOPIC_SIZE, MAX_FRAMES, MAX_UDP_SIZE,
+                      MIN_DATAGRAM_SIZE, MAX_DATAGRAM_SIZE, htons, hton_u64,
                       frame_header_t, frame_t)
 
 
-cpdef list pack(uint64_t uid, unicode topic, object body):
+cpdef list pack(uint64_t uid, unicode topic, object body,
+                size_t max_datagram_size=MAX_UDP_SIZE, uint8_t flags=0):
     cdef Py_buffer bytearray_buf, topic_buf, body_buf
-    cdef bytes body_bytes = (body if isinstance(body, bytes) else
-                             body.encode('utf-8'))
+    # any contiguous buffer is read in place; only text needs encoding
+    cdef object body_obj = (body.encode('utf-8') if isinstance(body, unicode)
+                            else body)
     cdef bytes topic_bytes = topic.encode()
     cdef size_t topic_size = len(topic_bytes)
-    cdef size_t body_size = len(body_bytes)
-    cdef size_t max_body_size = max_message_size(topic_size)
-    cdef uint8_t total_frames = compute_total_frames(topic_size, body_size)
-    cdef list ret_list = [None,] * total_frames
-    cdef frame_t frame
+    cdef size_t body_size
+    cdef size_t frame_body_size
+    cdef uint8_t total_frames
+    cdef list ret_list
     cdef size_t frame_size
     cdef size_t next_frame_start
     cdef bytearray py_frame
     cdef int i
 
-    if topic_size > MAX_TOPIC_SIZE:
-        raise ValueError('topic length exceeds maximum: '
-                         '%d > %d' % (<int>topic_size, MAX_TOPIC_SIZE))
-
-    if body_size > max_body_size:
-        raise ValueError('message length exceeds maximum for topic: '
-                         '%d > %d' % (<int>body_size, <int>max_body_size))
-
     PyObject_GetBuffer(topic_bytes, &topic_buf,
                        PyBUF_ANY_CONTIGUOUS | PyBUF_SIMPLE)
-    PyObject_GetBuffer(body_bytes, &body_buf,
+    PyObject_GetBuffer(body_obj, &body_buf,
                        PyBUF_ANY_CONTIGUOUS | PyBUF_SIMPLE)
     try:
+        body_size = body_buf.len
+        frame_body_size = check_sizes(topic_size, body_size,
+                                      max_datagram_size)
+        total_frames = compute_total_frames(topic_size, body_size,
+                                            frame_body_size)
+        ret_list = [None,] * total_frames
+
         # pack the first frame
         frame_size = FRAME_HEADER_SIZE + min(1 + topic_size + body_size,
-                                             FRAME_BODY_SIZE)
+                                             frame_body_size)
         py_frame = bytearray(frame_size)
         PyObject_GetBuffer(py_frame, &bytearray_buf,
                            PyBUF_ANY_CONTIGUOUS | PyBUF_SIMPLE)
@@ -47,7 +48,7 @@ cpdef list pack(uint64_t uid, unicode topic, object body):
             next_frame_start = c_pack_start_frame(
                 <frame_t*>bytearray_buf.buf, <uint16_t>frame_size, uid,
                 total_frames, <uint8_t>topic_size, <uint8_t*>topic_buf.buf,
-                body_size, <uint8_t*>body_buf.buf
+                body_size, <uint8_t*>body_buf.buf, frame_body_size, flags
             )
         finally:
             PyBuffer_Release(&bytearray_buf)
@@ -56,7 +57,7 @@ cpdef list pack(uint64_t uid, unicode topic, object body):
         # pack the rest of the frames
         for i in range(1, total_frames):
             frame_size = FRAME_HEADER_SIZE + min(body_size - next_frame_start,
-                                                 FRAME_BODY_SIZE)
+                                                 frame_body_size)
             py_frame = bytearray(frame_size)
             PyObject_GetBuffer(py_frame, &bytearray_buf,
                                PyBUF_ANY_CONTIGUOUS | PyBUF_SIMPLE)
@@ -64,7 +65,8 @@ cpdef list pack(uint64_t uid, unicode topic, object body):
                 next_frame_start += c_pack_cont_frame(
                     <frame_t*>bytearray_buf.buf, <uint16_t>frame_size, uid, i,
                     total_frames, next_frame_start,
-                    body_size - next_frame_start, <uint8_t*>body_buf.buf
+                    body_size - next_frame_start, <uint8_t*>body_buf.buf,
+                    frame_body_size, flags
                 )
             finally:
                 PyBuffer_Release(&bytearray_buf)
@@ -76,14 +78,88 @@ cpdef list pack(uint64_t uid, unicode topic, object body):
     return ret_list
 
 
-cdef size_t max_message_size(size_t topic_size):
-    return 255*FRAME_BODY_SIZE - (topic_size + 1)
+cpdef list pack_headers(uint64_t uid, unicode topic, object body,
+                        size_t max_datagram_size=MAX_UDP_SIZE,
+                        uint8_t flags=0):
+    cdef object view = memoryview(body.encode('utf-8')
+                                  if isinstance(body, unicode) else body)
+    cdef bytes topic_bytes = topic.encode()
+    cdef size_t topic_size = len(topic_bytes)
+    cdef size_t body_size
+    cdef size_t frame_body_size
+    cdef uint8_t total_frames
+    cdef list ret_list
+    cdef size_t frame_size
+    cdef size_t start, end
+    cdef bytearray header
+    cdef uint8_t *header_buf
+    cdef int i
+
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    body_size = len(view)
+    frame_body_size = check_sizes(topic_size, body_size, max_datagram_size)
+    total_frames = compute_total_frames(topic_size, body_size, frame_body_size)
+    ret_list = [None,] * total_frames
+
+    # the first header also carries the topic
+    end = min(body_size, frame_body_size - (topic_size + 1))
+    header = bytearray(FRAME_HEADER_SIZE + 1 + topic_size)
+    header_buf = header
+    c_set_frame_header(<frame_header_t*>header_buf,
+                       <uint16_t>(len(header) + end), START_FRAME | flags,
+                       uid, 0, total_frames)
+    header_buf[FRAME_HEADER_SIZE] = <uint8_t>topic_size
+    memcpy(&header_buf[FRAME_HEADER_SIZE + 1], <char*>topic_bytes, topic_size)
+    ret_list[0] = (header, view[:end])
+
+    for i in range(1, total_frames):
+        start = end
+        end = min(body_size, start + frame_body_size)
+        header = bytearray(FRAME_HEADER_SIZE)
+        header_buf = header
+        c_set_frame_header(<frame_header_t*>header_buf,
+                           <uint16_t>(FRAME_HEADER_SIZE + end - start),
+                           CONTINUATION_FRAME | flags, uid, i, total_frames)
+        ret_list[i] = (header, view[start:end])
+
+    return ret_list
+
 
+cdef size_t check_sizes(size_t topic_size, size_t body_size,
+                        size_t max_datagram_size) except 0:
+    cdef size_t frame_body_size
+    cdef size_t max_body_size
 
-cdef uint8_t compute_total_frames(size_t topic_size, size_t body_size) nogil:
+    if not MIN_DATAGRAM_SIZE <= max_datagram_size <= MAX_DATAGRAM_SIZE:
+        raise ValueError('datagram size outside supported range: '
+                         '%d not in [%d, %d]' % (<int>max_datagram_size,
+                                                 MIN_DATAGRAM_SIZE,
+                                                 MAX_DATAGRAM_SIZE))
+
+    frame_body_size = max_datagram_size - FRAME_HEADER_SIZE
+    max_body_size = max_message_size(topic_size, frame_body_size)
+
+    if topic_size > MAX_TOPIC_SIZE:
+        raise ValueError('topic length exceeds maximum: '
+                         '%d > %d' % (<int>topic_size, MAX_TOPIC_SIZE))
+
+    if body_size > max_body_size:
+        raise ValueError('message length exceeds maximum for topic: '
+                         '%d > %d' % (<int>body_size, <int>max_body_size))
+
+    return frame_body_size
+
+
+cdef size_t max_message_size(size_t topic_size, size_t frame_body_size):
+    return MAX_FRAMES*frame_body_size - (topic_size + 1)
+
+
+cdef uint8_t compute_total_frames(size_t topic_size, size_t body_size,
+                                  size_t frame_body_size) nogil:
     cdef size_t full_body_size = topic_size + body_size + 1  # topic size byte
-    return <uint8_t> (full_body_size / FRAME_BODY_SIZE +
-                      ((full_body_size % FRAME_BODY_SIZE) != 0))
+    return <uint8_t> (full_body_size / frame_body_size +
+                      ((full_body_size % frame_body_size) != 0))
 
 
 cdef void c_set_frame_header(frame_header_t *hdr, uint16_t size,
@@ -99,9 +175,12 @@ cdef void c_set_frame_header(frame_header_t *hdr, uint16_t size,
 cdef size_t c_pack_start_frame(frame_t *frame, uint16_t size, uint64_t uid,
                                uint8_t total_frames, uint8_t topic_size,
                                uint8_t *topic, size_t body_size,
-                               uint8_t *body) nogil:
-    cdef size_t body_copied = min(body_size, FRAME_BODY_SIZE - (topic_size + 1))
-    c_set_frame_header(&frame.hdr, size, START_FRAME, uid, 0, total_frames)
+                               uint8_t *body, size_t frame_body_size,
+                               uint8_t flags) nogil:
+    cdef size_t body_copied = min(body_size,
+                                  frame_body_size - (topic_size + 1))
+    c_set_frame_header(&frame.hdr, size, START_FRAME | flags, uid, 0,
+                       total_frames)
     frame.body[0] = topic_size
     memcpy(&frame.body[1], topic, topic_size)
     memcpy(&frame.body[1 + topic_size], body, body_copied)
@@ -111,9 +190,10 @@ cdef size_t c_pack_start_frame(frame_t *frame, uint16_t size, uint64_t uid,
 cdef size_t c_pack_cont_frame(frame_t *frame, uint16_t size, uint64_t uid,
                               uint8_t frame_number, uint8_t total_frames,
                               size_t body_start, size_t body_size_remaining,
-                              uint8_t *body) nogil:
-    cdef size_t size_copied = min(body_size_remaining, FRAME_BODY_SIZE)
-    c_set_frame_header(&frame.hdr, size, CONTINUATION_FRAME, uid, frame_number,
-                       total_frames)
+                              uint8_t *body, size_t frame_body_size,
+                              uint8_t flags) nogil:
+    cdef size_t size_copied = min(body_size_remaining, frame_body_size)
+    c_set_frame_header(&frame.hdr, size, CONTINUATION_FRAME | flags, uid,
+                       frame_number, total_frames)
     memcpy(&frame.body, body+body_start, size_copied)
     return size_copied
@@ -3,10 +3,10 @@ from cpython.buffer cimport (PyObject_GetBuffer, PyBuffer_Release,
 from libc.string cimport memcpy
 from libc.stdint cimport uint16_t, uint64_t
 
-from ._frame cimport (TYPE_MASK, VERSION_MASK, START_FRAME, FRAME_RESPONSE,
-                      FRAME_HEADER_SIZE,
+from ._frame cimport (TYPE_MASK, VERSION_MASK, COMPRESSED, START_FRAME,
+                      FRAME_RESPONSE, FRAME_HEADER_SIZE,
                       htons, ntohs, ntoh_u64, hton_u64,
-                      frame_header_t)
+                      frame_header_t, frame_header_v2_t)
 
 from libc.stdint cimport uint8_t
 
@@ -34,6 +34,34 @@ cdef bytes get_bytes_from_topic_t(topic_t topic):
     return out
 
 
+cpdef tuple parse_header(object frame_bytes):
+    cdef Py_buffer bytes_buf
+    cdef frame_header_t hdr
+    cdef frame_header_v2_t hdr_v2
+
+    PyObject_GetBuffer(frame_bytes, &bytes_buf,
+                       PyBUF_ANY_CONTIGUOUS | PyBUF_SIMPLE)
+    try:
+        if <size_t>bytes_buf.len < sizeof(frame_header_t):
+            raise ValueError('data buffer smaller than header size: '
+                             '%d < %d' % (<int>bytes_buf.len,
+                                          sizeof(frame_header_t)))
+        memcpy(&hdr, bytes_buf.buf, FRAME_HEADER_SIZE)
+        if hdr.vt >> 4 == 2:
+            if <size_t>bytes_buf.len < sizeof(frame_header_v2_t):
+                raise ValueError('data buffer smaller than header size: '
+                                 '%d < %d' % (<int>bytes_buf.len,
+                                              sizeof(frame_header_v2_t)))
+            memcpy(&hdr_v2, bytes_buf.buf, sizeof(frame_header_v2_t))
+            return (hdr_v2.vt & TYPE_MASK, ntoh_u64(hdr_v2.uid),
+                    ntohs(hdr_v2.frame_number), ntohs(hdr_v2.total_frames))
+    finally:
+        PyBuffer_Release(&bytes_buf)
+
+    return (hdr.vt & TYPE_MASK, ntoh_u64(hdr.uid), hdr.frame_number,
+            hdr.total_frames)
+
+
 cdef class Frame:
 
     cdef frame_header_t _hdr
@@ -96,7 +124,7 @@ cdef class Frame:
 
     @protocol_version.setter
     def protocol_version(self, uint8_t version):
-        self._hdr.vt = (self._hdr.vt & TYPE_MASK) | (version << 4)
+        self._hdr.vt = (self._hdr.vt & ~VERSION_MASK) | (version << 4)
 
     @property
     def frame_type(self):
@@ -104,7 +132,19 @@ cdef class Frame:
 
     @frame_type.setter
     def frame_type(self, uint8_t new_type):
-        self._hdr.vt = (self._hdr.vt & VERSION_MASK) | (new_type & TYPE_MASK)
+        self._hdr.vt = ((self._hdr.vt & ~TYPE_MASK) |
+                        (new_type & TYPE_MASK))
+
+    @property
+    def compressed(self):
+        return bool(self._hdr.vt & COMPRESSED)
+
+    @compressed.setter
+    def compressed(self, bint compressed):
+        if compressed:
+            self._hdr.vt |= COMPRESSED
+        else:
+            self._hdr.vt &= ~COMPRESSED
 
     @property
     def uid(self):
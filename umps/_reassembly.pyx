@@ -0,0 +1,276 @@
+from cpython.buffer cimport (PyObject_GetBuffer, PyBuffer_Release,
+                             PyBUF_ANY_CONTIGUOUS, PyBUF_SIMPLE)
+from cpython.bytearray cimport PyByteArray_AS_STRING
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_FromStringAndSize
+from cpython.mem cimport PyMem_Free, PyMem_Malloc
+from libc.stdint cimport uint8_t
+from libc.string cimport memcpy, memset
+
+from ._frame cimport FRAME_HEADER_SIZE
+
+
+# bytes of XORed frame lengths that start a parity payload
+DEF PARITY_OVERHEAD = 2
+
+
+cdef class PartialMessage:
+    """
+    Reassembly state of one multi-frame message.
+
+    The publisher splits the topic-size byte, topic and body into frames of a
+    fixed size, so each frame's payload is written straight into a single
+    buffer at ``frame_number * frame_size``.  The frame size is learned from
+    the first non-final frame to arrive; a final frame that arrives before
+    any other is held until then.  Missing frames are tracked in a bitmap.
+
+    Parity frames are held until their block is missing exactly one frame,
+    which is then rebuilt from them and the rest of the block.
+    """
+    cdef readonly int total_frames
+    cdef public object source
+    cdef public object request_delay
+    cdef public int request_rounds
+    cdef public double start_time
+    cdef public double frame_time
+    cdef public double request_time
+    cdef public bint gap_detected
+    cdef uint8_t* _missing
+    cdef int _nmissing
+    cdef Py_ssize_t _frame_size
+    cdef Py_ssize_t _length
+    cdef bytearray _buffer
+    cdef bytes _pending
+    cdef int _block_size
+    cdef dict _parity
+
+    def __cinit__(self, int total_frames, source=None, request_delay=0):
+        cdef int i
+        cdef size_t bitmap_size = (max(total_frames, 0) + 7) // 8 + 1
+        self._missing = <uint8_t*>PyMem_Malloc(bitmap_size)
+        if self._missing == NULL:
+            raise MemoryError
+        memset(self._missing, 0, bitmap_size)
+        for i in range(total_frames):
+            self._missing[i >> 3] |= 1 << (i & 7)
+        self._nmissing = max(total_frames, 0)
+
+    def __init__(self, int total_frames, source=None, request_delay=0):
+        self.total_frames = total_frames
+        # where to request missing frames from, how long to wait first and
+        # how often they've been requested
+        self.source = source
+        self.request_delay = request_delay
+        self.request_rounds = 0
+        # when the first and last new frames arrived and the last request was
+        # sent, and whether a frame was found missing ahead of one that
+        # arrived
+        self.start_time = 0
+        self.frame_time = 0
+        self.request_time = 0
+        self.gap_detected = False
+        self._frame_size = 0
+        self._buffer = None
+        self._length = 0
+        self._pending = None
+        self._block_size = 0
+        # block index -> parity payload
+        self._parity = dict()
+
+    def __dealloc__(self):
+        PyMem_Free(self._missing)
+
+    @property
+    def complete(self):
+        return self._nmissing == 0
+
+    @property
+    def nbytes(self):
+        """Memory held for the message's frames."""
+        nbytes = sum([len(parity) for parity in self._parity.values()])
+        if self._buffer is not None:
+            return nbytes + len(self._buffer)
+        return nbytes + (0 if self._pending is None else len(self._pending))
+
+    @property
+    def topic(self):
+        """The message's topic if its first frame has arrived, else None."""
+        if self._buffer is None or self._is_missing(0):
+            return None
+        return self._buffer[1:1 + self._buffer[0]].decode('utf-8', 'replace')
+
+    def is_missing(self, int frame_number):
+        return self._is_missing(frame_number)
+
+    def missing_frames(self):
+        """Numbers of the frames still missing, in order."""
+        cdef int i
+        return tuple([i for i in range(self.total_frames)
+                      if self._is_missing(i)])
+
+    cpdef bint add_frame(self, int frame_number, object frame) except? -1:
+        """
+        Copy the payload of a received frame into the message.
+
+        Returns whether the message is now complete, and raises ValueError
+        if the frame's number or size doesn't fit the message.
+        """
+        cdef Py_buffer view
+
+        if frame_number > self.total_frames - 1:
+            raise ValueError('frame number out of range')
+        PyObject_GetBuffer(frame, &view, PyBUF_ANY_CONTIGUOUS | PyBUF_SIMPLE)
+        try:
+            self._add(frame_number,
+                      <const char*>view.buf + FRAME_HEADER_SIZE,
+                      max(view.len - FRAME_HEADER_SIZE, 0))
+        finally:
+            PyBuffer_Release(&view)
+        if self._parity:
+            self._recover(frame_number // self._block_size)
+        return self._nmissing == 0
+
+    def add_parity(self, int block, int block_size, object frame):
+        """
+        Add a parity frame, rebuilding a missing frame of its block if it can.
+
+        Returns whether the message is now complete, and raises ValueError
+        if the block doesn't fit the message or its other parity frames.
+        """
+        if block_size < 1 or block * block_size >= self.total_frames:
+            raise ValueError('parity block out of range')
+        if self._block_size and block_size != self._block_size:
+            raise ValueError('parity block size inconsistent with message')
+        if len(frame) < FRAME_HEADER_SIZE + PARITY_OVERHEAD:
+            raise ValueError('parity frame too short')
+        self._block_size = block_size
+        if block not in self._parity:
+            # the frame may be a view of a reused receive buffer
+            self._parity[block] = bytes(memoryview(frame)[FRAME_HEADER_SIZE:])
+            self._recover(block)
+        return self._nmissing == 0
+
+    def assemble(self):
+        """
+        Return the topic and body of the complete message.
+
+        The body is the reassembly buffer itself, trimmed in place.
+        """
+        body = self._buffer
+        del body[self._length:]
+        topic_end = 1 + body[0]
+        topic = body[1:topic_end].decode('utf-8')
+        del body[:topic_end]
+        return topic, body
+
+    cdef int _add(self, int frame_number, const char* payload,
+                  Py_ssize_t size) except -1:
+        cdef int last = self.total_frames - 1
+        cdef bytes pending
+
+        if not self._frame_size:
+            if frame_number == last:
+                # the frame may be a view of a reused receive buffer
+                self._pending = PyBytes_FromStringAndSize(payload, size)
+                self._clear(frame_number)
+                return 0
+            self._frame_size = size
+            self._buffer = bytearray(size * self.total_frames)
+            if self._pending is not None:
+                pending, self._pending = self._pending, None
+                if not self._write(last, PyBytes_AS_STRING(pending),
+                                   len(pending)):
+                    self._set(last)
+
+        if not self._write(frame_number, payload, size):
+            raise ValueError('frame size inconsistent with message')
+        self._clear(frame_number)
+        return 0
+
+    cdef int _recover(self, int block) except -1:
+        cdef bytes parity = self._parity.get(block)
+        cdef int first, end, number, missing = -1, nmissing = 0
+        cdef Py_ssize_t size, present_size, length, i
+        cdef const uint8_t* present
+        cdef uint8_t* out
+        cdef bytearray recovered
+
+        if parity is None:
+            return 0
+        first = block * self._block_size
+        end = min(first + self._block_size, self.total_frames)
+        for number in range(first, end):
+            if self._is_missing(number):
+                missing = number
+                nmissing += 1
+        if nmissing > 1:
+            return 0
+        if not nmissing:
+            # once the block is whole, its parity is no longer needed
+            del self._parity[block]
+            return 0
+        size = len(parity) - PARITY_OVERHEAD
+        for number in range(first, end):
+            if number != missing and self._present_size(number) > size:
+                # too short to be the parity of these frames; kept until the
+                # block is whole
+                return 0
+        del self._parity[block]
+
+        present = <const uint8_t*>PyBytes_AS_STRING(parity)
+        length = present[0] << 8 | present[1]
+        recovered = bytearray(parity[PARITY_OVERHEAD:])
+        out = <uint8_t*>PyByteArray_AS_STRING(recovered)
+        for number in range(first, end):
+            if number == missing:
+                continue
+            present_size = self._present_size(number)
+            if self._buffer is None:
+                present = <const uint8_t*>PyBytes_AS_STRING(self._pending)
+            else:
+                present = (<const uint8_t*>PyByteArray_AS_STRING(self._buffer)
+                           + number * self._frame_size)
+            length ^= present_size
+            for i in range(present_size):
+                out[i] ^= present[i]
+        if length > size:
+            return 0
+        try:
+            self._add(missing, <const char*>out, length)
+        except ValueError:
+            # parity that doesn't match the frames; wait for a retransmission
+            pass
+        return 0
+
+    cdef inline Py_ssize_t _present_size(self, int frame_number):
+        if self._buffer is None:
+            return len(self._pending)
+        if frame_number == self.total_frames - 1:
+            return self._length - frame_number * self._frame_size
+        return self._frame_size
+
+    cdef inline bint _is_missing(self, int frame_number):
+        if frame_number < 0 or frame_number >= self.total_frames:
+            return False
+        return (self._missing[frame_number >> 3] >> (frame_number & 7)) & 1
+
+    cdef inline void _clear(self, int frame_number):
+        if self._is_missing(frame_number):
+            self._missing[frame_number >> 3] &= ~(1 << (frame_number & 7))
+            self._nmissing -= 1
+
+    cdef inline void _set(self, int frame_number):
+        if not self._is_missing(frame_number):
+            self._missing[frame_number >> 3] |= 1 << (frame_number & 7)
+            self._nmissing += 1
+
+    cdef bint _write(self, int frame_number, const char* payload,
+                     Py_ssize_t size):
+        cdef Py_ssize_t start
+        if size > self._frame_size or (frame_number < self.total_frames - 1
+                                       and size != self._frame_size):
+            return False
+        start = frame_number * self._frame_size
+        memcpy(PyByteArray_AS_STRING(self._buffer) + start, payload, size)
+        if frame_number == self.total_frames - 1:
+            self._length = start + size
+        return True
@@ -0,0 +1,152 @@
+from collections import OrderedDict, namedtuple
+from time import monotonic
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from .parse import (COMPRESSED, FRAME_RESPONSE, VERSION_TYPE_BYTE_POSITION,
+                    header_size_of, pack_header)
+
+
+MAX_CACHE_BYTES = 2 ** 24
+MAX_CACHE_AGE = 10  # seconds
+
+CacheEntry = namedtuple('CacheEntry', ['offset', 'length', 'frame_size',
+                                       'total_frames', 'destination',
+                                       'created', 'flags'])
+
+
+class RetransmissionCache:
+    """
+    Recently published messages, kept for answering retransmission requests.
+
+    Frame payloads are copied back to back into one preallocated ring
+    buffer, and headers are rebuilt when a frame is resent.  The cache is
+    bounded by the ring's size in bytes, by the age of its messages and,
+    optionally, by the number of messages; the oldest messages go first.
+
+    ``hits`` and ``misses`` count lookups, ``evictions`` messages pushed out
+    for space or count, and ``expirations`` messages that outlived
+    ``max_age``.
+    """
+
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES,
+                 max_age: float = MAX_CACHE_AGE,
+                 max_messages: Optional[int] = None,
+                 clock: Callable[[], float] = monotonic):
+        self._ring = bytearray(max_bytes)
+        self._view = memoryview(self._ring)
+        self._head = 0
+        self._entries = OrderedDict()
+        self._max_age = max_age
+        self._max_messages = max_messages
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, uid: int):
+        return uid in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the ring held by cached messages."""
+        return sum(entry.length for entry in self._entries.values())
+
+    def put(self, uid: int, destination: Tuple[str, int],
+            frames: Iterable[Tuple[bytes, bytes]]):
+        """
+        Copy a published message's frames into the cache.
+
+        ``frames`` are the ``(header, body)`` pairs the message was sent as.
+        Messages larger than the whole ring are not cached.
+        """
+        frames = tuple(frames)
+        header_size = header_size_of(frames[0][0])
+        length = sum(len(header) - header_size + len(body)
+                     for header, body in frames)
+        capacity = len(self._ring)
+        if length > capacity:
+            return
+
+        self._expire()
+        start = self._head
+        if start + length > capacity:
+            # wrap round, giving up the tail of the ring
+            while self._entries and self._oldest().offset >= start:
+                self._evict()
+            start = 0
+        end = start + length
+        while self._entries:
+            oldest = self._oldest()
+            if oldest.offset >= end or oldest.offset + oldest.length <= start:
+                break
+            self._evict()
+
+        # the first frame's header also holds the topic, which is part of its
+        # payload when resent
+        position = start
+        for header, body in frames:
+            prefix = len(header) - header_size
+            self._view[position:position + prefix] = header[header_size:]
+            position += prefix
+            self._view[position:position + len(body)] = body
+            position += len(body)
+        self._head = end
+
+        first_header, first_body = frames[0]
+        frame_size = len(first_header) - header_size + len(first_body)
+        flags = first_header[VERSION_TYPE_BYTE_POSITION] & COMPRESSED
+        self._entries[uid] = CacheEntry(start, length, frame_size, len(frames),
+                                        destination, self._clock(), flags)
+        if self._max_messages is not None:
+            while len(self._entries) > self._max_messages:
+                self._evict()
+
+    def lookup(self, uid: int) -> Optional[CacheEntry]:
+        """Find a cached message, counting the hit or miss."""
+        entry = self.peek(uid)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def peek(self, uid: int) -> Optional[CacheEntry]:
+        self._expire()
+        return self._entries.get(uid)
+
+    def frames(self, uid: int, entry: CacheEntry,
+               frame_numbers: Iterable[int]) -> List[Tuple[bytearray,
+                                                           memoryview]]:
+        """
+        Rebuild the requested frames of a cached message as responses.
+
+        Frame numbers beyond the message's last frame are skipped.
+        """
+        frames = []
+        for number in frame_numbers:
+            if number >= entry.total_frames:
+                continue
+            start = number * entry.frame_size
+            end = min(start + entry.frame_size, entry.length)
+            header = pack_header(FRAME_RESPONSE | entry.flags, uid, number,
+                                 entry.total_frames, end - start)
+            frames.append((header, self._view[entry.offset + start:
+                                              entry.offset + end]))
+        return frames
+
+    def _oldest(self) -> CacheEntry:
+        return next(iter(self._entries.values()))
+
+    def _evict(self):
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+    def _expire(self):
+        oldest_allowed = self._clock() - self._max_age
+        while self._entries and self._oldest().created < oldest_allowed:
+            self._entries.popitem(last=False)
+            self.expirations += 1
@@ -0,0 +1,117 @@
+"""
+Message body compression.
+
+A compressed body starts with the id of the codec that compressed it, and
+its frames are marked with the ``COMPRESSED`` flag, so subscribers
+decompress whatever codec each publisher chose.  zlib is always available;
+others are added with ``register_codec``, under the same id on every host.
+Decompression is bounded, so a small body can't expand without limit.
+"""
+import zlib
+from collections import namedtuple
+from typing import Callable, Optional, Union
+
+
+# bodies shorter than this are sent as they are
+COMPRESSION_THRESHOLD = 2 ** 9
+
+Codec = namedtuple('Codec', ['name', 'codec_id', 'compress', 'decompress'])
+
+_codecs_by_name = dict()
+_codecs_by_id = dict()
+
+
+def register_codec(name: str, codec_id: int,
+                   compress: Callable[[bytes], bytes],
+                   decompress: Callable[[bytes, Optional[int]], bytes]
+                   ) -> Codec:
+    """
+    Make a codec available to publishers and subscribers.
+
+    Parameters
+    ----------
+    name : str
+        Name publishers select the codec by.
+    codec_id : int
+        Id from 1 to 255 sent with each body the codec compresses.
+    compress : callable
+        Function from a bytes-like object to bytes.
+    decompress : callable
+        ``decompress(data, limit)`` returns the bytes ``data`` decompresses
+        to, and should raise ValueError for data it can't read or that would
+        decompress to more than ``limit`` bytes, unless ``limit`` is None.
+        It should stop decompressing once past the limit.
+    """
+    if not 1 <= codec_id <= 255:
+        raise ValueError('codec id outside supported range: '
+                         '%d not in [1, 255]' % codec_id)
+    existing = _codecs_by_id.get(codec_id)
+    if existing is not None and existing.name != name:
+        raise ValueError('codec id %d already used by %r' % (codec_id,
+                                                             existing.name))
+    codec = Codec(name, codec_id, compress, decompress)
+    previous = _codecs_by_name.pop(name, None)
+    if previous is not None:
+        del _codecs_by_id[previous.codec_id]
+    _codecs_by_name[name] = codec
+    _codecs_by_id[codec_id] = codec
+    return codec
+
+
+def get_codec(codec: Union[str, Codec]) -> Codec:
+    """Find a registered codec by name."""
+    if isinstance(codec, Codec):
+        return codec
+    try:
+        return _codecs_by_name[codec]
+    except KeyError:
+        raise ValueError('unknown codec %r' % codec) from None
+
+
+def compress(body, codec: Codec,
+             threshold: int = COMPRESSION_THRESHOLD) -> Optional[bytes]:
+    """
+    Compress a body, or return None if it isn't worth compressing.
+
+    Bodies shorter than ``threshold`` are left alone, as are those that
+    don't get any shorter.
+    """
+    if len(body) < threshold:
+        return None
+    compressed = codec.compress(body)
+    if len(compressed) + 1 >= len(body):
+        return None
+    return bytes((codec.codec_id,)) + compressed
+
+
+def decompress(body, limit: int = None) -> bytes:
+    """
+    Decompress a body compressed by ``compress``.
+
+    Raises ValueError if the codec is unknown, the body can't be read or it
+    decompresses to more than ``limit`` bytes.
+    """
+    if not len(body):
+        raise ValueError('compressed body is empty')
+    codec = _codecs_by_id.get(body[0])
+    if codec is None:
+        raise ValueError('unknown codec id %d' % body[0])
+    try:
+        return codec.decompress(memoryview(body)[1:], limit)
+    except zlib.error as exc:
+        raise ValueError(str(exc)) from None
+
+
+def _zlib_decompress(data, limit: int = None) -> bytes:
+    # ask for a byte more than the limit, to tell a body that just fits from
+    # one that would go on
+    decompressor = zlib.decompressobj()
+    body = decompressor.decompress(data, 0 if limit is None else limit + 1)
+    if limit is not None and len(body) > limit:
+        raise ValueError('decompresses to more than %d bytes' % limit)
+    if not decompressor.eof:
+        raise ValueError('incomplete or truncated stream')
+    return body
+
+
+ZLIB = register_codec('zlib', 1, zlib.compress, _zlib_decompress)
@@ -0,0 +1,106 @@
+from array import array
+
+
+DUPLICATE_WINDOW = 2 ** 18
+
+# Fibonacci hashing spreads sequential and clustered uids over the index
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_UINT64_MASK = 2 ** 64 - 1
+
+
+class DuplicateFilter:
+    """
+    Sliding window over the most recently seen 64-bit message uids.
+
+    The uids are kept in a fixed ring, oldest overwritten first, and found
+    through an open-addressing index with linear probing that holds ring
+    positions.  The index has at least twice as many slots as the ring, so
+    probe sequences stay short however full the window is, and removals
+    shift later entries back rather than leaving tombstones.  Membership
+    tests and additions therefore cost the same at any window size.  The
+    index is rounded up to a power of two, so the window takes 16 bytes per
+    uid for a power-of-two capacity and up to 24 otherwise.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of uids remembered.
+    """
+
+    def __init__(self, capacity: int = DUPLICATE_WINDOW):
+        if capacity < 1:
+            raise ValueError('duplicate window must hold at least one uid')
+        self._ring = array('Q', bytes(8 * capacity))
+        self._size = 0
+        self._head = 0
+        index_bits = max((2 * capacity - 1).bit_length(), 1)
+        self._shift = 64 - index_bits
+        self._mask = (1 << index_bits) - 1
+        # ring position + 1 for each occupied slot, 0 for an empty one
+        self._index = array('I', bytes(4 << index_bits))
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, uid: int):
+        return self._find(uid) is not None
+
+    @property
+    def capacity(self) -> int:
+        return len(self._ring)
+
+    def add(self, uid: int):
+        """
+        Remember a uid, forgetting the oldest if the window is full.
+        """
+        if self._find(uid) is not None:
+            return
+        head = self._head
+        if self._size == len(self._ring):
+            self._remove(self._find(self._ring[head]))
+        else:
+            self._size += 1
+        self._ring[head] = uid
+
+        index = self._index
+        mask = self._mask
+        slot = self._slot(uid)
+        while index[slot]:
+            slot = (slot + 1) & mask
+        index[slot] = head + 1
+        self._head = (head + 1) % len(self._ring)
+
+    def _slot(self, uid: int) -> int:
+        return ((uid * _MULTIPLIER) & _UINT64_MASK) >> self._shift
+
+    def _find(self, uid: int):
+        index = self._index
+        ring = self._ring
+        mask = self._mask
+        slot = self._slot(uid)
+        position = index[slot]
+        while position:
+            if ring[position - 1] == uid:
+                return slot
+            slot = (slot + 1) & mask
+            position = index[slot]
+        return None
+
+    def _remove(self, slot: int):
+        # backward-shift deletion: pull later entries of the probe run into
+        # the hole wherever that doesn't move them before their home slot
+        index = self._index
+        ring = self._ring
+        mask = self._mask
+        index[slot] = 0
+        hole = slot
+        slot = (slot + 1) & mask
+        position = index[slot]
+        while position:
+            home = self._slot(ring[position - 1])
+            if (slot - home) & mask >= (slot - hole) & mask:
+                index[hole] = position
+                index[slot] = 0
+                hole = slot
+            slot = (slot + 1) & mask
+            position = index[slot]
@@ -0,0 +1,162 @@
+from asyncio import (CancelledError, get_event_loop, iscoroutinefunction,
+                     sleep)
+from collections import deque, namedtuple
+from concurrent.futures import Executor
+from logging import getLogger
+from time import perf_counter
+from typing import Callable, Iterable
+
+from .stats import Stats
+
+
+MAX_QUEUE_SIZE = 2 ** 10
+
+# what to do with a message that finds its topic's queue full
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+# keep only the latest message of the topic, whatever the queue size
+CONFLATE = 'conflate'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, CONFLATE)
+
+QueueStats = namedtuple('QueueStats', ['depth', 'delivered', 'dropped'])
+
+
+class _TopicQueue:
+    __slots__ = ('messages', 'max_size', 'policy', 'delivered', 'dropped',
+                 'task')
+
+    def __init__(self, max_size: int, policy: str):
+        self.messages = deque()
+        self.max_size = max_size
+        self.policy = policy
+        self.delivered = 0
+        self.dropped = 0
+        self.task = None
+
+    def put(self, message):
+        messages = self.messages
+        if self.policy == CONFLATE:
+            self.dropped += len(messages)
+            messages.clear()
+        elif len(messages) >= self.max_size:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return
+            messages.popleft()
+        messages.append(message)
+
+
+def _check_policy(max_size: int, policy: str):
+    if policy not in OVERFLOW_POLICIES:
+        raise ValueError('unknown overflow policy %r' % policy)
+    if max_size < 1:
+        raise ValueError('queue size must be at least 1')
+
+
+class Dispatcher:
+    """
+    Delivers received messages to callbacks off the receive path.
+
+    Each topic has a bounded queue of messages waiting for its callbacks,
+    emptied by a task that runs only while messages are queued, so callbacks
+    never delay reading the socket and a slow topic only holds up itself.
+    Messages of a topic are delivered in order.  When a message finds its
+    topic's queue full, the overflow policy drops the oldest queued message
+    or the new one, or conflates the queue to the newest message.
+
+    Callbacks may be plain functions, which are called on the loop or, given
+    an ``executor``, run in it, or coroutine functions, which are awaited.
+    The time each call takes, awaiting included, is recorded in
+    ``stats.callback_time``.
+    """
+
+    def __init__(self, loop=None, max_queue_size: int = None,
+                 overflow_policy: str = None, executor: Executor = None,
+                 stats: Stats = None):
+        self.loop = get_event_loop() if loop is None else loop
+        self.log = getLogger(__name__)
+        self.max_queue_size = (MAX_QUEUE_SIZE if max_queue_size is None else
+                               max_queue_size)
+        self.overflow_policy = (DROP_OLDEST if overflow_policy is None else
+                                overflow_policy)
+        _check_policy(self.max_queue_size, self.overflow_policy)
+        self.executor = executor
+        self.stats = Stats() if stats is None else stats
+        self._queues = dict()
+
+    def configure(self, topic: str, max_queue_size: int = None,
+                  overflow_policy: str = None):
+        """Set a topic's queue size and overflow policy."""
+        queue = self._queue(topic)
+        max_size = (queue.max_size if max_queue_size is None else
+                    max_queue_size)
+        policy = queue.policy if overflow_policy is None else overflow_policy
+        _check_policy(max_size, policy)
+        queue.max_size = max_size
+        queue.policy = policy
+
+    def dispatch(self, topic: str, message: bytes,
+                 callbacks: Iterable[Callable]):
+        """Queue a message for a topic's callbacks."""
+        queue = self._queue(topic)
+        queue.put((message, tuple(callbacks)))
+        if queue.task is None:
+            queue.task = self.loop.create_task(self._deliver(topic, queue))
+
+    def queue_stats(self, topic: str) -> QueueStats:
+        """Queue depth and counts of delivered and dropped messages."""
+        queue = self._queues.get(topic)
+        if queue is None:
+            return QueueStats(0, 0, 0)
+        return QueueStats(len(queue.messages), queue.delivered, queue.dropped)
+
+    def discard(self, topic: str):
+        """Forget a topic, dropping any messages still queued for it."""
+        queue = self._queues.pop(topic, None)
+        if queue is not None and queue.task is not None:
+            queue.task.cancel()
+
+    async def close(self):
+        """Stop delivering, dropping queued messages."""
+        tasks = [queue.task for queue in self._queues.values()
+                 if queue.task is not None]
+        self._queues.clear()
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except CancelledError:
+                pass
+
+    def _queue(self, topic: str) -> _TopicQueue:
+        queue = self._queues.get(topic)
+        if queue is None:
+            queue = self._queues[topic] = _TopicQueue(self.max_queue_size,
+                                                      self.overflow_policy)
+        return queue
+
+    async def _deliver(self, topic: str, queue: _TopicQueue):
+        try:
+            while queue.messages:
+                message, callbacks = queue.messages.popleft()
+                for callback in callbacks:
+                    start = perf_counter()
+                    try:
+                        if iscoroutinefunction(callback):
+                            await callback(topic, message)
+                        elif self.executor is not None:
+                            await self.loop.run_in_executor(
+                                self.executor, callback, topic, message)
+                        else:
+                            callback(topic, message)
+                    except CancelledError:
+                        raise
+                    except Exception:
+                        self.log.exception("error in '%s' callback", topic)
+                    self.stats.callback_time.record(perf_counter() - start)
+                queue.delivered += 1
+                # let the loop read the socket between messages
+                await sleep(0)
+        finally:
+            queue.task = None
@@ -1,35 +1,122 @@
 from asyncio import CancelledError, Task, get_event_loop
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from functools import partial
 from ipaddress import IPv4Network
-from itertools import islice
 from logging import getLogger
-from typing import Callable
+from typing import Callable, Iterable, Tuple, Union
 
+from .dispatch import Dispatcher, QueueStats
 from .exceptions import NotConnectedError, NotSubscribedError
 from .hash import hash_v1
+from .local import get_bus
 from .publish import PublishProtocol, create_publish_socket
-from .subscribe import SubscribeProtocol, create_subscribe_socket
+from .stats import Stats
+from .stream import MessageStream
+from .subscribe import Chunk, SubscribeProtocol, create_subscribe_socket
 
 
-def _nth(it, n):
-    return next(islice(it, n, None))
+MAX_DESTINATION_CACHE_SIZE = 2 ** 12
+
+
+def count_bins(network: IPv4Network) -> int:
+    """
+    Number of hash bins of a network, one per address of ``hosts()``.
+
+    The network and broadcast addresses are left out, except in /31 and /32
+    networks, whose every address is a host.
+    """
+    if network.prefixlen >= network.max_prefixlen - 1:
+        return network.num_addresses
+    return network.num_addresses - 2
+
+
+def address_of_bin(network: IPv4Network, address_bin: int) -> str:
+    """
+    Compute the multicast group address a hash bin maps to.
+
+    Bins are numbered over the usable host addresses of the network, so bin
+    ``n`` is the network address offset by ``n + 1``, or by ``n`` in /31
+    and /32 networks.  This is equivalent to taking the ``n``-th element of
+    ``network.hosts()`` without walking it.
+
+    Parameters
+    ----------
+    network : IPv4Network
+        Multicast network the bins are spread over.
+    address_bin : int
+        Bin index from 0 to ``count_bins(network) - 1``.
+
+    Returns
+    -------
+    str
+        Dotted-quad address of the group for the bin.
+
+    Raises
+    ------
+    ValueError
+        If the bin is outside the network.
+    """
+    nbins = count_bins(network)
+    if not 0 <= address_bin < nbins:
+        raise ValueError('bin %d outside the %d bins of %s'
+                         % (address_bin, nbins, network))
+    offset = 0 if nbins == network.num_addresses else 1
+    return str(network.network_address + (address_bin + offset))
 
 
 class Interface:
 
     def __init__(self, network: IPv4Network, port: int, timeout=None,
-                 max_cache_size=None, time_to_live=None, loop=None):
+                 max_cache_size=None, time_to_live=None,
+                 max_destination_cache_size=None, max_datagram_size=None,
+                 repair_delay=None, nack_jitter=None, drop_callback=None,
+                 max_incomplete_messages=None, max_incomplete_bytes=None,
+                 max_request_rounds=None, max_cache_bytes=None,
+                 max_cache_age=None, duplicate_window=None,
+                 batch_receive=False, max_queue_size=None,
+                 overflow_policy=None, executor=None, pacing_rate=None,
+                 pacing_packet_rate=None, fec_block_size=None,
+                 compression=None, compression_threshold=None,
+                 local_delivery=True, loop=None):
         self._loop = get_event_loop() if loop is None else loop
         self._log = getLogger(__name__)
         self._net = network
         self._port = port
         self._timeout = timeout
         self._max_cache_size = max_cache_size
+        self._max_cache_bytes = max_cache_bytes
+        self._max_cache_age = max_cache_age
         self._ttl = time_to_live
+        self._max_datagram_size = max_datagram_size
+        self._repair_delay = repair_delay
+        self._nack_jitter = nack_jitter
+        self._drop_callback = drop_callback
+        self._max_incomplete_messages = max_incomplete_messages
+        self._max_incomplete_bytes = max_incomplete_bytes
+        self._max_request_rounds = max_request_rounds
+        self._duplicate_window = duplicate_window
+        self._batch_receive = batch_receive
+        self._pacing_rate = pacing_rate
+        self._pacing_packet_rate = pacing_packet_rate
+        self._fec_block_size = fec_block_size
+        self._compression = compression
+        self._compression_threshold = compression_threshold
         self._nbins = self._calculate_nbins()
+        # topic -> (address, port) of its group, bounded least-recently-used
+        self._destinations = OrderedDict()
+        self._max_destinations = (MAX_DESTINATION_CACHE_SIZE
+                                  if max_destination_cache_size is None else
+                                  max_destination_cache_size)
         self._startup_tasks = set()
         self._subscriptions = defaultdict(set)
         self._topic_callbacks = defaultdict(list)
+        self._topic_chunk_callbacks = defaultdict(list)
+        self._topic_streams = defaultdict(set)
+        # counters and histograms of the protocols and dispatcher
+        self.stats = Stats()
+        # callbacks run from per-topic queues, never from the receive path
+        self._dispatcher = Dispatcher(self._loop, max_queue_size,
+                                      overflow_policy, executor, self.stats)
         # setup the publish protocol
         self._publish_protocol: PublishProtocol = None
         self._startup_tasks.add(
@@ -41,7 +128,17 @@ class Interface:
 
         self._hash = hash_v1
 
+        # messages published in this process skip the network on their way
+        # to interfaces on the same network, port and event loop
+        self._bus = None
+        if local_delivery:
+            self._bus = get_bus(network, port)
+            self._bus.join(self._loop, self._local_message)
+
     async def terminate(self):
+        if self._bus is not None:
+            self._bus.leave(self._loop, self._local_message)
+            self._bus = None
         if self._startup_tasks:
             tasks = self._startup_tasks.copy()
             for task in tasks:
@@ -51,9 +148,26 @@ class Interface:
             self._publish_protocol.close()
         if self._subscribe_protocol is not None:
             self._subscribe_protocol.close()
+        await self._dispatcher.close()
+        for stream in {stream for streams in self._topic_streams.values()
+                       for stream in streams}:
+            stream.close()
+
+    async def subscribe(self, topic: str, callback: Callable,
+                        max_queue_size: int = None,
+                        overflow_policy: str = None):
+        """
+        Subscribe a callback to a topic.
 
-    async def subscribe(self, topic: str,
-                        callback: Callable[[str, bytes], None]):
+        The callback is called with the topic and message, from the topic's
+        queue rather than as the message is received, and may be a coroutine
+        function.  The queue's size and overflow policy default to the
+        interface's.
+
+        Messages from the network are passed as a ``bytearray``, and those
+        published locally as the object published, with ``str`` messages
+        encoded as UTF-8 as they are on the wire.
+        """
         if self._startup_tasks:
             tasks = self._startup_tasks.copy()
             for task in tasks:
@@ -62,8 +176,33 @@ class Interface:
         if self._subscribe_protocol is None:
             raise NotConnectedError
 
+        if max_queue_size is not None or overflow_policy is not None:
+            self._dispatcher.configure(topic, max_queue_size, overflow_policy)
         self._add_subscription(topic, callback)
 
+    async def subscribe_chunks(self, topic: str,
+                               callback: Callable[[str, Chunk], None]):
+        """
+        Subscribe a callback to chunks of a topic's largest messages.
+
+        Messages of more than ``MAX_FRAMES`` frames are passed to
+        ``callback(topic, chunk)`` a ``Chunk`` at a time, each as soon as
+        every byte before it has arrived, rather than whole to the topic's
+        other callbacks and streams.  Chunks are passed on straight from the
+        receive path, to keep them in order, so the callback must not block.
+        A message may be dropped after some of its chunks were passed on.
+        """
+        if self._startup_tasks:
+            tasks = self._startup_tasks.copy()
+            for task in tasks:
+                await task
+
+        if self._subscribe_protocol is None:
+            raise NotConnectedError
+
+        self._join_group(topic)
+        self._topic_chunk_callbacks[topic].append(callback)
+
     async def unsubscribe(self, topic: str):
         if self._startup_tasks:
             tasks = self._startup_tasks.copy()
@@ -75,7 +214,41 @@ class Interface:
 
         self._remove_subscription(topic)
 
+    async def stream(self, topics: Union[str, Iterable[str]],
+                     maxsize: int = None, policy: str = None
+                     ) -> MessageStream:
+        """
+        Subscribe to one or more topics as a stream of messages.
+
+        The stream holds up to ``maxsize`` unread messages, applying the
+        overflow ``policy`` beyond that, and is unsubscribed when closed.
+        """
+        if self._startup_tasks:
+            tasks = self._startup_tasks.copy()
+            for task in tasks:
+                await task
+
+        if self._subscribe_protocol is None:
+            raise NotConnectedError
+
+        topics = {topics} if isinstance(topics, str) else set(topics)
+        stream = MessageStream(maxsize, policy, loop=self._loop,
+                               on_close=partial(self._close_stream, topics))
+        for topic in topics:
+            self._join_group(topic)
+            self._topic_streams[topic].add(stream)
+        return stream
+
     async def publish(self, topic: str, message: bytes):
+        """
+        Publish a message to a topic.
+
+        Subscribers of interfaces on the same network and port, in this
+        process and on this event loop, are given the message object itself
+        rather than a copy from the network, so it must not be changed
+        afterwards.  A ``str`` message is encoded as UTF-8 for them, as it
+        is for the network.
+        """
         if self._startup_tasks:
             tasks = self._startup_tasks.copy()
             for task in tasks:
@@ -84,49 +257,182 @@ class Interface:
         if self._publish_protocol is None:
             raise NotConnectedError
 
-        address_bin = self._hash(topic, self._nbins)
-        address = self._get_address_of_bin(address_bin)
-        self._publish_protocol.publish((address, self._port), topic, message)
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        uid, streamed = self._publish_protocol.publish(
+            self._get_destination(topic), topic, message)
+        if self._bus is not None:
+            self._bus.deliver(self._loop, uid, topic, message, streamed)
+
+    async def publish_many(self, messages: Iterable[Tuple[str, bytes]]):
+        if self._startup_tasks:
+            tasks = self._startup_tasks.copy()
+            for task in tasks:
+                await task
+
+        if self._publish_protocol is None:
+            raise NotConnectedError
+
+        messages = [(self._get_destination(topic), topic,
+                     message.encode('utf-8') if isinstance(message, str)
+                     else message)
+                    for topic, message in messages]
+        published = self._publish_protocol.publish_batch(messages)
+        if self._bus is not None:
+            for (uid, streamed), (_, topic, message) in zip(published,
+                                                            messages):
+                self._bus.deliver(self._loop, uid, topic, message, streamed)
+
+    async def set_fec_block_size(self, topic: str, block_size: int = None):
+        """
+        Send a parity frame per ``block_size`` frames of a topic's messages.
+
+        A ``block_size`` of 0 sends the topic without parity, and None
+        returns it to the interface's block size.
+        """
+        if self._startup_tasks:
+            tasks = self._startup_tasks.copy()
+            for task in tasks:
+                await task
+
+        if self._publish_protocol is None:
+            raise NotConnectedError
+
+        self._publish_protocol.set_fec_block_size(topic, block_size)
+
+    async def set_compression(self, topic: str, codec=None,
+                              threshold: int = None):
+        """
+        Compress a topic's messages of at least ``threshold`` bytes.
+
+        ``codec`` is the name of a registered codec, False to send the topic
+        uncompressed, or None for the interface's codec, and ``threshold``
+        None for the interface's.
+        """
+        if self._startup_tasks:
+            tasks = self._startup_tasks.copy()
+            for task in tasks:
+                await task
+
+        if self._publish_protocol is None:
+            raise NotConnectedError
+
+        self._publish_protocol.set_compression(topic, codec, threshold)
+
+    def stats_snapshot(self) -> dict:
+        """
+        Counters, gauges and latency histograms of the interface.
+
+        Counters only grow, for export as rates; ``stats.reset`` zeroes
+        them.  ``stats.set_profiler`` times a sample of received frames and
+        published messages.
+        """
+        return self.stats.snapshot()
+
+    def queue_stats(self, topic: str) -> QueueStats:
+        """Depth and delivered and dropped counts of a topic's queue."""
+        return self._dispatcher.queue_stats(topic)
 
     def _add_subscription(self, topic: str,
                           callback: Callable[[str, bytes], None]):
-        address_bin = self._hash(topic, self._nbins)
-        address = self._get_address_of_bin(address_bin)
-
-        if address not in self._subscriptions:
-            self._subscribe_protocol.subscribe(address)
-        self._subscriptions[address].add(topic)
+        self._join_group(topic)
         self._topic_callbacks[topic].append(callback)
 
     def _remove_subscription(self, topic: str):
-        address_bin = self._hash(topic, self._nbins)
-        address = self._get_address_of_bin(address_bin)
+        if (topic not in self._topic_callbacks and
+                topic not in self._topic_chunk_callbacks):
+            raise NotSubscribedError
+
+        self._topic_callbacks.pop(topic, None)
+        self._topic_chunk_callbacks.pop(topic, None)
+        self._dispatcher.discard(topic)
+        self._leave_group(topic)
+
+    def _close_stream(self, topics, stream: MessageStream):
+        for topic in topics:
+            streams = self._topic_streams[topic]
+            streams.discard(stream)
+            if not streams:
+                del self._topic_streams[topic]
+            self._leave_group(topic)
+
+    def _join_group(self, topic: str):
+        if not self._is_subscribed(topic):
+            # the filter rejected the topic's messages until now
+            self._subscribe_protocol.forget_ignored()
+        address, _ = self._get_destination(topic)
 
         if address not in self._subscriptions:
-            raise NotSubscribedError
-        if topic not in self._subscriptions[address]:
-            raise NotSubscribedError
+            self._subscribe_protocol.subscribe(address)
+        self._subscriptions[address].add(topic)
 
-        self._subscriptions[address].remove(topic)
-        self._topic_callbacks.pop(topic)
+    def _leave_group(self, topic: str):
+        # only once the topic has neither callbacks nor streams left
+        if self._is_subscribed(topic):
+            return
+        address, _ = self._get_destination(topic)
+
+        self._subscriptions[address].discard(topic)
         if not self._subscriptions[address]:
             self._subscribe_protocol.unsubscribe(address)
             self._subscriptions.pop(address)
 
     def _calculate_nbins(self):
-        # Remove network and broadcast addresses from count.
-        return self._net.num_addresses - 2
+        return count_bins(self._net)
 
     def _get_address_of_bin(self, address_bin):
-        return str(_nth(self._net.hosts(), address_bin))
+        return address_of_bin(self._net, address_bin)
+
+    def _get_destination(self, topic: str):
+        try:
+            destination = self._destinations[topic]
+        except KeyError:
+            address_bin = self._hash(topic, self._nbins)
+            destination = (self._get_address_of_bin(address_bin), self._port)
+            self._destinations[topic] = destination
+            while len(self._destinations) > self._max_destinations:
+                self._destinations.popitem(last=False)
+        else:
+            self._destinations.move_to_end(topic)
+        return destination
+
+    def _is_subscribed(self, topic: str) -> bool:
+        return (topic in self._topic_callbacks or
+                topic in self._topic_streams or
+                topic in self._topic_chunk_callbacks)
+
+    def _wants_chunks(self, topic: str) -> bool:
+        return topic in self._topic_chunk_callbacks
 
     def _message_callback(self, topic: str, message: bytes):
-        if topic not in self._topic_callbacks:
+        if not self._is_subscribed(topic):
             self._log.debug("received '%s' message with no callbacks", topic)
             return
 
-        for callback in self._topic_callbacks[topic]:
-            callback(topic, message)
+        # streams are bounded queues of their own
+        for stream in self._topic_streams.get(topic, ()):
+            stream.put(topic, message)
+        if topic in self._topic_callbacks:
+            self._dispatcher.dispatch(topic, message,
+                                      self._topic_callbacks[topic])
+
+    def _local_message(self, uid: int, topic: str, message, streamed: bool):
+        if self._subscribe_protocol is None:
+            return
+        # its frames are on their way back by multicast loopback
+        self._subscribe_protocol.skip_message(uid)
+        self.stats.local_messages += 1
+        if streamed and topic in self._topic_chunk_callbacks:
+            self._chunk_callback(topic, Chunk(uid, 0, message, True))
+        else:
+            self._message_callback(topic, message)
+
+    def _chunk_callback(self, topic: str, chunk: Chunk):
+        for callback in self._topic_chunk_callbacks.get(topic, ()):
+            try:
+                callback(topic, chunk)
+            except Exception:
+                self._log.exception("error in '%s' chunk callback", topic)
 
     async def _setup_publish_protocol(self):
         local_address = ('0.0.0.0', 0)
@@ -134,7 +440,17 @@ class Interface:
             self._publish_protocol = await create_publish_socket(
                 local_address, loop=self._loop,
                 max_cache_size=self._max_cache_size,
-                time_to_live=self._ttl)
+                time_to_live=self._ttl,
+                max_datagram_size=self._max_datagram_size,
+                repair_delay=self._repair_delay,
+                max_cache_bytes=self._max_cache_bytes,
+                max_cache_age=self._max_cache_age,
+                pacing_rate=self._pacing_rate,
+                pacing_packet_rate=self._pacing_packet_rate,
+                fec_block_size=self._fec_block_size,
+                compression=self._compression,
+                compression_threshold=self._compression_threshold,
+                stats=self.stats)
         except CancelledError:
             pass
 
@@ -145,7 +461,19 @@ class Interface:
         try:
             self._subscribe_protocol = await create_subscribe_socket(
                 local_address, loop=self._loop, timeout=self._timeout,
-                message_callback=self._message_callback)
+                message_callback=self._message_callback,
+                max_datagram_size=self._max_datagram_size,
+                nack_jitter=self._nack_jitter,
+                drop_callback=self._drop_callback,
+                max_incomplete_messages=self._max_incomplete_messages,
+                max_incomplete_bytes=self._max_incomplete_bytes,
+                max_request_rounds=self._max_request_rounds,
+                duplicate_window=self._duplicate_window,
+                topic_filter=self._is_subscribed,
+                batch_receive=self._batch_receive,
+                chunk_callback=self._chunk_callback,
+                chunk_filter=self._wants_chunks,
+                stats=self.stats)
         except CancelledError:
             pass
 
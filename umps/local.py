@@ -0,0 +1,60 @@
+"""
+In-process delivery between interfaces.
+
+Interfaces on the same network and port in one process share a
+``LocalBus``, through which every message one of them publishes is handed,
+as the very object published, to each member running on the publisher's
+event loop.  The members then ignore the message's own frames when
+multicast loopback brings them back.  Members on other event loops still
+receive messages from the network.
+"""
+from collections import defaultdict
+from typing import Callable, Hashable, Tuple
+
+
+# (network, port) -> bus of the interfaces on it
+_buses = dict()
+
+
+class LocalBus:
+    """Interfaces of one network and port, by event loop."""
+
+    def __init__(self, key: Tuple[Hashable, int]):
+        self.key = key
+        # event loop -> callbacks of the members running on it
+        self._members = defaultdict(list)
+
+    def __len__(self):
+        return sum(len(members) for members in self._members.values())
+
+    def join(self, loop, callback: Callable[[int, str, object, bool], None]):
+        """
+        Add a member, called as ``callback(uid, topic, message, streamed)``
+        for each message published on ``loop`` by any member, itself
+        included.  ``streamed`` is whether the message is too long to be
+        sent whole.
+        """
+        self._members[loop].append(callback)
+
+    def leave(self, loop, callback: Callable[[int, str, object, bool], None]):
+        members = self._members.get(loop)
+        if members is None or callback not in members:
+            return
+        members.remove(callback)
+        if not members:
+            del self._members[loop]
+        if not self._members and _buses.get(self.key) is self:
+            del _buses[self.key]
+
+    def deliver(self, loop, uid: int, topic: str, message, streamed: bool):
+        for callback in tuple(self._members.get(loop, ())):
+            callback(uid, topic, message, streamed)
+
+
+def get_bus(network, port: int) -> LocalBus:
+    """Find the bus of a network and port, creating it if need be."""
+    key = (network, port)
+    bus = _buses.get(key)
+    if bus is None:
+        bus = _buses[key] = LocalBus(key)
+    return bus
@@ -0,0 +1,254 @@
+"""
+Batched datagram system calls.
+
+The ``socket`` module sends and receives one datagram per call.  On Linux,
+``sendmmsg(2)`` and ``recvmmsg(2)`` hand the kernel a whole batch of
+datagrams at once; they are reached through ctypes here, and
+``HAVE_SENDMMSG`` and ``HAVE_RECVMMSG`` are false wherever they are
+unavailable so callers can fall back to a plain ``sendto`` or
+``recvfrom_into`` loop.
+"""
+import ctypes
+import sys
+from errno import EAGAIN, EINTR, EWOULDBLOCK
+from os import strerror
+from socket import AF_INET, htons, inet_aton, inet_ntoa, ntohs
+from typing import Sequence, Tuple
+
+
+# the kernel rejects larger batches (UIO_MAXIOV)
+MAX_BATCH_SIZE = 1024
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_uint8 * 4),
+                ('sin_zero', ctypes.c_uint8 * 8)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+class _PyBuffer(ctypes.Structure):
+    _fields_ = [('buf', ctypes.c_void_p),
+                ('obj', ctypes.c_void_p),
+                ('len', ctypes.c_ssize_t),
+                ('itemsize', ctypes.c_ssize_t),
+                ('readonly', ctypes.c_int),
+                ('ndim', ctypes.c_int),
+                ('format', ctypes.c_char_p),
+                ('shape', ctypes.c_void_p),
+                ('strides', ctypes.c_void_p),
+                ('suboffsets', ctypes.c_void_p),
+                ('internal', ctypes.c_void_p)]
+
+
+_MSG_DONTWAIT = 0x40
+
+_sendmmsg = None
+_recvmmsg = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _sendmmsg = _libc.sendmmsg
+        _sendmmsg.argtypes = (ctypes.c_int, ctypes.POINTER(_MMsgHdr),
+                              ctypes.c_uint, ctypes.c_int)
+        _sendmmsg.restype = ctypes.c_int
+        _recvmmsg = _libc.recvmmsg
+        _recvmmsg.argtypes = (ctypes.c_int, ctypes.POINTER(_MMsgHdr),
+                              ctypes.c_uint, ctypes.c_int, ctypes.c_void_p)
+        _recvmmsg.restype = ctypes.c_int
+        _get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+        _get_buffer.argtypes = (ctypes.py_object, ctypes.POINTER(_PyBuffer),
+                                ctypes.c_int)
+        _release_buffer = ctypes.pythonapi.PyBuffer_Release
+        _release_buffer.argtypes = (ctypes.POINTER(_PyBuffer),)
+    except (AttributeError, OSError):
+        _sendmmsg = None
+        _recvmmsg = None
+
+HAVE_SENDMMSG = _sendmmsg is not None
+HAVE_RECVMMSG = _recvmmsg is not None
+
+
+def _sockaddr(address: Tuple[str, int]) -> _SockAddrIn:
+    host, port = address
+    return _SockAddrIn(AF_INET, htons(port),
+                       (ctypes.c_uint8 * 4)(*inet_aton(host)))
+
+
+def _fill_iovec(iov: _IOVec, buf, exports: list):
+    size = len(buf)
+    iov.iov_len = size
+    if not size:
+        return
+    if isinstance(buf, bytes):
+        iov.iov_base = ctypes.cast(buf, ctypes.c_void_p).value
+        exports.append(buf)
+    elif isinstance(buf, bytearray):
+        exports.append(ctypes.c_char.from_buffer(buf))
+        iov.iov_base = ctypes.addressof(exports[-1])
+    else:
+        # read-only views can't go through from_buffer(), so borrow the
+        # buffer through the C API and release it after the call
+        view = _PyBuffer()
+        _get_buffer(buf, ctypes.byref(view), 0)
+        exports.append(view)
+        iov.iov_base = view.buf
+        iov.iov_len = view.len
+
+
+def sendmmsg(fileno: int,
+             datagrams: Sequence[Tuple[Sequence, Tuple[str, int]]]) -> int:
+    """
+    Send a batch of datagrams with a single ``sendmmsg`` call.
+
+    Parameters
+    ----------
+    fileno : int
+        File descriptor of a non-blocking IPv4 UDP socket.
+    datagrams : sequence of (buffers, address)
+        Each datagram is the sequence of bytes-like buffers that are gathered
+        into it, with the ``(host, port)`` it is sent to.  At most
+        ``MAX_BATCH_SIZE`` datagrams are sent.
+
+    Returns
+    -------
+    int
+        Number of datagrams the kernel accepted from the front of the batch;
+        0 if the socket would block.
+    """
+    count = min(len(datagrams), MAX_BATCH_SIZE)
+    msgs = (_MMsgHdr * count)()
+    names = dict()
+    keep = []
+    exports = []
+    try:
+        for i in range(count):
+            buffers, address = datagrams[i]
+            name = names.get(address)
+            if name is None:
+                name = names[address] = _sockaddr(address)
+            iov = (_IOVec * len(buffers))()
+            for j, buf in enumerate(buffers):
+                _fill_iovec(iov[j], buf, exports)
+            keep.append(iov)
+            hdr = msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(name)
+            hdr.msg_namelen = ctypes.sizeof(name)
+            hdr.msg_iov = iov
+            hdr.msg_iovlen = len(buffers)
+
+        sent = _sendmmsg(fileno, msgs, count, 0)
+    finally:
+        for export in exports:
+            if isinstance(export, _PyBuffer):
+                _release_buffer(ctypes.byref(export))
+
+    if sent < 0:
+        err = ctypes.get_errno()
+        if err in (EAGAIN, EWOULDBLOCK, EINTR):
+            return 0
+        raise OSError(err, strerror(err))
+    return sent
+
+
+class ReceiveBuffers:
+    """
+    Preallocated slots that a batch of datagrams is received into.
+
+    ``recvmmsg`` fills the slots in place; the datagrams are returned as
+    views of them, so they are only valid until the next batch is received.
+
+    Parameters
+    ----------
+    count : int
+        Most datagrams received at once, up to ``MAX_BATCH_SIZE``.
+    size : int
+        Size of each slot.  Longer datagrams are truncated to it.
+    """
+
+    def __init__(self, count: int, size: int):
+        count = min(count, MAX_BATCH_SIZE)
+        self.size = size
+        self.pool = bytearray(count * size)
+        self.view = memoryview(self.pool)
+        self._msgs = (_MMsgHdr * count)()
+        self._names = (_SockAddrIn * count)()
+        self._iovs = (_IOVec * count)()
+        self._addresses = dict()
+        self._base = ctypes.c_char.from_buffer(self.pool)
+        base = ctypes.addressof(self._base)
+        for i in range(count):
+            self._iovs[i].iov_base = base + i * size
+            self._iovs[i].iov_len = size
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._names[i])
+            hdr.msg_iov = ctypes.pointer(self._iovs[i])
+            hdr.msg_iovlen = 1
+
+    def __len__(self):
+        return len(self._msgs)
+
+    def recvmmsg(self, fileno: int) -> list:
+        """
+        Receive a batch of datagrams with a single ``recvmmsg`` call.
+
+        Parameters
+        ----------
+        fileno : int
+            File descriptor of an IPv4 UDP socket.
+
+        Returns
+        -------
+        list of (memoryview, address)
+            The datagrams received, oldest first, with the ``(host, port)``
+            each came from; empty if none were waiting.
+        """
+        namelen = ctypes.sizeof(_SockAddrIn)
+        for msg in self._msgs:
+            msg.msg_hdr.msg_namelen = namelen
+        received = _recvmmsg(fileno, self._msgs, len(self._msgs),
+                             _MSG_DONTWAIT, None)
+        if received < 0:
+            err = ctypes.get_errno()
+            if err in (EAGAIN, EWOULDBLOCK, EINTR):
+                return []
+            raise OSError(err, strerror(err))
+
+        datagrams = []
+        size = self.size
+        for i in range(received):
+            start = i * size
+            datagrams.append((self.view[start:start + self._msgs[i].msg_len],
+                              self._address(self._names[i])))
+        return datagrams
+
+    def _address(self, name: _SockAddrIn) -> Tuple[str, int]:
+        # few sources send to a subscriber, so remember their addresses
+        key = (bytes(name.sin_addr), name.sin_port)
+        address = self._addresses.get(key)
+        if address is None:
+            if len(self._addresses) >= MAX_BATCH_SIZE:
+                self._addresses.clear()
+            address = self._addresses[key] = (inet_ntoa(key[0]),
+                                              ntohs(name.sin_port))
+        return address
@@ -0,0 +1,191 @@
+from collections import deque
+from logging import getLogger
+from typing import Callable, List, Sequence, Tuple
+
+
+# largest burst the buckets allow, in bytes and in datagrams
+PACING_BURST = 2 ** 15
+PACING_PACKET_BURST = 32
+# seconds between adjustments of the rate to the retransmission requests
+ADAPT_INTERVAL = 0.1
+# fraction of the frames sent in an interval that may be requested again
+# before the rate is cut
+NACK_THRESHOLD = 0.01
+# multiplicative decrease and additive increase, the latter as a fraction of
+# the configured rate, and the floor of the rate as a fraction of it
+RATE_DECREASE = 0.75
+RATE_INCREASE = 0.05
+MIN_RATE_FRACTION = 1 / 16
+# shortest wait for tokens, in seconds, so that a bucket left short by
+# rounding is refilled rather than drained again at the same instant
+MIN_PACING_DELAY = 1e-6
+
+
+class TokenBucket:
+    """
+    Token bucket allowing ``rate`` units per second in bursts of ``burst``.
+
+    The bucket starts full.
+    """
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float]):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._clock = clock
+        self._updated = clock()
+
+    def refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available, after a refill."""
+        needed = min(amount, self.burst) - self.tokens
+        return 0 if needed <= 0 else needed / self.rate
+
+
+class Pacer:
+    """
+    Spreads datagrams out in time to stay within byte and packet rates.
+
+    Datagrams are queued and sent by ``send(datagrams)`` whenever both token
+    buckets allow, in as large batches as they allow, from callbacks on the
+    event loop.  Either rate may be None to leave it unlimited.
+
+    With ``adaptive``, retransmission requests reported through
+    ``frames_requested`` steer the rates between the configured maximum and
+    a fraction of it: every ``ADAPT_INTERVAL`` seconds they are cut by
+    ``RATE_DECREASE`` if more than ``NACK_THRESHOLD`` of the frames sent were
+    requested again, and otherwise raised by ``RATE_INCREASE`` of the
+    maximum.
+    """
+
+    def __init__(self, loop, send: Callable[[List], None],
+                 rate: float = None, packet_rate: float = None,
+                 burst: int = None, packet_burst: int = None,
+                 adaptive: bool = True):
+        if rate is None and packet_rate is None:
+            raise ValueError('pacing needs a byte or packet rate')
+        self.loop = loop
+        self.log = getLogger(__name__)
+        self._send = send
+        clock = loop.time
+        self._buckets = []
+        self._bytes = self._packets = None
+        if rate is not None:
+            self._bytes = TokenBucket(
+                rate, PACING_BURST if burst is None else burst, clock)
+            self._buckets.append(self._bytes)
+        if packet_rate is not None:
+            self._packets = TokenBucket(
+                packet_rate,
+                PACING_PACKET_BURST if packet_burst is None else packet_burst,
+                clock)
+            self._buckets.append(self._packets)
+        self._max_rates = [bucket.rate for bucket in self._buckets]
+        self._queue = deque()
+        self.queued_bytes = 0
+        self._handle = None
+        self.adaptive = adaptive
+        self._interval_start = clock()
+        self._sent_frames = 0
+        self._requested_frames = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def rate(self) -> float:
+        """Current byte rate, or None if bytes aren't limited."""
+        return None if self._bytes is None else self._bytes.rate
+
+    @property
+    def packet_rate(self) -> float:
+        """Current packet rate, or None if packets aren't limited."""
+        return None if self._packets is None else self._packets.rate
+
+    def send(self, datagrams: Sequence[Tuple[Sequence, Tuple[str, int]]]):
+        """Queue ``(buffers, address)`` datagrams to be sent in turn."""
+        for datagram in datagrams:
+            self._queue.append((datagram, _size(datagram)))
+            self.queued_bytes += self._queue[-1][1]
+        if self._handle is None:
+            self._drain()
+
+    def frames_requested(self, count: int):
+        """Report frames that subscribers asked to have sent again."""
+        self._requested_frames += count
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._queue.clear()
+        self.queued_bytes = 0
+
+    def _drain(self):
+        self._handle = None
+        for bucket in self._buckets:
+            bucket.refill()
+        self._adapt()
+
+        batch = []
+        queue = self._queue
+        byte_bucket = self._bytes
+        packet_bucket = self._packets
+        while queue:
+            datagram, size = queue[0]
+            if byte_bucket is not None and byte_bucket.tokens < min(
+                    size, byte_bucket.burst):
+                break
+            if packet_bucket is not None and packet_bucket.tokens < 1:
+                break
+            queue.popleft()
+            self.queued_bytes -= size
+            if byte_bucket is not None:
+                byte_bucket.tokens -= size
+            if packet_bucket is not None:
+                packet_bucket.tokens -= 1
+            batch.append(datagram)
+        if batch:
+            self._sent_frames += len(batch)
+            self._send(batch)
+
+        if queue:
+            _, size = queue[0]
+            delay = max(MIN_PACING_DELAY, *(
+                bucket.delay(size if bucket is byte_bucket else 1)
+                for bucket in self._buckets))
+            self._handle = self.loop.call_later(delay, self._drain)
+
+    def _adapt(self):
+        now = self.loop.time()
+        intervals = int((now - self._interval_start) / ADAPT_INTERVAL)
+        if not self.adaptive or not intervals:
+            return
+        congested = (self._requested_frames >
+                     NACK_THRESHOLD * max(self._sent_frames, 1))
+        # an idle publisher isn't drained to adapt, so intervals beyond the
+        # first are taken to have passed quietly
+        quiet = intervals - 1 if congested else intervals
+        for bucket, max_rate in zip(self._buckets, self._max_rates):
+            rate = bucket.rate
+            if congested:
+                rate = max(rate * RATE_DECREASE, max_rate * MIN_RATE_FRACTION)
+            bucket.rate = min(rate + quiet * max_rate * RATE_INCREASE,
+                              max_rate)
+        if congested:
+            self.log.debug('%d of %d frames requested again; pacing at '
+                           '%s bytes/s, %s packets/s', self._requested_frames,
+                           self._sent_frames, self.rate, self.packet_rate)
+        self._interval_start = now
+        self._sent_frames = 0
+        self._requested_frames = 0
+
+
+def _size(datagram) -> int:
+    buffers, _ = datagram
+    return sum(len(buffer) for buffer in buffers)
@@ -6,24 +6,62 @@ from typing import Tuple, Union
 
 _header = Struct('!HBQ2B')
 _topic_size = Struct('!B')
+HEADER_SIZE = _header.size
 MAX_UDP_SIZE = 512  # bytes
 MAX_BODY_SIZE = MAX_UDP_SIZE - _header.size
 MAX_TOPIC_SIZE = 255
+MAX_FRAMES = 255
+# largest UDP payload over IPv4
+MAX_DATAGRAM_SIZE = 65507  # bytes
+# the first frame must fit the longest topic and at least one body byte
+MIN_DATAGRAM_SIZE = _header.size + _topic_size.size + MAX_TOPIC_SIZE + 1
 
 PROTOCOL_VERSION_UPPER = 0x1 << 4
 
+# Version 2 frames number frames in two bytes, for messages of more than
+# MAX_FRAMES frames, and are otherwise like version 1 frames.
+_header_v2 = Struct('!HBQ2H')
+HEADER_SIZE_V2 = _header_v2.size
+PROTOCOL_VERSION_2_UPPER = 0x2 << 4
+MAX_STREAM_FRAMES = 0xFFFF
+# a version 2 FRAMES_REQUEST body is (first frame, count) ranges, as many as
+# fit the smallest datagram
+_frame_range = Struct('!HH')
+MAX_REQUEST_RANGES = ((MIN_DATAGRAM_SIZE - HEADER_SIZE_V2) //
+                      _frame_range.size)
+
 VERSION_TYPE_BYTE_POSITION = 2
 
-# v1 message types
-TYPE_MASK = 0xF
+# v1 message types, in the low three bits of the version-type byte
+TYPE_MASK = 0x7
+# set in every frame of a message whose body is compressed
+COMPRESSED = 0x8
 START_FRAME = 0x1
 CONTINUATION_FRAME = 0x2
+# with a total of 0 frames, requests the whole message
 FRAME_REQUEST = 0x3
 FRAME_RESPONSE = 0x4
 MESSAGE_DROPPED = 0x5
+# body is a bitmap of the requested frame numbers, least significant bit first
+FRAMES_REQUEST = 0x6
+# body is the XOR of the payloads of a block of data frames, after the XOR of
+# their lengths; the frame number is the block's index and the total frames
+# the number of data frames per block
+PARITY_FRAME = 0x7
+
+# A uid is the random id of its publisher's stream of messages to one group,
+# above the message's sequence number in that stream, so subscribers notice
+# messages lost whole.
+SEQUENCE_BITS = 32
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+
+_parity_length = Struct('!H')
+# bytes a parity frame's payload has over the data frames it covers
+PARITY_OVERHEAD = _parity_length.size
 
 Frame = namedtuple('Frame', ['size', 'protocol_version', 'frame_type', 'uid',
-                             'frame_number', 'total_frames', 'topic', 'body'])
+                             'frame_number', 'total_frames', 'topic', 'body',
+                             'compressed'])
 
 
 def parse(frame_bytes: Union[bytes, bytearray]) -> Frame:
@@ -42,59 +80,176 @@ def parse(frame_bytes: Union[bytes, bytearray]) -> Frame:
         topic = None
 
     return Frame(size, protocol_version, frame_type, uid, frame,
-                 total_frames, topic, frame_bytes[body_start:])
+                 total_frames, topic, frame_bytes[body_start:],
+                 bool(vt & COMPRESSED))
+
+
+def parse_header(frame_bytes: Union[bytes, bytearray, memoryview]
+                 ) -> Tuple[int, int, int, int]:
+    """
+    Unpack the frame type, uid, frame number and total frames of a frame.
+
+    Unlike ``parse``, the topic and body are left in the buffer, to be read
+    from ``header_size_of(frame_bytes)`` onward by the caller.  Both protocol
+    versions are read.
+    """
+    if frame_bytes[VERSION_TYPE_BYTE_POSITION] >> 4 == 2:
+        header = _header_v2
+    else:
+        header = _header
+    size, vt, uid, frame, total_frames = header.unpack_from(frame_bytes, 0)
+    return TYPE_MASK & vt, uid, frame, total_frames
 
 
-def pack(uid: int, topic: str, body: Union[bytes, str]) -> Tuple[bytearray]:
+def header_size_of(frame_bytes: Union[bytes, bytearray, memoryview]) -> int:
+    """Size of a frame's header, from its protocol version."""
+    if frame_bytes[VERSION_TYPE_BYTE_POSITION] >> 4 == 2:
+        return HEADER_SIZE_V2
+    return HEADER_SIZE
+
+
+def pack(uid: int, topic: str, body: Union[bytes, str],
+         max_datagram_size: int = MAX_UDP_SIZE,
+         flags: int = 0) -> Tuple[bytearray]:
+    max_body_size = max_datagram_size - _header.size
     topic = topic.encode('utf-8')
     if isinstance(body, str):
         body = body.encode('utf-8')
 
     topic_size = len(topic)
-    if topic_size > MAX_TOPIC_SIZE:
-        raise ValueError('topic length exceeds maximum: '
-                         '%d > %d' % (topic_size, MAX_TOPIC_SIZE))
-
     body_size = len(body)
-    if body_size > max_message_size(topic_size):
-        raise ValueError('message length exceeds maximum for topic: '
-                         '%d > %d' % (body_size, max_message_size(topic_size)))
+    _check_sizes(topic_size, body_size, max_datagram_size)
 
     # compute the total number of frames we need to multicast the message,
     # keeping each frame under the fragmentation limit for UDP
     num_frames = 1
     # we'll have at least one frame, but the first frame also contains the
     # topic, so it can't hold as much as later frames
-    max_first_frame_size = MAX_BODY_SIZE - _topic_size.size - len(topic)
+    max_first_frame_size = max_body_size - _topic_size.size - len(topic)
 
     if body_size <= max_first_frame_size:
         # return a tuple of just the first (only) frame
-        return pack_first_frame(uid, num_frames, topic, body),
+        return pack_first_frame(uid, num_frames, topic, body, flags),
 
     remaining_size = body_size - max_first_frame_size
-    num_frames += ceil(remaining_size / MAX_BODY_SIZE)
+    num_frames += ceil(remaining_size / max_body_size)
 
     frames = []
     start, end = 0, max_first_frame_size
     for i in range(num_frames):
         if not i:
             frames.append(pack_first_frame(uid, num_frames, topic,
-                                           body[start:end]))
+                                           body[start:end], flags))
             continue
         start = end
-        end = start + MAX_BODY_SIZE
-        frames.append(pack_frame(uid, i, num_frames, body[start:end]))
+        end = start + max_body_size
+        frames.append(pack_frame(uid, i, num_frames, body[start:end],
+                                 flags))
+
+    return tuple(frames)
+
+
+def pack_headers(uid: int, topic: str, body: Union[bytes, str],
+                 max_datagram_size: int = MAX_UDP_SIZE, flags: int = 0
+                 ) -> Tuple[Tuple[bytearray, memoryview]]:
+    """
+    Frame a message without copying its body.
+
+    Each frame is returned as a freshly packed header and a ``memoryview`` of
+    its slice of ``body``, to be gathered into one datagram when sent.  The
+    body is referenced rather than copied, so it must not be modified while
+    the frames are in use.  ``flags``, such as ``COMPRESSED``, are set in
+    every frame's type.
+    """
+    max_body_size = max_datagram_size - _header.size
+    topic = topic.encode('utf-8')
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    view = memoryview(body)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+
+    topic_size = len(topic)
+    body_size = len(view)
+    _check_sizes(topic_size, body_size, max_datagram_size)
+
+    # the first frame's header also carries the topic
+    end = min(body_size, max_body_size - _topic_size.size - topic_size)
+    num_frames = 1 + ceil((body_size - end) / max_body_size)
+    header = bytearray(_header.size + _topic_size.size + topic_size)
+    _header.pack_into(header, 0, len(header) + end,
+                      PROTOCOL_VERSION_UPPER | START_FRAME | flags, uid, 0,
+                      num_frames)
+    _topic_size.pack_into(header, _header.size, topic_size)
+    header[_header.size + _topic_size.size:] = topic
+    frames = [(header, view[:end])]
+
+    vt = PROTOCOL_VERSION_UPPER | CONTINUATION_FRAME | flags
+    for frame in range(1, num_frames):
+        start, end = end, min(body_size, end + max_body_size)
+        header = bytearray(_header.size)
+        _header.pack_into(header, 0, _header.size + end - start, vt, uid,
+                          frame, num_frames)
+        frames.append((header, view[start:end]))
+
+    return tuple(frames)
+
+
+def pack_stream_headers(uid: int, topic: str, body: Union[bytes, str],
+                        max_datagram_size: int = MAX_UDP_SIZE
+                        ) -> Tuple[Tuple[bytearray, memoryview]]:
+    """
+    Frame a message too large for ``pack_headers`` with version 2 headers.
+
+    The frames are laid out as by ``pack_headers``, with up to
+    ``MAX_STREAM_FRAMES`` of them, and likewise reference ``body``.
+    """
+    max_body_size = max_datagram_size - HEADER_SIZE_V2
+    topic = topic.encode('utf-8')
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    view = memoryview(body)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+
+    topic_size = len(topic)
+    body_size = len(view)
+    _check_sizes(topic_size, 0, max_datagram_size)
+    max_size = max_stream_message_size(topic_size, max_datagram_size)
+    if body_size > max_size:
+        raise ValueError('message length exceeds maximum for topic: '
+                         '%d > %d' % (body_size, max_size))
+
+    end = min(body_size, max_body_size - _topic_size.size - topic_size)
+    if end < 0:
+        raise ValueError('datagram size too small for topic')
+    num_frames = 1 + ceil((body_size - end) / max_body_size)
+    header = bytearray(HEADER_SIZE_V2 + _topic_size.size + topic_size)
+    _header_v2.pack_into(header, 0, len(header) + end,
+                         PROTOCOL_VERSION_2_UPPER | START_FRAME, uid, 0,
+                         num_frames)
+    _topic_size.pack_into(header, HEADER_SIZE_V2, topic_size)
+    header[HEADER_SIZE_V2 + _topic_size.size:] = topic
+    frames = [(header, view[:end])]
+
+    vt = PROTOCOL_VERSION_2_UPPER | CONTINUATION_FRAME
+    for frame in range(1, num_frames):
+        start, end = end, min(body_size, end + max_body_size)
+        header = bytearray(HEADER_SIZE_V2)
+        _header_v2.pack_into(header, 0, HEADER_SIZE_V2 + end - start, vt,
+                             uid, frame, num_frames)
+        frames.append((header, view[start:end]))
 
     return tuple(frames)
 
 
 def pack_first_frame(uid: int, total_frames: int, topic: bytes,
-                     body: bytes) -> bytearray:
+                     body: bytes, flags: int = 0) -> bytearray:
     body_size = len(body)
     topic_size = len(topic)
     header_size = _header.size + _topic_size.size + topic_size
     size = header_size + body_size
-    vt = PROTOCOL_VERSION_UPPER | START_FRAME
+    vt = PROTOCOL_VERSION_UPPER | START_FRAME | flags
     frame = 0
 
     buf = bytearray(header_size + body_size)
@@ -114,10 +269,10 @@ def pack_first_frame(uid: int, total_frames: int, topic: bytes,
 
 
 def pack_frame(uid: int, frame: int, total_frames: int,
-               body: bytes) -> bytearray:
+               body: bytes, flags: int = 0) -> bytearray:
     body_size = len(body)
     size = _header.size + body_size
-    vt = PROTOCOL_VERSION_UPPER | CONTINUATION_FRAME
+    vt = PROTOCOL_VERSION_UPPER | CONTINUATION_FRAME | flags
 
     buf = bytearray(_header.size + body_size)
     # pack the header
@@ -129,39 +284,171 @@ def pack_frame(uid: int, frame: int, total_frames: int,
     return buf
 
 
-def pack_drop_message(uid: int, frame: int, total_frames: int) -> bytearray:
-    vt = PROTOCOL_VERSION_UPPER | MESSAGE_DROPPED
-    buf = bytearray(_header.size)
+def pack_header(frame_type: int, uid: int, frame: int, total_frames: int,
+                payload_size: int) -> bytearray:
+    header, version = _header_for(total_frames)
+    buf = bytearray(header.size)
 
-    _header.pack_into(buf, 0, _header.size, vt, uid, frame, total_frames)
+    header.pack_into(buf, 0, header.size + payload_size, version | frame_type,
+                     uid, frame, total_frames)
 
     return buf
 
 
+def pack_parity_frames(uid: int, frames, block_size: int
+                       ) -> Tuple[bytearray]:
+    """
+    Pack a parity frame for each block of ``block_size`` frames.
+
+    ``frames`` are the ``(header, body)`` pairs of a message from
+    ``pack_headers``.  Any one frame missing from a block can be rebuilt
+    from the rest of the block and its parity frame.  The parity frames are
+    ``PARITY_OVERHEAD`` bytes longer than the longest frame of their block,
+    and have the flags of the message's frames.
+    """
+    if not 1 <= block_size <= MAX_FRAMES:
+        raise ValueError('parity block size outside supported range: '
+                         '%d not in [1, %d]' % (block_size, MAX_FRAMES))
+    flags = frames[0][0][VERSION_TYPE_BYTE_POSITION] & COMPRESSED
+    parity_frames = []
+    for block, start in enumerate(range(0, len(frames), block_size)):
+        lengths = 0
+        parity = 0
+        size = 0
+        for header, body in frames[start:start + block_size]:
+            payload = bytes(header[_header.size:]) + bytes(body)
+            lengths ^= len(payload)
+            parity ^= int.from_bytes(payload, 'little')
+            size = max(size, len(payload))
+        payload_size = PARITY_OVERHEAD + size
+        buf = pack_header(PARITY_FRAME | flags, uid, block, block_size,
+                          payload_size)
+        buf += _parity_length.pack(lengths)
+        buf += parity.to_bytes(size, 'little')
+        parity_frames.append(buf)
+
+    return tuple(parity_frames)
+
+
+def pack_drop_message(uid: int, frame: int, total_frames: int) -> bytearray:
+    return pack_header(MESSAGE_DROPPED, uid, frame, total_frames, 0)
+
+
 def pack_request_message(uid: int, frame: int, total_frames: int) -> bytearray:
-    vt = PROTOCOL_VERSION_UPPER | FRAME_REQUEST
-    buf = bytearray(_header.size)
+    return pack_header(FRAME_REQUEST, uid, frame, total_frames, 0)
+
+
+def pack_message_request(uid: int) -> bytearray:
+    """Request every frame of a message none of which arrived."""
+    return pack_header(FRAME_REQUEST, uid, 0, 0, 0)
+
+
+def pack_frames_request(uid: int, total_frames: int,
+                        frame_numbers) -> bytearray:
+    """
+    Request frames of a message.
 
-    _header.pack_into(buf, 0, _header.size, vt, uid, frame, total_frames)
+    Frames of version 2 messages are requested as ranges, and only the first
+    ``MAX_REQUEST_RANGES`` ranges of them.
+    """
+    if total_frames > MAX_FRAMES:
+        ranges = _frame_ranges(frame_numbers)[:MAX_REQUEST_RANGES]
+        buf = pack_header(FRAMES_REQUEST, uid, 0, total_frames,
+                          _frame_range.size * len(ranges))
+        for first, count in ranges:
+            buf += _frame_range.pack(first, count)
+        return buf
+
+    vt = PROTOCOL_VERSION_UPPER | FRAMES_REQUEST
+    bitmap = 0
+    for frame in frame_numbers:
+        bitmap |= 1 << frame
+    bitmap_size = (total_frames + 7) // 8
+    buf = bytearray(_header.size + bitmap_size)
+
+    _header.pack_into(buf, 0, len(buf), vt, uid, 0, total_frames)
+    buf[_header.size:] = bitmap.to_bytes(bitmap_size, 'little')
 
     return buf
 
 
+def unpack_frames_bitmap(bitmap: Union[bytes, bytearray],
+                         total_frames: int) -> Tuple[int]:
+    bits = int.from_bytes(bitmap, 'little')
+    return tuple(frame for frame in range(total_frames) if bits >> frame & 1)
+
+
+def unpack_frame_ranges(ranges: Union[bytes, bytearray, memoryview]
+                        ) -> Tuple[int]:
+    """Frame numbers of the ranges in a version 2 request."""
+    frames = []
+    for first, count in _frame_range.iter_unpack(
+            ranges[:len(ranges) - len(ranges) % _frame_range.size]):
+        frames.extend(range(first, min(first + count, MAX_STREAM_FRAMES)))
+    return tuple(frames)
+
+
 def set_response_frame_type(*frames):
-    vt = PROTOCOL_VERSION_UPPER | FRAME_RESPONSE
     for frame in frames:
-        frame[VERSION_TYPE_BYTE_POSITION] = vt
+        frame[VERSION_TYPE_BYTE_POSITION] = FRAME_RESPONSE | (
+            frame[VERSION_TYPE_BYTE_POSITION] & ~TYPE_MASK)
+
+
+def max_message_size(topic_size, max_datagram_size=MAX_UDP_SIZE):
+    max_body_size = max_datagram_size - _header.size
+    return MAX_FRAMES*max_body_size - (topic_size + 1)
+
+
+def max_stream_message_size(topic_size, max_datagram_size=MAX_UDP_SIZE):
+    max_body_size = max_datagram_size - HEADER_SIZE_V2
+    return MAX_STREAM_FRAMES*max_body_size - (topic_size + 1)
+
+
+def _header_for(total_frames):
+    # messages of more frames than one byte counts need version 2 headers
+    if total_frames > MAX_FRAMES:
+        return _header_v2, PROTOCOL_VERSION_2_UPPER
+    return _header, PROTOCOL_VERSION_UPPER
+
+
+def _frame_ranges(frame_numbers):
+    ranges = []
+    for frame in sorted(frame_numbers):
+        if ranges and ranges[-1][0] + ranges[-1][1] == frame:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([frame, 1])
+    return ranges
+
+
+def _check_sizes(topic_size, body_size, max_datagram_size):
+    check_datagram_size(max_datagram_size)
+
+    if topic_size > MAX_TOPIC_SIZE:
+        raise ValueError('topic length exceeds maximum: '
+                         '%d > %d' % (topic_size, MAX_TOPIC_SIZE))
+
+    max_size = max_message_size(topic_size, max_datagram_size)
+    if body_size > max_size:
+        raise ValueError('message length exceeds maximum for topic: '
+                         '%d > %d' % (body_size, max_size))
 
 
-def max_message_size(topic_size):
-    return 255*MAX_BODY_SIZE - (topic_size + 1)
+def check_datagram_size(max_datagram_size):
+    if not MIN_DATAGRAM_SIZE <= max_datagram_size <= MAX_DATAGRAM_SIZE:
+        raise ValueError('datagram size outside supported range: '
+                         '%d not in [%d, %d]' % (max_datagram_size,
+                                                 MIN_DATAGRAM_SIZE,
+                                                 MAX_DATAGRAM_SIZE))
 
 
 _parse = parse
+_parse_header = parse_header
 _pack = pack
+_pack_headers = pack_headers
 try:
-    from ._pack import pack
-    from ._parse import Frame as _Frame
+    from ._pack import pack, pack_headers
+    from ._parse import Frame as _Frame, parse_header
     parse = _Frame.parse
 except ImportError:
     pass
@@ -1,23 +1,53 @@
 from asyncio import DatagramProtocol, get_event_loop
-from collections import OrderedDict
 from functools import partial
 from logging import getLogger
-from socket import IPPROTO_IP, IP_MULTICAST_TTL
-from typing import Tuple
-from uuid import uuid4
+from os import urandom
+from socket import AF_INET, IPPROTO_IP, IP_MULTICAST_TTL
+from time import perf_counter
+from typing import Iterable, List, Tuple
 
+from .cache import MAX_CACHE_AGE, MAX_CACHE_BYTES, RetransmissionCache
+from .compression import COMPRESSION_THRESHOLD, compress, get_codec
 from .exceptions import NotConnectedError
-from .parse import (FRAME_REQUEST, parse, pack, pack_drop_message,
-                    set_response_frame_type)
+from .mmsg import HAVE_SENDMMSG, MAX_BATCH_SIZE, sendmmsg
+from .pacing import Pacer
+from .parse import (COMPRESSED, FRAME_REQUEST, FRAMES_REQUEST, MAX_FRAMES,
+                    MAX_UDP_SIZE, MIN_DATAGRAM_SIZE, PARITY_OVERHEAD,
+                    SEQUENCE_BITS, SEQUENCE_MASK, check_datagram_size,
+                    header_size_of, max_message_size, parse_header,
+                    pack_drop_message, pack_headers, pack_parity_frames,
+                    pack_stream_headers, unpack_frame_ranges,
+                    unpack_frames_bitmap)
+from .stats import Stats
+
+
+# seconds to collect retransmission requests before multicasting a repair
+REPAIR_DELAY = 0.01
 
 
 async def create_publish_socket(local_addr, loop=None, max_cache_size=None,
-                                time_to_live=None):
+                                time_to_live=None, max_datagram_size=None,
+                                repair_delay=None, max_cache_bytes=None,
+                                max_cache_age=None, pacing_rate=None,
+                                pacing_packet_rate=None, fec_block_size=None,
+                                compression=None, compression_threshold=None,
+                                stats=None):
     loop = get_event_loop() if loop is None else loop
     log = getLogger(__name__)
     log.debug('creating publish socket')
-    factory = partial(PublishProtocol, loop=loop, max_cache_size=max_cache_size,
-                      time_to_live=time_to_live)
+    factory = partial(PublishProtocol, loop=loop,
+                      max_cache_size=max_cache_size,
+                      time_to_live=time_to_live,
+                      max_datagram_size=max_datagram_size,
+                      repair_delay=repair_delay,
+                      max_cache_bytes=max_cache_bytes,
+                      max_cache_age=max_cache_age,
+                      pacing_rate=pacing_rate,
+                      pacing_packet_rate=pacing_packet_rate,
+                      fec_block_size=fec_block_size,
+                      compression=compression,
+                      compression_threshold=compression_threshold,
+                      stats=stats)
     transport, protocol = await loop.create_datagram_endpoint(
         factory, local_addr=local_addr, reuse_address=True
     )
@@ -26,13 +56,93 @@ async def create_publish_socket(local_addr, loop=None, max_cache_size=None,
 
 
 class PublishProtocol(DatagramProtocol):
-    def __init__(self, loop=None, max_cache_size=None, time_to_live=None):
+    """
+    Publishes framed messages and answers retransmission requests.
+
+    Requests for a cached message are collected for ``repair_delay`` seconds
+    and the union of the requested frames is then multicast once to the
+    message's group, so one repair serves every subscriber that lost the same
+    frames.  A ``repair_delay`` of 0 answers each request immediately by
+    unicast instead.
+
+    Each message's uid numbers it in sequence among the messages sent to its
+    group, under a random id for the publisher's stream to the group, so
+    subscribers can request messages they lost every frame of.
+
+    Published messages are kept for retransmission for up to
+    ``max_cache_age`` seconds in a ring of ``max_cache_bytes`` bytes, and
+    optionally no more than ``max_cache_size`` messages.
+
+    Given a ``pacing_rate`` in bytes per second or a ``pacing_packet_rate``
+    in datagrams per second, published frames are queued and sent no faster,
+    rather than in one burst per message, and the rates back off while
+    subscribers request many frames again.  Repairs and drop notices are not
+    paced.
+
+    Given an ``fec_block_size`` of k, each block of k frames of a multi-frame
+    message is followed by a parity frame, from which subscribers rebuild any
+    one lost frame of the block without a retransmission request, for 1/k
+    more bytes sent.  Data frames are then ``PARITY_OVERHEAD`` bytes smaller
+    so parity frames fit the datagram size.  ``set_fec_block_size`` overrides
+    the block size per topic, and 0 turns parity off.
+
+    Given the name of a registered ``compression`` codec, message bodies of
+    at least ``compression_threshold`` bytes are compressed before they are
+    framed, when that makes them shorter, so they take fewer frames.
+    ``set_compression`` overrides the codec and threshold per topic.
+
+    Messages too long for ``MAX_FRAMES`` frames, even compressed, are sent
+    uncompressed and without parity in up to ``MAX_STREAM_FRAMES`` frames
+    with version 2 headers, which subscribers can pass on in chunks as they
+    arrive.  Only those that fit the cache's ring can be repaired.
+
+    Frames, bytes and messages sent, requests received and drop notices are
+    counted in ``stats``, which also reports the cache's state.
+    """
+    def __init__(self, loop=None, max_cache_size=None, time_to_live=None,
+                 max_datagram_size=None, repair_delay=None,
+                 max_cache_bytes=None, max_cache_age=None, pacing_rate=None,
+                 pacing_packet_rate=None, fec_block_size=None,
+                 compression=None, compression_threshold=None,
+                 stats=None):
         self.loop = get_event_loop() if loop is None else loop
         self.log = getLogger(__name__)
         self.transport = None
-        self._message_cache = OrderedDict()
-        self._max_cache_size = 20 if max_cache_size is None else max_cache_size
+        self._fileno = None
+        self._message_cache = RetransmissionCache(
+            MAX_CACHE_BYTES if max_cache_bytes is None else max_cache_bytes,
+            MAX_CACHE_AGE if max_cache_age is None else max_cache_age,
+            max_cache_size, clock=self.loop.time)
         self._ttl = 3 if time_to_live is None else time_to_live
+        self._max_datagram_size = (MAX_UDP_SIZE if max_datagram_size is None
+                                   else max_datagram_size)
+        check_datagram_size(self._max_datagram_size)
+        self._repair_delay = (REPAIR_DELAY if repair_delay is None else
+                              repair_delay)
+        # uid -> (requested frame numbers, requester addresses)
+        self._pending_repairs = dict()
+        self._pacer = None
+        if pacing_rate is not None or pacing_packet_rate is not None:
+            self._pacer = Pacer(self.loop, self._send_datagrams, pacing_rate,
+                                pacing_packet_rate)
+        self._fec_block_size = _check_block_size(
+            0 if fec_block_size is None else fec_block_size)
+        self._topic_block_sizes = dict()
+        self._codec = None if compression is None else get_codec(compression)
+        self._compression_threshold = (
+            COMPRESSION_THRESHOLD if compression_threshold is None else
+            compression_threshold)
+        # topic -> (codec, or False for none, and threshold), None for either
+        # taking the protocol's
+        self._topic_compression = dict()
+        # destination -> [stream id, sequence number of the last message]
+        self._streams = dict()
+        self.stats = Stats() if stats is None else stats
+        cache = self._message_cache
+        self.stats.add_gauge('cache_messages', cache.__len__)
+        self.stats.add_gauge('cache_bytes', lambda: cache.nbytes)
+        self.stats.add_gauge('cache_hits', lambda: cache.hits)
+        self.stats.add_gauge('cache_misses', lambda: cache.misses)
 
     def connection_made(self, transport):
         self.log.debug('connection made: %s (local) to %s (remote)',
@@ -41,6 +151,8 @@ class PublishProtocol(DatagramProtocol):
         self.transport = transport
         sock = self.transport.get_extra_info('socket')
         sock.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, self._ttl)
+        if HAVE_SENDMMSG and sock.family == AF_INET:
+            self._fileno = sock.fileno()
 
     def connection_lost(self, exc):
         if exc:
@@ -48,50 +160,291 @@ class PublishProtocol(DatagramProtocol):
         else:
             self.log.debug('connection closed')
         self.transport = None
+        self._fileno = None
+        if self._pacer is not None:
+            self._pacer.close()
 
     def datagram_received(self, data, addr):
         self.log.debug('frame received from %s', addr)
-        frame = parse(data)
+        frame_type, uid, frame_number, total_frames = parse_header(data)
 
-        if frame.frame_type != FRAME_REQUEST:
+        if frame_type == FRAME_REQUEST and total_frames:
+            frame_numbers = (frame_number,)
+        elif frame_type == FRAME_REQUEST:
+            # the whole message, none of which arrived
+            entry = self._message_cache.peek(uid)
+            frame_numbers = (() if entry is None else
+                             range(entry.total_frames))
+        elif frame_type == FRAMES_REQUEST:
+            body = memoryview(data)[header_size_of(data):]
+            if total_frames > MAX_FRAMES:
+                frame_numbers = unpack_frame_ranges(body)
+            else:
+                frame_numbers = unpack_frames_bitmap(body, total_frames)
+        else:
             self.log.warning('received frame is not a request frame; ignoring '
                              'frame')
             return
+        self.stats.nacks_received += 1
+        if self._pacer is not None:
+            self._pacer.frames_requested(len(frame_numbers))
 
-        if frame.uid in self._message_cache:
-            # find the requested frame and send it
-            self.log.debug('frame of cached message found')
-            frame = self._message_cache[frame.uid][frame.frame_number]
+        entry = self._message_cache.lookup(uid)
+        if entry is not None and self._repair_delay:
+            self._schedule_repair(uid, frame_numbers, addr)
+            return
+        elif entry is not None:
+            # find the requested frames and send them together
+            self.log.debug('frames of cached message found')
+            frames = self._message_cache.frames(uid, entry, frame_numbers)
+            datagrams = [(frame, addr) for frame in frames]
         else:
             # send a response that the message is no longer cached
             self.log.debug('message no longer cached; creating drop-message '
                            'frame')
-            frame = pack_drop_message(frame.uid, frame.frame_number,
-                                      frame.total_frames)
+            datagrams = [((pack_drop_message(uid, frame_number,
+                                             total_frames),), addr)]
+            self.stats.drop_notices_sent += 1
 
-        self.transport.sendto(frame, addr)
+        self._send_datagrams(datagrams)
 
-    def publish(self, destination, topic: str, message: bytes):
+    def publish(self, destination, topic: str,
+                message: bytes) -> Tuple[int, bool]:
+        """
+        Publish a message to a group, returning its uid and whether it was
+        streamed, that is too long even after compression for its frames to
+        be numbered in a byte, so subscribers release it in order as it
+        arrives.
+
+        Frames are sent straight from the message buffer, which is copied
+        only once, into the retransmission cache, unless sending is paced and
+        the buffer is mutable.
+        """
         if self.transport is None:
             raise NotConnectedError
 
-        uid = generate_uid()
-        frames = pack(uid, topic, message)
-        for frame in frames:
-            self.transport.sendto(frame, destination)
+        stats = self.stats
+        start = (perf_counter() if stats.profiler is not None and
+                 stats.sample() else None)
+        uid = self._next_uid(destination)
+        frames, datagrams, streamed = self._frame(uid, topic, message)
+        self._send_paced([(datagram, destination) for datagram in datagrams])
+
+        self._message_cache.put(uid, destination, frames)
+        stats.messages_published += 1
+        if start is not None:
+            stats.profiler('publish', perf_counter() - start)
+        return uid, streamed
+
+    def publish_batch(self, messages: Iterable[Tuple[Tuple[str, int], str,
+                                                     bytes]]
+                      ) -> List[Tuple[int, bool]]:
+        """
+        Publish several messages, sending all of their frames together, and
+        return the uid of each and whether it was streamed, as ``publish``
+        does.
+
+        Parameters
+        ----------
+        messages : iterable of (destination, topic, message)
+            Messages to publish, each with the ``(address, port)`` of its
+            group.
+        """
+        if self.transport is None:
+            raise NotConnectedError
+
+        datagrams = []
+        packed = []
+        for destination, topic, message in messages:
+            uid = self._next_uid(destination)
+            frames, message_datagrams, streamed = self._frame(uid, topic,
+                                                              message)
+            datagrams.extend((datagram, destination)
+                             for datagram in message_datagrams)
+            packed.append((uid, destination, frames, streamed))
+        self._send_paced(datagrams)
+
+        for uid, destination, frames, _ in packed:
+            self._message_cache.put(uid, destination, frames)
+        self.stats.messages_published += len(packed)
+        return [(uid, streamed) for uid, _, _, streamed in packed]
+
+    def set_fec_block_size(self, topic: str, block_size: int = None):
+        """
+        Set the frames per parity frame of a topic's messages.
+
+        A ``block_size`` of 0 sends the topic without parity, and None
+        returns it to the protocol's block size.
+        """
+        if block_size is None:
+            self._topic_block_sizes.pop(topic, None)
+        else:
+            self._topic_block_sizes[topic] = _check_block_size(block_size)
+
+    def set_compression(self, topic: str, codec=None, threshold: int = None):
+        """
+        Set how a topic's messages are compressed.
+
+        ``codec`` is the name of a registered codec, False to send the topic
+        uncompressed, or None for the protocol's codec, and ``threshold``
+        the shortest body compressed, or None for the protocol's.
+        """
+        if codec is None and threshold is None:
+            self._topic_compression.pop(topic, None)
+            return
+        if codec:
+            codec = get_codec(codec)
+        elif codec is not None:
+            codec = False
+        self._topic_compression[topic] = (codec, threshold)
+
+    @property
+    def max_datagram_size(self) -> int:
+        return self._max_datagram_size
 
-        set_response_frame_type(*frames)
-        self._cache_message(uid, frames)
+    @property
+    def pacer(self):
+        """The pacer of published frames, or None if they aren't paced."""
+        return self._pacer
 
     def close(self):
+        if self._pacer is not None:
+            self._pacer.close()
         if self.transport is not None:
             self.transport.close()
 
-    def _cache_message(self, uid: int, frames: Tuple[bytearray]):
-        self._message_cache[uid] = frames
-        while len(self._message_cache) > self._max_cache_size:
-            self._message_cache.popitem(last=False)
+    def _next_uid(self, destination):
+        stream = self._streams.get(destination)
+        if stream is None or stream[1] == SEQUENCE_MASK:
+            # a new stream, rather than wrapping round to reused uids
+            stream = self._streams[destination] = [generate_stream_id(), -1]
+        stream[1] += 1
+        return stream[0] << SEQUENCE_BITS | stream[1]
+
+    def _frame(self, uid, topic, message):
+        # returns the frames to cache, the datagrams to send, the latter
+        # with a parity frame after each block when the topic has parity,
+        # and whether the message is streamed
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        body, flags = self._compress(topic, message)
+        if len(body) > max_message_size(len(topic.encode('utf-8')),
+                                        self._max_datagram_size):
+            # too many frames to number in a byte: sent as it is, without
+            # parity, so subscribers can release it in order as it arrives
+            frames = pack_stream_headers(uid, topic, self._stable(message),
+                                         self._max_datagram_size)
+            return frames, frames, True
+        message = self._stable(body)
+        block_size = self._topic_block_sizes.get(topic, self._fec_block_size)
+        frame_size = self._max_datagram_size - PARITY_OVERHEAD
+        if block_size and frame_size >= MIN_DATAGRAM_SIZE:
+            try:
+                frames = pack_headers(uid, topic, message, frame_size, flags)
+            except ValueError:
+                # too long to leave room for parity
+                pass
+            else:
+                if len(frames) > 1:
+                    parity = pack_parity_frames(uid, frames, block_size)
+                    datagrams = []
+                    for block, start in enumerate(range(0, len(frames),
+                                                        block_size)):
+                        datagrams.extend(frames[start:start + block_size])
+                        datagrams.append((parity[block],))
+                    return frames, datagrams, False
+
+        frames = pack_headers(uid, topic, message, self._max_datagram_size,
+                              flags)
+        return frames, frames, False
+
+    def _compress(self, topic, message):
+        codec, threshold = self._topic_compression.get(topic, (None, None))
+        codec = self._codec if codec is None else codec
+        if not codec:
+            return message, 0
+        compressed = compress(message, codec, self._compression_threshold
+                              if threshold is None else threshold)
+        if compressed is None:
+            return message, 0
+        return compressed, COMPRESSED
+
+    def _stable(self, message):
+        # queued frames must not see later changes to the caller's buffer
+        if self._pacer is None or isinstance(message, (bytes, str)):
+            return message
+        return bytes(message)
+
+    def _send_paced(self, datagrams):
+        if self._pacer is None:
+            self._send_datagrams(datagrams)
+        else:
+            self._pacer.send(datagrams)
+
+    def _send_datagrams(self, datagrams):
+        # Each datagram is a sequence of buffers gathered by the kernel, so
+        # message bodies are never copied.  A lone datagram isn't worth the
+        # setup of a sendmmsg call and is joined instead.
+        stats = self.stats
+        stats.frames_sent += len(datagrams)
+        stats.bytes_sent += sum(len(buffer) for buffers, _ in datagrams
+                                for buffer in buffers)
+        sent = 0
+        # only bypass the transport when it has nothing queued, so datagrams
+        # still leave the socket in order
+        if (self._fileno is not None and len(datagrams) > 1 and
+                not self.transport.get_write_buffer_size()):
+            try:
+                while sent < len(datagrams):
+                    count = sendmmsg(self._fileno,
+                                     datagrams[sent:sent + MAX_BATCH_SIZE])
+                    if not count:
+                        break
+                    sent += count
+            except OSError as exc:
+                # the transport reports the error for the failed datagram
+                self.log.debug('batched send failed: %s', exc)
+
+        for buffers, destination in datagrams[sent:]:
+            frame = buffers[0] if len(buffers) == 1 else b''.join(buffers)
+            self.transport.sendto(frame, destination)
+
+    def _schedule_repair(self, uid, frame_numbers, requester):
+        if uid not in self._pending_repairs:
+            self._pending_repairs[uid] = (set(), set())
+            self.loop.call_later(self._repair_delay, self._send_repair, uid)
+        requested, requesters = self._pending_repairs[uid]
+        requested.update(frame_numbers)
+        requesters.add(requester)
+
+    def _send_repair(self, uid):
+        requested, requesters = self._pending_repairs.pop(uid)
+        if self.transport is None:
+            return
+
+        entry = self._message_cache.peek(uid)
+        if entry is not None:
+            self.log.debug('multicasting %d repair frames for message %s to '
+                           '%d requesters', len(requested), hex(uid),
+                           len(requesters))
+            frames = self._message_cache.frames(uid, entry, sorted(requested))
+            datagrams = [(frame, entry.destination) for frame in frames]
+        else:
+            # evicted while collecting requests
+            drop = (pack_drop_message(uid, 0, 0),)
+            datagrams = [(drop, requester) for requester in requesters]
+            self.stats.drop_notices_sent += len(datagrams)
+
+        self._send_datagrams(datagrams)
+
+
+def _check_block_size(block_size: int) -> int:
+    if not 0 <= block_size <= MAX_FRAMES:
+        raise ValueError('parity block size outside supported range: '
+                         '%d not in [0, %d]' % (block_size, MAX_FRAMES))
+    return block_size
 
 
-def generate_uid():
-    return int(uuid4()) >> 64
+def generate_stream_id():
+    # the uid's bits above the sequence number
+    return int.from_bytes(urandom((64 - SEQUENCE_BITS) // 8), 'big')
@@ -0,0 +1,371 @@
+from typing import Callable, Tuple
+
+from .parse import HEADER_SIZE, HEADER_SIZE_V2, PARITY_OVERHEAD
+
+
+class PartialMessage:
+    """
+    Reassembly state of one multi-frame message.
+
+    The publisher splits the topic-size byte, topic and body into frames of a
+    fixed size, so each frame's payload is written straight into a single
+    buffer at ``frame_number * frame_size``.  The frame size is learned from
+    the first non-final frame to arrive; a final frame that arrives before
+    any other is held until then.
+
+    Parity frames are held until their block is missing exactly one frame,
+    which is then rebuilt from them and the rest of the block.
+    """
+    __slots__ = ('total_frames', '_missing', '_frame_size', '_buffer',
+                 '_length', '_pending', '_block_size', '_parity', 'source',
+                 'request_delay', 'request_rounds', 'start_time',
+                 'frame_time', 'request_time', 'gap_detected')
+
+    def __init__(self, total_frames: int, source=None, request_delay: int = 0):
+        self.total_frames = total_frames
+        # where to request missing frames from, how long to wait first and
+        # how often they've been requested
+        self.source = source
+        self.request_delay = request_delay
+        self.request_rounds = 0
+        # when the first and last new frames arrived and the last request was
+        # sent, and whether a frame was found missing ahead of one that
+        # arrived
+        self.start_time = 0
+        self.frame_time = 0
+        self.request_time = 0
+        self.gap_detected = False
+        self._missing = set(range(total_frames))
+        self._frame_size = 0
+        self._buffer = None
+        self._length = 0
+        self._pending = None
+        self._block_size = 0
+        # block index -> parity payload
+        self._parity = dict()
+
+    @property
+    def complete(self) -> bool:
+        return not self._missing
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held for the message's frames."""
+        nbytes = sum(len(parity) for parity in self._parity.values())
+        if self._buffer is not None:
+            return nbytes + len(self._buffer)
+        return nbytes + (0 if self._pending is None else len(self._pending))
+
+    @property
+    def topic(self):
+        """The message's topic if its first frame has arrived, else None."""
+        if self._buffer is None or 0 in self._missing:
+            return None
+        return self._buffer[1:1 + self._buffer[0]].decode('utf-8', 'replace')
+
+    def is_missing(self, frame_number: int) -> bool:
+        return frame_number in self._missing
+
+    def missing_frames(self) -> Tuple[int]:
+        """Numbers of the frames still missing, in order."""
+        return tuple(sorted(self._missing))
+
+    def add_frame(self, frame_number: int, frame) -> bool:
+        """
+        Copy the payload of a received frame into the message.
+
+        Parameters
+        ----------
+        frame_number : int
+            Number of the frame, from its header.
+        frame : bytes-like
+            The whole frame, header included.  It is not kept.
+
+        Returns
+        -------
+        bool
+            Whether the message is now complete.
+
+        Raises
+        ------
+        ValueError
+            If the frame's number or size doesn't fit the message.
+        """
+        if frame_number > self.total_frames - 1:
+            raise ValueError('frame number out of range')
+        self._add(frame_number, memoryview(frame)[HEADER_SIZE:])
+        if self._parity:
+            self._recover(frame_number // self._block_size)
+        return not self._missing
+
+    def add_parity(self, block: int, block_size: int, frame) -> bool:
+        """
+        Add a parity frame, rebuilding a missing frame of its block if it can.
+
+        Parameters
+        ----------
+        block : int
+            Index of the block, the frame number in the parity frame's header.
+        block_size : int
+            Frames per block, the total frames in the parity frame's header.
+        frame : bytes-like
+            The whole parity frame, header included.  It is not kept.
+
+        Returns
+        -------
+        bool
+            Whether the message is now complete.
+
+        Raises
+        ------
+        ValueError
+            If the block doesn't fit the message or its other parity frames.
+        """
+        if block_size < 1 or block * block_size >= self.total_frames:
+            raise ValueError('parity block out of range')
+        if self._block_size and block_size != self._block_size:
+            raise ValueError('parity block size inconsistent with message')
+        if len(frame) < HEADER_SIZE + PARITY_OVERHEAD:
+            raise ValueError('parity frame too short')
+        self._block_size = block_size
+        if block not in self._parity:
+            # the frame may be a view of a reused receive buffer
+            self._parity[block] = bytes(memoryview(frame)[HEADER_SIZE:])
+            self._recover(block)
+        return not self._missing
+
+    def _add(self, frame_number: int, payload):
+        last = self.total_frames - 1
+        if not self._frame_size:
+            if frame_number == last:
+                # the frame may be a view of a reused receive buffer
+                self._pending = bytes(payload)
+                self._missing.discard(frame_number)
+                return
+            self._frame_size = len(payload)
+            self._buffer = bytearray(self._frame_size * self.total_frames)
+            if self._pending is not None:
+                pending, self._pending = self._pending, None
+                try:
+                    self._write(last, pending)
+                except ValueError:
+                    self._missing.add(last)
+
+        self._write(frame_number, payload)
+        self._missing.discard(frame_number)
+
+    def _recover(self, block: int):
+        parity = self._parity.get(block)
+        if parity is None:
+            return
+        first = block * self._block_size
+        frames = range(first, min(first + self._block_size, self.total_frames))
+        missing = [number for number in frames if number in self._missing]
+        if len(missing) > 1:
+            return
+        if not missing:
+            # once the block is whole, its parity is no longer needed
+            del self._parity[block]
+            return
+        size = len(parity) - PARITY_OVERHEAD
+        present = [self._payload(number) for number in frames
+                   if number != missing[0]]
+        if any(len(frame) > size for frame in present):
+            # too short to be the parity of these frames; kept until the
+            # block is whole
+            return
+        del self._parity[block]
+
+        length = int.from_bytes(parity[:PARITY_OVERHEAD], 'big')
+        payload = int.from_bytes(parity[PARITY_OVERHEAD:], 'little')
+        for frame in present:
+            length ^= len(frame)
+            payload ^= int.from_bytes(frame, 'little')
+        if length > size:
+            return
+        try:
+            self._add(missing[0], payload.to_bytes(size, 'little')[:length])
+        except ValueError:
+            # parity that doesn't match the frames; wait for a retransmission
+            pass
+
+    def _payload(self, frame_number: int):
+        if self._buffer is None:
+            return self._pending
+        start = frame_number * self._frame_size
+        if frame_number == self.total_frames - 1:
+            return self._buffer[start:self._length]
+        return self._buffer[start:start + self._frame_size]
+
+    def assemble(self):
+        """
+        Return the topic and body of the complete message.
+
+        The body is the reassembly buffer itself, trimmed in place.
+        """
+        body = self._buffer
+        del body[self._length:]
+        topic_end = 1 + body[0]
+        topic = body[1:topic_end].decode('utf-8')
+        del body[:topic_end]
+        return topic, body
+
+    def _write(self, frame_number: int, payload):
+        size = len(payload)
+        if size > self._frame_size or (frame_number < self.total_frames - 1
+                                       and size != self._frame_size):
+            raise ValueError('frame size inconsistent with message')
+        start = frame_number * self._frame_size
+        self._buffer[start:start + size] = payload
+        if frame_number == self.total_frames - 1:
+            self._length = start + size
+
+
+class StreamingMessage:
+    """
+    Reassembly state of a message too large to hold whole.
+
+    Frames are released in order as soon as every frame before them has
+    arrived; only frames that arrive after a missing one are held.  Each
+    contiguous run of body bytes released is passed to
+    ``on_chunk(topic, offset, data, last)``, unless ``wants_chunks(topic)``
+    declines the message when its first frame is released, in which case
+    the runs are gathered into a body, as by ``PartialMessage``.
+
+    Frames have version 2 headers and messages don't have parity frames.
+    """
+    __slots__ = ('total_frames', '_next', '_highest', '_waiting',
+                 '_waiting_bytes', '_frame_size', '_topic', '_offset',
+                 '_body', '_wants_chunks', '_on_chunk', 'source',
+                 'request_delay', 'request_rounds', 'start_time',
+                 'frame_time', 'request_time', 'gap_detected')
+
+    def __init__(self, total_frames: int, source=None, request_delay: int = 0,
+                 wants_chunks: Callable[[str], bool] = None,
+                 on_chunk: Callable[[str, int, bytes, bool], None] = None):
+        self.total_frames = total_frames
+        # request bookkeeping, as for ``PartialMessage``
+        self.source = source
+        self.request_delay = request_delay
+        self.request_rounds = 0
+        self.start_time = 0
+        self.frame_time = 0
+        self.request_time = 0
+        self.gap_detected = False
+        # number of the first frame not yet released, and the highest to
+        # have arrived
+        self._next = 0
+        self._highest = -1
+        # frame number -> payload of frames waiting behind a missing one
+        self._waiting = dict()
+        self._waiting_bytes = 0
+        self._frame_size = 0
+        self._topic = None
+        # body bytes released so far
+        self._offset = 0
+        self._body = None
+        self._wants_chunks = wants_chunks
+        self._on_chunk = on_chunk
+
+    @property
+    def complete(self) -> bool:
+        return self._next == self.total_frames
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held for the message's frames."""
+        if self._body is not None:
+            return self._waiting_bytes + len(self._body)
+        return self._waiting_bytes
+
+    @property
+    def topic(self):
+        """The message's topic if its first frame has arrived, else None."""
+        return self._topic
+
+    def is_missing(self, frame_number: int) -> bool:
+        return (self._next <= frame_number < self.total_frames and
+                frame_number not in self._waiting)
+
+    def missing_frames(self) -> Tuple[int]:
+        """
+        Numbers of the frames missing before the highest to have arrived,
+        or if there are none, of the frames after it.
+        """
+        holes = tuple(number for number in range(self._next, self._highest)
+                      if number not in self._waiting)
+        return holes or tuple(range(max(self._highest + 1, self._next),
+                                    self.total_frames))
+
+    def add_frame(self, frame_number: int, frame) -> bool:
+        """
+        Add a received frame, releasing it and any frames waiting behind it
+        if it was the first frame not yet released.
+
+        Returns whether the message is now complete, and raises ValueError
+        if the frame's number or size doesn't fit the message.
+        """
+        last = self.total_frames - 1
+        if not 0 <= frame_number <= last:
+            raise ValueError('frame number out of range')
+        payload = memoryview(frame)[HEADER_SIZE_V2:]
+        size = len(payload)
+        if frame_number < last and not self._frame_size:
+            self._frame_size = size
+        if size > self._frame_size and self._frame_size or (
+                frame_number < last and size != self._frame_size):
+            raise ValueError('frame size inconsistent with message')
+        if frame_number == 0 and (not size or size < 1 + payload[0]):
+            raise ValueError('first frame too short for its topic')
+        if not self.is_missing(frame_number):
+            return self.complete
+
+        self._highest = max(self._highest, frame_number)
+        if frame_number != self._next:
+            # the frame may be a view of a reused receive buffer
+            self._waiting[frame_number] = bytes(payload)
+            self._waiting_bytes += size
+            return False
+
+        run = [payload]
+        self._next += 1
+        while self._next in self._waiting:
+            waiting = self._waiting.pop(self._next)
+            self._waiting_bytes -= len(waiting)
+            run.append(waiting)
+            self._next += 1
+        self._release(b''.join(run))
+        return self.complete
+
+    def add_parity(self, block: int, block_size: int, frame) -> bool:
+        raise ValueError('streamed messages have no parity frames')
+
+    def assemble(self):
+        """
+        Return the topic and body of the complete message, with the body
+        None if it was released in chunks.
+        """
+        return self._topic, self._body
+
+    def _release(self, data: bytes):
+        if self._topic is None:
+            topic_end = 1 + data[0]
+            self._topic = data[1:topic_end].decode('utf-8', 'replace')
+            data = data[topic_end:]
+            if (self._wants_chunks is None or self._on_chunk is None or
+                    not self._wants_chunks(self._topic)):
+                self._body = bytearray()
+        if self._body is not None:
+            self._body += data
+        else:
+            self._on_chunk(self._topic, self._offset, data, self.complete)
+        self._offset += len(data)
+
+
+# If the C extension is available, use it.
+# Save Python implementation for unit testing.
+_PartialMessage = PartialMessage
+try:
+    from ._reassembly import PartialMessage
+except ImportError:
+    pass
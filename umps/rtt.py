@@ -0,0 +1,75 @@
+from random import random
+
+
+# smoothing gains of the mean and mean deviation of the estimates, as for
+# TCP's retransmission timer (RFC 6298)
+MEAN_GAIN = 1 / 8
+DEVIATION_GAIN = 1 / 4
+# deviations above the mean a sample may be before it's taken to be late
+DEVIATION_FACTOR = 4
+
+# seconds to wait for a publisher's next frame, and for the answer to a
+# request, before anything is known of the publisher
+INITIAL_GAP_TIMEOUT = 0.1
+INITIAL_RETRY_TIMEOUT = 0.25
+# floor of the wait for an answer, above a publisher's repair delay
+MIN_RETRY_TIMEOUT = 0.02
+# the wait grows by up to this fraction at random, so subscribers that lost
+# the same frames drift apart
+RETRY_JITTER = 0.25
+
+
+class Estimate:
+    """Smoothed mean and mean deviation of a series of samples."""
+    __slots__ = ('mean', 'deviation')
+
+    def __init__(self):
+        self.mean = None
+        self.deviation = 0
+
+    def update(self, sample: float):
+        if self.mean is None:
+            self.mean = sample
+            self.deviation = sample / 2
+        else:
+            self.deviation += DEVIATION_GAIN * (abs(sample - self.mean) -
+                                                self.deviation)
+            self.mean += MEAN_GAIN * (sample - self.mean)
+
+    def bound(self, default: float) -> float:
+        """Mean plus ``DEVIATION_FACTOR`` deviations, or ``default``."""
+        if self.mean is None:
+            return default
+        return self.mean + DEVIATION_FACTOR * self.deviation
+
+
+class PeerTiming:
+    """
+    Loss-recovery timing of one publisher, as seen by a subscriber.
+
+    ``gap`` estimates the time between consecutive frames of a message, so a
+    frame that is overdue can be requested soon after it should have
+    arrived, and ``rtt`` the time between requesting frames and the first
+    of them arriving, which sets how long to wait before asking again.
+    """
+    __slots__ = ('gap', 'rtt')
+
+    def __init__(self):
+        self.gap = Estimate()
+        self.rtt = Estimate()
+
+    def gap_timeout(self, max_timeout: float) -> float:
+        """Seconds after a frame by which the next is presumed lost."""
+        return min(self.gap.bound(INITIAL_GAP_TIMEOUT), max_timeout)
+
+    def retry_timeout(self, rounds: int, max_timeout: float) -> float:
+        """
+        Seconds to wait for the answer to the ``rounds``-th request.
+
+        The wait doubles with each round up to ``max_timeout``, and is then
+        lengthened by up to ``RETRY_JITTER`` of itself at random.
+        """
+        timeout = max(self.rtt.bound(INITIAL_RETRY_TIMEOUT),
+                      MIN_RETRY_TIMEOUT)
+        timeout = min(timeout * 2 ** min(rounds - 1, 32), max_timeout)
+        return timeout * (1 + RETRY_JITTER * random())
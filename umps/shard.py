@@ -0,0 +1,326 @@
+"""
+Subscribing with several worker processes.
+
+An ``Interface`` parses, reassembles and delivers every message on one event
+loop.  ``ShardedSubscriber`` spreads that work over worker processes instead:
+topics hash into the network's bins as usual, and each bin belongs to one
+worker, which joins the bin's group on its own socket and reassembles the
+messages sent to it.
+"""
+import asyncio
+import ctypes
+import os
+import struct
+import sys
+from collections import defaultdict
+from ipaddress import IPv4Network
+from logging import getLogger
+from multiprocessing import get_all_start_methods, get_context
+from socket import IPPROTO_IP
+from typing import Callable, Optional
+
+from .exceptions import NotConnectedError, NotSubscribedError
+from .hash import hash_v1
+from .interface import address_of_bin, count_bins
+from .subscribe import create_subscribe_socket
+
+
+# bytes of shared memory each worker has for passing messages to the parent
+RING_SIZE = 2 ** 24
+
+# Linux delivers multicast to every socket bound to the port unless told to
+# deliver only groups the socket itself joined.
+try:
+    from socket import IP_MULTICAST_ALL
+except ImportError:
+    IP_MULTICAST_ALL = 49
+
+# Workers start from a server process forked before any event loop, rather
+# than from this process, whose loop may be running; rings and pipes are
+# passed to them when they start.
+_context = (get_context('forkserver')
+            if 'forkserver' in get_all_start_methods() else None)
+
+_record_header = struct.Struct('=IB')
+_WRAP = 0xFFFFFFFF
+_ALIGNMENT = 8
+
+
+def worker_of_bin(address_bin: int, workers: int) -> int:
+    """Index of the worker a hash bin belongs to."""
+    return address_bin % workers
+
+
+class _MessageRing:
+    """
+    Single-producer, single-consumer queue of messages in shared memory.
+
+    Records are a length, the topic size, the topic and the body, padded to
+    8 bytes and written contiguously; a record that won't fit before the end
+    of the ring is preceded by a wrap marker.  ``head`` and ``tail`` count
+    bytes written and read, so only the producer moves ``head`` and only the
+    consumer moves ``tail``.  Each record written is announced with a byte
+    on a pipe, which the consumer drains before reading records so no
+    announcement is lost.  The ring can be passed to a worker process as it
+    starts.
+    """
+
+    def __init__(self, size: int):
+        if size % _ALIGNMENT:
+            raise ValueError('ring size must be a multiple of %d' % _ALIGNMENT)
+        self.buffer = _context.RawArray(ctypes.c_uint8, size)
+        self.head = _context.RawValue(ctypes.c_uint64, 0)
+        self.tail = _context.RawValue(ctypes.c_uint64, 0)
+        self.dropped = _context.RawValue(ctypes.c_uint64, 0)
+        self._signal, self._notify = _context.Pipe(duplex=False)
+        os.set_blocking(self.notify_fd, False)
+        os.set_blocking(self.signal_fd, False)
+
+    @property
+    def signal_fd(self) -> int:
+        return self._signal.fileno()
+
+    @property
+    def notify_fd(self) -> int:
+        return self._notify.fileno()
+
+    def close(self):
+        self._signal.close()
+        self._notify.close()
+
+    def put(self, topic: str, body) -> bool:
+        """Write a message, or drop it if the ring is full."""
+        view = memoryview(self.buffer).cast('B')
+        size = len(view)
+        topic_bytes = topic.encode('utf-8')
+        length = _record_header.size + len(topic_bytes) + len(body)
+        padded = -(-length // _ALIGNMENT) * _ALIGNMENT
+        head = self.head.value
+        position = head % size
+        needed = padded
+        if position + padded > size:
+            needed += size - position
+        if padded > size or head + needed - self.tail.value > size:
+            self.dropped.value += 1
+            return False
+
+        if position + padded > size:
+            _record_header.pack_into(view, position, _WRAP, 0)
+            head += size - position
+            position = 0
+        _record_header.pack_into(view, position, length, len(topic_bytes))
+        start = position + _record_header.size
+        view[start:start + len(topic_bytes)] = topic_bytes
+        start += len(topic_bytes)
+        view[start:start + len(body)] = body
+        self.head.value = head + padded
+        try:
+            os.write(self.notify_fd, b'\0')
+        except BlockingIOError:
+            # the pipe is full of announcements the consumer hasn't read yet
+            pass
+        return True
+
+    def drain(self):
+        """Read every message written so far, oldest first."""
+        try:
+            while os.read(self.signal_fd, 2 ** 16):
+                pass
+        except BlockingIOError:
+            pass
+
+        view = memoryview(self.buffer).cast('B')
+        size = len(view)
+        messages = []
+        tail = self.tail.value
+        head = self.head.value
+        while tail < head:
+            position = tail % size
+            length, topic_size = _record_header.unpack_from(view, position)
+            if length == _WRAP:
+                tail += size - position
+                continue
+            start = position + _record_header.size
+            topic = bytes(view[start:start + topic_size]).decode('utf-8')
+            start += topic_size
+            end = position + length
+            messages.append((topic, bytes(view[start:end])))
+            tail += -(-length // _ALIGNMENT) * _ALIGNMENT
+        self.tail.value = tail
+        return messages
+
+
+def _run_worker(index: int, network: IPv4Network, port: int, commands,
+                ring: Optional[_MessageRing], handler, options: dict):
+    log = getLogger(__name__)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    topics = set()
+    groups = defaultdict(set)
+    stopped = loop.create_future()
+
+    if handler is None:
+        handler = ring.put
+
+    def message_callback(topic, message):
+        if topic in topics:
+            handler(topic, message)
+
+    async def start():
+        return await create_subscribe_socket(
+            ('0.0.0.0', port), loop=loop, message_callback=message_callback,
+            topic_filter=topics.__contains__, **options)
+
+    try:
+        protocol = loop.run_until_complete(start())
+    except OSError as exc:
+        log.error('worker %d could not open its socket: %s', index, exc)
+        commands.close()
+        return
+    if sys.platform.startswith('linux'):
+        protocol.socket.setsockopt(IPPROTO_IP, IP_MULTICAST_ALL, 0)
+
+    def read_command():
+        try:
+            command, topic, address = commands.recv()
+        except EOFError:
+            command = 'stop'
+        if command == 'subscribe':
+            if not groups[address]:
+                protocol.subscribe(address)
+            groups[address].add(topic)
+            topics.add(topic)
+        elif command == 'unsubscribe':
+            groups[address].discard(topic)
+            topics.discard(topic)
+            if not groups[address]:
+                protocol.unsubscribe(address)
+                del groups[address]
+        elif not stopped.done():
+            stopped.set_result(None)
+
+    loop.add_reader(commands.fileno(), read_command)
+    try:
+        loop.run_until_complete(stopped)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.remove_reader(commands.fileno())
+        protocol.close()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+
+class ShardedSubscriber:
+    """
+    Subscriber whose groups are shared out among worker processes.
+
+    Each of the ``workers`` processes binds its own socket to ``port`` and
+    joins only the groups of the bins that belong to it, using the same
+    topic hash as ``Interface``, so parsing and reassembly run on several
+    cores.  Workers are started when the subscriber is created, by
+    multiprocessing's forkserver, so that they inherit nothing of this
+    process's event loop; this is only available where the forkserver start
+    method is.
+
+    Completed messages are handled in one of two ways.  With a ``handler``,
+    each worker calls ``handler(topic, message)`` itself, and the callbacks
+    given to ``subscribe`` are not used; the handler is pickled to reach
+    the workers, so it must be a module-level function or similar.
+    Otherwise workers copy messages into a ring of ``ring_size`` bytes of
+    memory shared with this process, which reads them on ``loop`` and calls
+    the topic's callbacks; messages that find a worker's ring full are
+    dropped and counted in ``dropped``.
+
+    Other keyword arguments, which must be picklable too, are passed to
+    each worker's subscribe socket.
+    """
+
+    def __init__(self, network: IPv4Network, port: int,
+                 workers: int = None, handler: Callable = None,
+                 ring_size: int = None, loop=None, **options):
+        if _context is None:
+            raise RuntimeError('sharding needs the forkserver start method')
+        self._loop = asyncio.get_event_loop() if loop is None else loop
+        self._log = getLogger(__name__)
+        self._net = network
+        self._port = port
+        self._nbins = count_bins(network)
+        self._hash = hash_v1
+        self._handler = handler
+        self._topics = set()
+        self._topic_callbacks = defaultdict(list)
+        nworkers = (os.cpu_count() or 1) if workers is None else workers
+        ring_size = RING_SIZE if ring_size is None else ring_size
+
+        self._commands = []
+        self._rings = []
+        self._workers = []
+        for index in range(nworkers):
+            receiver, sender = _context.Pipe(duplex=False)
+            ring = None if handler is not None else _MessageRing(ring_size)
+            worker = _context.Process(
+                target=_run_worker,
+                args=(index, network, port, receiver, ring, handler, options),
+                name='umps-shard-%d' % index, daemon=True)
+            worker.start()
+            receiver.close()
+            self._commands.append(sender)
+            self._workers.append(worker)
+            if ring is not None:
+                self._rings.append(ring)
+                self._loop.add_reader(ring.signal_fd, self._read_ring, ring)
+
+    @property
+    def dropped(self) -> int:
+        """Messages dropped because a worker's ring was full."""
+        return sum(ring.dropped.value for ring in self._rings)
+
+    async def terminate(self):
+        for ring in self._rings:
+            self._loop.remove_reader(ring.signal_fd)
+        for commands in self._commands:
+            try:
+                commands.send(('stop', None, None))
+            except (BrokenPipeError, OSError):
+                pass
+            commands.close()
+        for worker in self._workers:
+            await self._loop.run_in_executor(None, worker.join)
+        for ring in self._rings:
+            ring.close()
+        self._rings = []
+
+    async def subscribe(self, topic: str,
+                        callback: Callable[[str, bytes], None] = None):
+        if callback is None and self._handler is None:
+            raise ValueError('a callback is needed without a handler')
+        index, address = self._shard_of(topic)
+        if not self._workers[index].is_alive():
+            raise NotConnectedError
+
+        if callback is not None:
+            self._topic_callbacks[topic].append(callback)
+        self._topics.add(topic)
+        self._commands[index].send(('subscribe', topic, address))
+
+    async def unsubscribe(self, topic: str):
+        index, address = self._shard_of(topic)
+        if not self._workers[index].is_alive():
+            raise NotConnectedError
+        if topic not in self._topics:
+            raise NotSubscribedError
+
+        self._topics.remove(topic)
+        self._topic_callbacks.pop(topic, None)
+        self._commands[index].send(('unsubscribe', topic, address))
+
+    def _shard_of(self, topic: str):
+        address_bin = self._hash(topic, self._nbins)
+        return (worker_of_bin(address_bin, len(self._workers)),
+                address_of_bin(self._net, address_bin))
+
+    def _read_ring(self, ring: _MessageRing):
+        for topic, message in ring.drain():
+            for callback in self._topic_callbacks.get(topic, ()):
+                callback(topic, message)
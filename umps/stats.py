@@ -0,0 +1,193 @@
+"""
+Protocol counters and latency histograms.
+
+A ``Stats`` object is shared by an interface's publisher, subscriber and
+dispatcher, which bump its integer counters in place and record timings in
+its histograms.  ``snapshot`` reads everything at once, for export to a
+monitoring system, and ``set_profiler`` times a sample of the work done on
+the receive and publish paths.
+"""
+from array import array
+from typing import Callable, Dict
+
+
+# sub-buckets per power of two of a histogram, bounding the error of a
+# recorded value to one part in 2 ** (HISTOGRAM_PRECISION - 1)
+HISTOGRAM_PRECISION = 6
+# resolution and range of latency histograms, in seconds; longer latencies
+# are recorded as the longest
+HISTOGRAM_UNIT = 1e-6
+HISTOGRAM_MAX = 3600
+
+# operations per one timed by the profiler
+PROFILE_INTERVAL = 2 ** 10
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram:
+    """
+    Distribution of durations, with bounded relative error.
+
+    As in an HDR histogram, values are counted in buckets of ``precision``
+    bits: exact below ``2 ** precision`` units, and above that in
+    ``2 ** (precision - 1)`` equal sub-buckets per power of two.  Recording
+    costs a few integer operations whatever the range, and percentiles are
+    read back to within the bucket's width.
+    """
+    __slots__ = ('unit', 'precision', 'count', 'total', 'min', 'max',
+                 '_counts', '_max_index')
+
+    def __init__(self, unit: float = HISTOGRAM_UNIT,
+                 max_value: float = HISTOGRAM_MAX,
+                 precision: int = HISTOGRAM_PRECISION):
+        if precision < 1:
+            raise ValueError('histogram precision must be at least 1 bit')
+        self.unit = unit
+        self.precision = precision
+        self._max_index = self._index(int(max_value / unit))
+        self._counts = array('Q', bytes(8 * (self._max_index + 1)))
+        self.reset()
+
+    def record(self, value: float):
+        units = int(value / self.unit)
+        if units < 0:
+            units = 0
+        index = self._index(units)
+        if index > self._max_index:
+            index = self._max_index
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float) -> float:
+        """
+        Lowest value of the bucket holding the given percentile, or 0 if
+        nothing was recorded.
+        """
+        if not self.count:
+            return 0
+        rank = max(self.count * percent / 100, 1)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return self._lowest(index) * self.unit
+        return self._lowest(self._max_index) * self.unit
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    def snapshot(self) -> Dict[str, float]:
+        """Count, mean, extremes and ``PERCENTILES`` of the values."""
+        snapshot = dict(count=self.count, mean=self.mean,
+                        min=self.min if self.count else 0, max=self.max)
+        for percent in PERCENTILES:
+            snapshot['p%s' % percent] = self.percentile(percent)
+        return snapshot
+
+    def reset(self):
+        for index in range(len(self._counts)):
+            self._counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.min = float('inf')
+        self.max = 0
+
+    def _index(self, units: int) -> int:
+        precision = self.precision
+        if units < 1 << precision:
+            return units
+        # above the exact range, buckets are told apart by the power of two
+        # and the next precision - 1 bits
+        shift = units.bit_length() - precision
+        return (shift << (precision - 1)) + (units >> shift)
+
+    def _lowest(self, index: int) -> int:
+        # smallest number of units counted in a bucket
+        precision = self.precision
+        if index < 1 << precision:
+            return index
+        shift = (index >> (precision - 1)) - 1
+        return (index - (shift << (precision - 1))) << shift
+
+
+class Stats:
+    """
+    Counters, gauges and histograms of an interface's protocols.
+
+    Counters are plain integer attributes, bumped in place on the paths they
+    count.  Gauges are functions read at snapshot time, added by the parts
+    of the interface that hold the state they report.  ``reassembly_latency``
+    records the time from a multi-frame message's first frame arriving to its
+    completion, and ``callback_time`` the time taken by each callback.
+    """
+    COUNTERS = ('frames_sent', 'bytes_sent', 'frames_received',
+                'bytes_received', 'messages_published', 'messages_completed',
+                'messages_dropped', 'local_messages', 'duplicate_frames',
+                'nacks_sent', 'nacks_received', 'drop_notices_sent',
+                'drop_notices_received')
+    __slots__ = COUNTERS + ('reassembly_latency', 'callback_time', 'profiler',
+                            '_gauges', '_interval', '_countdown')
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.reassembly_latency = Histogram()
+        self.callback_time = Histogram()
+        self._gauges = dict()
+        # called as ``profiler(stage, seconds)`` for sampled operations
+        self.profiler = None
+        self._interval = PROFILE_INTERVAL
+        self._countdown = PROFILE_INTERVAL
+
+    def add_gauge(self, name: str, read: Callable[[], float]):
+        """Report ``read()`` as ``name`` in each snapshot."""
+        self._gauges[name] = read
+
+    def set_profiler(self, profiler: Callable[[str, float], None] = None,
+                     interval: int = None):
+        """
+        Time one in every ``interval`` operations on the hot paths.
+
+        ``profiler(stage, seconds)`` is called with the time taken by each
+        sampled operation: ``'receive'`` for handling a received frame,
+        including any reassembly and delivery it completes,
+        ``'receive_batch'`` for handling a batch of frames from a batch
+        transport, and ``'publish'`` for framing and sending a message.
+        None stops profiling.
+        """
+        interval = PROFILE_INTERVAL if interval is None else interval
+        if interval < 1:
+            raise ValueError('profiling interval must be at least 1')
+        self.profiler = profiler
+        self._interval = self._countdown = interval
+
+    def sample(self) -> bool:
+        """Whether to profile the current operation."""
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = self._interval
+        return True
+
+    def snapshot(self) -> Dict[str, object]:
+        """Current counters, gauges and histogram summaries, by name."""
+        snapshot = {name: getattr(self, name) for name in self.COUNTERS}
+        for name, read in self._gauges.items():
+            snapshot[name] = read()
+        snapshot['reassembly_latency'] = self.reassembly_latency.snapshot()
+        snapshot['callback_time'] = self.callback_time.snapshot()
+        return snapshot
+
+    def reset(self):
+        """Zero the counters and histograms; gauges are left as they are."""
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.reassembly_latency.reset()
+        self.callback_time.reset()
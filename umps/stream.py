@@ -0,0 +1,156 @@
+from asyncio import get_event_loop
+from typing import Callable, List, Tuple
+
+from .dispatch import CONFLATE, DROP_NEWEST, DROP_OLDEST, OVERFLOW_POLICIES
+
+
+MAX_STREAM_SIZE = 2 ** 10
+
+
+class MessageStream:
+    """
+    Bounded stream of ``(topic, message)`` pairs, read by async iteration.
+
+    Messages are put into a ring of ``maxsize`` preallocated slots as they
+    arrive, without waiting on the consumer.  When the ring is full, the
+    overflow ``policy`` drops the oldest unread message or the new one; with
+    ``CONFLATE``, a new message replaces any unread message of its topic in
+    place, and otherwise the oldest is dropped.  ``dropped`` counts the
+    messages lost.
+
+    ``async for topic, message in stream`` reads messages one at a time, and
+    ``async for batch in stream.batches(max_items)`` reads every message
+    waiting, up to ``max_items``, at each step.  Iteration ends once the
+    stream is closed and emptied.  A stream has one consumer at a time.
+    """
+
+    def __init__(self, maxsize: int = None, policy: str = None, loop=None,
+                 on_close: Callable[['MessageStream'], None] = None):
+        self.maxsize = MAX_STREAM_SIZE if maxsize is None else maxsize
+        self.policy = DROP_OLDEST if policy is None else policy
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy %r' % self.policy)
+        if self.maxsize < 1:
+            raise ValueError('stream size must be at least 1')
+        self.loop = get_event_loop() if loop is None else loop
+        self.dropped = 0
+        self._slots = [None] * self.maxsize
+        # sequence numbers of the next message to read and to write
+        self._read = 0
+        self._write = 0
+        # sequence number of each topic's latest unread message, to conflate
+        self._latest = dict()
+        self._waiter = None
+        self._closed = False
+        self._on_close = on_close
+
+    def __len__(self):
+        return self._write - self._read
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, topic: str, message: bytes):
+        """Add a message, applying the overflow policy if the ring is full."""
+        if self._closed:
+            return
+        if self.policy == CONFLATE:
+            sequence = self._latest.get(topic)
+            if sequence is not None and sequence >= self._read:
+                self._slots[sequence % self.maxsize] = (topic, message)
+                self.dropped += 1
+                return
+        if self._write - self._read == self.maxsize:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return
+            self._slots[self._read % self.maxsize] = None
+            self._read += 1
+        if self.policy == CONFLATE:
+            self._latest[topic] = self._write
+        self._slots[self._write % self.maxsize] = (topic, message)
+        self._write += 1
+        self._wake()
+
+    def close(self):
+        """Stop taking messages; those already waiting can still be read."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    async def get(self) -> Tuple[str, bytes]:
+        """
+        Wait for the next message.
+
+        Raises StopAsyncIteration if the stream is closed and empty.
+        """
+        await self._wait()
+        return self._take(1)[0]
+
+    async def get_batch(self, max_items: int = None
+                        ) -> List[Tuple[str, bytes]]:
+        """
+        Wait for messages and return all that are waiting, up to
+        ``max_items``.
+
+        Raises StopAsyncIteration if the stream is closed and empty.
+        """
+        if max_items is not None and max_items < 1:
+            raise ValueError('batch size must be at least 1')
+        await self._wait()
+        return self._take(len(self) if max_items is None else max_items)
+
+    async def batches(self, max_items: int = None):
+        """
+        Iterate over batches of waiting messages.
+
+        Raises ValueError on the first step if ``max_items`` is less than 1.
+        """
+        while True:
+            try:
+                yield await self.get_batch(max_items)
+            except StopAsyncIteration:
+                return
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Tuple[str, bytes]:
+        return await self.get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    async def _wait(self):
+        while self._read == self._write:
+            if self._closed:
+                raise StopAsyncIteration
+            self._waiter = self.loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _take(self, count: int) -> List[Tuple[str, bytes]]:
+        slots = self._slots
+        end = min(self._read + count, self._write)
+        taken = []
+        for sequence in range(self._read, end):
+            index = sequence % self.maxsize
+            taken.append(slots[index])
+            slots[index] = None
+        self._read = end
+        if self._read == self._write:
+            self._latest.clear()
+        return taken
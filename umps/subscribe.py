@@ -1,25 +1,111 @@
 from asyncio import DatagramProtocol, get_event_loop
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from functools import partial
 from logging import getLogger
-from socket import (INADDR_ANY, IPPROTO_IP, IP_ADD_MEMBERSHIP,
-                    IP_DROP_MEMBERSHIP, inet_aton)
+from math import ceil
+from random import random
+from socket import (AF_INET, INADDR_ANY, IPPROTO_IP, IP_ADD_MEMBERSHIP,
+                    IP_DROP_MEMBERSHIP, SOCK_DGRAM, SOL_SOCKET, SO_REUSEADDR,
+                    inet_aton, socket)
 from struct import Struct
+from time import perf_counter
 
+from .compression import decompress
+from .dedup import DUPLICATE_WINDOW, DuplicateFilter
 from .exceptions import NotConnectedError
-from .parse import MESSAGE_DROPPED, Frame, parse, pack_request_message
-
-
-MAX_CACHE_SIZE = 2 ** 10
+from .parse import (COMPRESSED, FRAME_RESPONSE, MAX_DATAGRAM_SIZE,
+                    MAX_FRAMES, MESSAGE_DROPPED, PARITY_FRAME, SEQUENCE_BITS,
+                    SEQUENCE_MASK, TYPE_MASK, VERSION_TYPE_BYTE_POSITION,
+                    check_datagram_size, header_size_of, parse, parse_header,
+                    pack_frames_request, pack_message_request)
+from .reassembly import PartialMessage, StreamingMessage
+from .rtt import PeerTiming
+from .stats import Stats
+from .timers import TimerWheel
+from .transport import BatchDatagramTransport
+
+
+# upper bound in seconds of the random delay added before requesting frames
+NACK_JITTER = 0.05
+# seconds per tick of the reassembly timeout wheel
+TIMER_RESOLUTION = 0.01
+# limits on reassembly state, beyond which the oldest messages are dropped
+MAX_INCOMPLETE_MESSAGES = 2 ** 10
+MAX_INCOMPLETE_BYTES = 2 ** 26
+MAX_REQUEST_ROUNDS = 10
+# publishers whose timing is tracked, beyond which the least recently heard
+# from is forgotten
+MAX_PEERS = 2 ** 10
+# publishers' streams of messages to a group whose sequence numbers are
+# tracked, likewise
+MAX_STREAMS = 2 ** 10
+# most messages requested for one gap in a stream; a longer gap is taken for
+# a publisher that restarted
+MAX_SEQUENCE_GAP = 2 ** 6
+
+# reasons passed to the drop callback
+DROPPED_BY_PUBLISHER = 'publisher'
+DROPPED_FOR_CAPACITY = 'capacity'
+DROPPED_AFTER_RETRIES = 'retries'
+# complete, but compressed with an unknown codec or corrupted
+DROPPED_UNREADABLE = 'unreadable'
+
+# A run of a large message's body, passed on as soon as every byte before it
+# has arrived: ``data`` starts ``offset`` bytes into the body of message
+# ``uid`` and ``last`` marks the run that ends it.
+Chunk = namedtuple('Chunk', ['uid', 'offset', 'data', 'last'])
 
 
 async def create_subscribe_socket(local_addr, loop=None, timeout=None,
-                                  message_callback=None):
+                                  message_callback=None,
+                                  max_datagram_size=None, nack_jitter=None,
+                                  timer_resolution=None, drop_callback=None,
+                                  max_incomplete_messages=None,
+                                  max_incomplete_bytes=None,
+                                  max_request_rounds=None,
+                                  duplicate_window=None, topic_filter=None,
+                                  batch_receive=False,
+                                  receive_batch_size=None,
+                                  chunk_callback=None, chunk_filter=None,
+                                  stats=None):
+    """
+    Create a subscribe socket bound to ``local_addr``.
+
+    With ``batch_receive``, datagrams are drained up to
+    ``receive_batch_size`` at a time into reused buffers and handed to the
+    protocol together, instead of one by one through asyncio's transport.
+    """
     loop = get_event_loop() if loop is None else loop
     log = getLogger(__name__)
     log.debug('creating subscribe socket')
     factory = partial(SubscribeProtocol, loop=loop, timeout=timeout,
-                      message_callback=message_callback)
+                      message_callback=message_callback,
+                      max_datagram_size=max_datagram_size,
+                      nack_jitter=nack_jitter,
+                      timer_resolution=timer_resolution,
+                      drop_callback=drop_callback,
+                      max_incomplete_messages=max_incomplete_messages,
+                      max_incomplete_bytes=max_incomplete_bytes,
+                      max_request_rounds=max_request_rounds,
+                      duplicate_window=duplicate_window,
+                      topic_filter=topic_filter,
+                      chunk_callback=chunk_callback,
+                      chunk_filter=chunk_filter, stats=stats)
+    if batch_receive:
+        sock = socket(AF_INET, SOCK_DGRAM)
+        try:
+            sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            sock.setblocking(False)
+            sock.bind(local_addr)
+        except OSError:
+            sock.close()
+            raise
+        protocol = factory()
+        BatchDatagramTransport(loop, sock, protocol,
+                               protocol.max_datagram_size,
+                               receive_batch_size)
+        return protocol
+
     transport, protocol = await loop.create_datagram_endpoint(
         factory, local_addr=local_addr, reuse_address=True
     )
@@ -28,21 +114,139 @@ async def create_subscribe_socket(local_addr, loop=None, timeout=None,
 
 
 class SubscribeProtocol(DatagramProtocol):
+    """
+    Receives frames and reassembles them into messages.
+
+    Missing frames are requested from the publisher once they are overdue,
+    judged by the gaps seen between its frames: soon after the last frame
+    to arrive if the message stops short, and soon after a frame that
+    arrives ahead of a missing one, without waiting for the rest of the
+    message.  Later requests wait for the publisher's estimated round-trip
+    time, doubled each round, lengthened by random jitter and capped at
+    ``timeout`` seconds, as is the wait for a next frame.
+
+    Reassembly state is bounded: beyond ``max_incomplete_messages`` messages
+    or ``max_incomplete_bytes`` bytes of buffered frames, the oldest
+    incomplete messages are dropped, and a message whose missing frames have
+    been requested ``max_request_rounds`` times is given up on.  Each dropped
+    message is reported to ``drop_callback(topic, uid, reason)``, with the
+    topic None if the first frame never arrived.
+
+    A message whose uid skips ahead of the last seen in its publisher's
+    stream to the group reveals the messages in between, lost whole, which
+    are requested once overdue like missing frames, and reported with the
+    topic None if they can't be recovered.  Their topics are unknown, so
+    they are not requested from a stream once it has carried a message the
+    topic filter rejected.
+
+    Compressed messages are decompressed once complete, to at most
+    ``max_incomplete_bytes`` bytes; those that can't be, or would grow
+    larger, are dropped and reported too.
+
+    Parity frames rebuild a lost frame of their block of a message being
+    reassembled; they never start a reassembly, and are otherwise ignored.
+
+    Frames of the last ``duplicate_window`` completed or dropped messages
+    are recognised and ignored rather than starting a new reassembly.  So
+    are those of the last ``duplicate_window`` messages passed to
+    ``skip_message``, which aren't counted as duplicates, as every one of
+    their frames is expected.
+
+    If given, ``topic_filter(topic)`` is asked about each message as soon as
+    its first frame arrives.  Messages it rejects are never reassembled:
+    their uids are remembered in a separate window and their other frames
+    are discarded straight after the header is parsed, with no buffering,
+    timeouts or retransmission requests.  Call ``forget_ignored()`` when the
+    filter starts accepting a topic, so that frames still to come of its
+    messages are gathered again.
+
+    Messages of more than ``MAX_FRAMES`` frames are released in order as
+    they arrive, so only frames that arrive ahead of a missing one are held.
+    Unless ``chunk_filter(topic)`` rejects the message, given a
+    ``chunk_callback`` each released run of its body is passed on at once as
+    ``chunk_callback(topic, chunk)``, and the message is never held whole;
+    otherwise it is gathered and delivered like any other.  A streamed
+    message may still be dropped after some of its chunks were passed on.
+
+    Frames and bytes received, duplicates, completed and dropped messages,
+    requests sent and drop notices are counted in ``stats``, along with the
+    time each multi-frame message took to reassemble.
+    """
     _igmp_struct = Struct('!4sL')
 
-    def __init__(self, loop=None, timeout=None, message_callback=None):
+    def __init__(self, loop=None, timeout=None, message_callback=None,
+                 max_datagram_size=None, nack_jitter=None,
+                 timer_resolution=None, drop_callback=None,
+                 max_incomplete_messages=None, max_incomplete_bytes=None,
+                 max_request_rounds=None, duplicate_window=None,
+                 topic_filter=None, chunk_callback=None, chunk_filter=None,
+                 stats=None):
         self.loop = get_event_loop() if loop is None else loop
         self.log = getLogger(__name__)
         self.transport = None
         self.socket = None
+        # the longest wait for a frame, or for an answer to a request
         self.timeout = 3 if timeout is None else timeout
+        # Subscribers that lost the same frames spread out their requests, so
+        # the repair multicast in answer to the first one arrives before the
+        # others are due and resets their timeouts.
+        self.nack_jitter = NACK_JITTER if nack_jitter is None else nack_jitter
         self.message_cb = message_callback
-        # structures for consolidating multi-frame messages
-        self._incomplete_messages = dict()
-        self._missing_frames = dict()
-        self._message_timeouts = dict()
-        self._complete_messages = OrderedDict()
-        self._max_cache_size = MAX_CACHE_SIZE
+        self.drop_cb = drop_callback
+        self.chunk_cb = chunk_callback
+        self.chunk_filter = chunk_filter
+        # accept any frame size unless limited, so subscribers interoperate
+        # with publishers whatever their frame size
+        self.max_datagram_size = (MAX_DATAGRAM_SIZE
+                                  if max_datagram_size is None else
+                                  max_datagram_size)
+        check_datagram_size(self.max_datagram_size)
+        # structures for consolidating multi-frame messages, oldest first
+        self._incomplete_messages = OrderedDict()
+        self._incomplete_bytes = 0
+        self._max_incomplete_messages = (
+            MAX_INCOMPLETE_MESSAGES if max_incomplete_messages is None else
+            max_incomplete_messages)
+        self._max_incomplete_bytes = (
+            MAX_INCOMPLETE_BYTES if max_incomplete_bytes is None else
+            max_incomplete_bytes)
+        self._max_request_rounds = (
+            MAX_REQUEST_ROUNDS if max_request_rounds is None else
+            max_request_rounds)
+        # Timeouts of incomplete messages share one wheel, advanced by a
+        # single periodic callback that only runs while messages are pending.
+        self._resolution = (TIMER_RESOLUTION if timer_resolution is None else
+                            timer_resolution)
+        self._jitter_ticks = ceil(self.nack_jitter / self._resolution)
+        self._message_timeouts = TimerWheel()
+        self._tick_time = None
+        # arrival time of the datagrams being handled
+        self._now = 0.0
+        self._tick_handle = None
+        # source address -> timing of each publisher, least recent first
+        self._peers = OrderedDict()
+        # (source address, stream id) -> highest sequence number seen and
+        # whether the stream carries topics the filter rejects, least recent
+        # first
+        self._streams = OrderedDict()
+        # uid -> (source address, request rounds) of messages lost whole
+        self._missing_messages = OrderedDict()
+        # uids of the last ``duplicate_window`` completed or dropped messages
+        duplicate_window = (DUPLICATE_WINDOW if duplicate_window is None else
+                            duplicate_window)
+        self._complete_messages = DuplicateFilter(duplicate_window)
+        # uids of messages delivered by other means
+        self._skipped_messages = DuplicateFilter(duplicate_window)
+        # uids of messages on topics the filter rejected
+        self.topic_filter = topic_filter
+        self._ignored_messages = DuplicateFilter(duplicate_window)
+        self.stats = Stats() if stats is None else stats
+        self.stats.add_gauge('incomplete_messages',
+                             self._incomplete_messages.__len__)
+        self.stats.add_gauge('incomplete_bytes',
+                             lambda: self._incomplete_bytes)
+        self.stats.add_gauge('missing_messages',
+                             self._missing_messages.__len__)
 
     def connection_made(self, transport):
         self.transport = transport
@@ -53,17 +257,84 @@ class SubscribeProtocol(DatagramProtocol):
         self.socket = None
 
     def datagram_received(self, data, addr):
-        frame = parse(data)
-
-        if frame.frame_type == MESSAGE_DROPPED:
-            self._clean_up_message(frame.uid)
-        elif frame.uid in self._incomplete_messages:
-            self._receive_known_message_frame(frame)
-        elif frame.uid in self._complete_messages:
-            self.log.warning('received duplicate frame from already-complete '
-                             'message')
+        if len(data) > self.max_datagram_size:
+            self.log.warning('received frame larger than maximum datagram '
+                             'size; ignoring frame')
+            return
+        stats = self.stats
+        stats.frames_received += 1
+        stats.bytes_received += len(data)
+        start = (perf_counter() if stats.profiler is not None and
+                 stats.sample() else None)
+
+        self._now = self.loop.time()
+        self._receive(data, addr)
+        self._start_timer()
+
+        if start is not None:
+            stats.profiler('receive', perf_counter() - start)
+
+    def datagrams_received(self, datagrams):
+        """
+        Handle a batch of ``(data, addr)`` pairs from a batch transport.
+
+        The data may be views of buffers that are reused once this returns.
+        The whole batch is handled as if it arrived at once: the clock is
+        read, the counters are updated, the timer is started and the
+        profiler is sampled once for it rather than for each datagram.
+        """
+        stats = self.stats
+        start = (perf_counter() if stats.profiler is not None and
+                 stats.sample() else None)
+
+        self._now = self.loop.time()
+        receive = self._receive
+        max_datagram_size = self.max_datagram_size
+        frames = nbytes = 0
+        for data, addr in datagrams:
+            if len(data) > max_datagram_size:
+                self.log.warning('received frame larger than maximum '
+                                 'datagram size; ignoring frame')
+                continue
+            frames += 1
+            nbytes += len(data)
+            receive(data, addr)
+        stats.frames_received += frames
+        stats.bytes_received += nbytes
+        self._start_timer()
+
+        if start is not None:
+            stats.profiler('receive_batch', perf_counter() - start)
+
+    def _receive(self, data, addr):
+        # one datagram of a size already checked, arrived at ``self._now``
+        frame_type, uid, frame_number, total_frames = parse_header(data)
+
+        if frame_type == MESSAGE_DROPPED:
+            self.stats.drop_notices_received += 1
+            self._drop_message(uid, DROPPED_BY_PUBLISHER)
+        elif frame_type == PARITY_FRAME:
+            if uid in self._incomplete_messages:
+                self._add_parity(uid, frame_number, total_frames, data)
+        elif uid in self._incomplete_messages:
+            self._update_incomplete_message(uid, frame_number, data)
+        elif uid in self._ignored_messages:
+            # most traffic in a busy group, so not worth logging
+            pass
+        elif uid in self._skipped_messages:
+            # the multicast loopback copy of a message delivered locally
+            pass
+        elif uid in self._complete_messages:
+            # routine with multicast repairs requested by other subscribers
+            self.stats.duplicate_frames += 1
         else:
-            self._receive_unknown_message_frame(frame, addr)
+            unwanted = frame_number == 0 and self._is_unwanted(data)
+            self._check_sequence(uid, addr, unwanted)
+            if unwanted:
+                self._ignored_messages.add(uid)
+            else:
+                self._receive_unknown_message_frame(uid, frame_number,
+                                                    total_frames, data, addr)
 
     def subscribe(self, address):
         if self.socket is None:
@@ -79,97 +350,330 @@ class SubscribeProtocol(DatagramProtocol):
 
         self._send_igmp(address, IP_DROP_MEMBERSHIP)
 
+    def skip_message(self, uid: int):
+        """Ignore the frames of a message delivered by other means."""
+        self._skipped_messages.add(uid)
+
+    def forget_ignored(self):
+        """Stop ignoring the messages the topic filter has rejected."""
+        self._ignored_messages = DuplicateFilter(
+            self._ignored_messages.capacity)
+
     def close(self):
+        if self._tick_handle is not None:
+            self._tick_handle.cancel()
+            self._tick_handle = None
         if self.transport is not None:
             self.transport.close()
 
-    def _receive_known_message_frame(self, frame: Frame):
-        if frame.uid not in self._incomplete_messages:
-            self.log.error('cannot update incomplete message: partial message '
-                           'not found')
-            return
-
-        self._update_incomplete_message(frame)
-
-    def _receive_unknown_message_frame(self, frame: Frame, source_address):
+    def _receive_unknown_message_frame(self, uid, frame_number, total_frames,
+                                       data, source_address):
         # if this is a single-frame message, immediately return it
-        if frame.frame_number == 0 and frame.total_frames == 1:
-            self._complete_message(frame.uid, frame.topic, frame.body)
+        if frame_number == 0 and total_frames == 1:
+            # copy views of reused receive buffers; bytes are left as they are
+            frame = parse(bytes(data))
+            self._complete_message(uid, frame.topic, frame.body,
+                                   frame.compressed)
             return
 
-        self._start_incomplete_message(frame, source_address)
-
-    def _start_incomplete_message(self, frame, source_address):
-        # set up the structure to store message frames
-        all_frames = [None]*frame.total_frames
-        all_frames[frame.frame_number] = frame
-        self._incomplete_messages[frame.uid] = all_frames
-
-        # record which frames are missing and set up a timeout to ask for the
-        # missing frames to be resent
-        remaining_frames = set(range(frame.total_frames))
-        remaining_frames.remove(frame.frame_number)
-        self._missing_frames[frame.uid] = remaining_frames
+        self._start_incomplete_message(uid, frame_number, total_frames, data,
+                                       source_address)
+
+    def _start_incomplete_message(self, uid, frame_number, total_frames, data,
+                                  source_address):
+        # set up the structure to store message frames, with a timeout to
+        # ask for the missing frames to be resent
+        peer = self._peer(source_address)
+        delay = self._request_ticks(peer.gap_timeout(self.timeout))
+        if total_frames > MAX_FRAMES:
+            message = StreamingMessage(total_frames, source_address, delay,
+                                       self._wants_chunks,
+                                       partial(self._deliver_chunk, uid))
+        else:
+            message = PartialMessage(total_frames, source_address, delay)
+        message.start_time = self._now
+        self._incomplete_messages[uid] = message
+        self._message_timeouts.schedule(uid, delay)
+        self._update_incomplete_message(uid, frame_number, data)
+
+        while len(self._incomplete_messages) > self._max_incomplete_messages:
+            self._drop_oldest_message()
+
+    def _update_incomplete_message(self, uid, frame_number, data):
+        message = self._incomplete_messages[uid]
+        if not message.is_missing(frame_number):
+            self.stats.duplicate_frames += 1
+            return
+        if frame_number == 0 and self._is_unwanted(data):
+            # later frames arrived first; forget what was gathered of them
+            self._ignore_message(uid)
+            self._check_sequence(uid, message.source, True)
+            return
 
-        check_time = self.loop.time() + self.timeout
-        self._message_timeouts[frame.uid] = check_time
-        self.loop.call_at(check_time, self._ensure_message, source_address,
-                          frame.uid, frame.total_frames)
+        nbytes = message.nbytes
+        try:
+            complete = message.add_frame(frame_number, data)
+        except ValueError as exc:
+            self.log.warning('ignoring frame %d of message %s: %s',
+                             frame_number, hex(uid), exc)
+            return
+        self._incomplete_bytes += message.nbytes - nbytes
+        self._frame_arrived(uid, message, frame_number, data, complete)
+        self._message_updated(uid, message, complete, data)
+
+    def _frame_arrived(self, uid, message, frame_number, data, complete):
+        now = self._now
+        peer = self._peer(message.source)
+        if message.request_rounds:
+            # only the answer to a first request is unambiguous
+            if (message.request_rounds == 1 and message.request_time and
+                    data[VERSION_TYPE_BYTE_POSITION] & TYPE_MASK ==
+                    FRAME_RESPONSE):
+                peer.rtt.update(now - message.request_time)
+                message.request_time = 0
+        elif not complete:
+            if message.frame_time:
+                peer.gap.update(now - message.frame_time)
+            message.request_delay = self._request_ticks(
+                peer.gap_timeout(self.timeout))
+            if (frame_number and not message.gap_detected and
+                    message.is_missing(frame_number - 1)):
+                # frames are sent in order, so the one before this is late;
+                # request it soon rather than when the message stops
+                message.gap_detected = True
+                self._message_timeouts.schedule(uid, message.request_delay)
+        message.frame_time = now
+
+    def _check_sequence(self, uid, source, unwanted=False):
+        # A message seen for the first time: note any messages its stream
+        # skipped since the highest seen, and stop waiting for this one.
+        # Lost messages may be on any topic of the stream's group, so once a
+        # stream has carried a topic the filter rejects, none are requested.
+        self._missing_messages.pop(uid, None)
+        key = (source, uid >> SEQUENCE_BITS)
+        sequence = uid & SEQUENCE_MASK
+        state = self._streams.get(key)
+        if state is None:
+            self._streams[key] = (sequence, unwanted)
+            while len(self._streams) > MAX_STREAMS:
+                self._streams.popitem(last=False)
+            return
+        self._streams.move_to_end(key)
+        highest, filtered = state
+        if unwanted and not filtered:
+            filtered = True
+            self._forget_missing_messages(uid >> SEQUENCE_BITS, source)
+        self._streams[key] = (max(sequence, highest), filtered)
+        if filtered or not 0 < sequence - highest - 1 <= MAX_SEQUENCE_GAP:
+            return
 
-    def _update_incomplete_message(self, frame: Frame):
-        self._incomplete_messages[frame.uid][frame.frame_number] = frame
-        self._missing_frames[frame.uid].remove(frame.frame_number)
+        self.log.debug('messages %d to %d of stream %s missing', highest + 1,
+                       sequence - 1, hex(key[1]))
+        delay = self._request_ticks(self._peer(source).gap_timeout(
+            self.timeout))
+        stream = uid & ~SEQUENCE_MASK
+        for missing in range(highest + 1, sequence):
+            self._missing_messages[stream | missing] = (source, 0)
+            self._message_timeouts.schedule(stream | missing, delay)
+        while len(self._missing_messages) > self._max_incomplete_messages:
+            self._drop_message(next(iter(self._missing_messages)),
+                               DROPPED_FOR_CAPACITY)
+
+    def _forget_missing_messages(self, stream_id, source):
+        # stop requesting a stream's lost messages, without reporting them
+        for uid, (missing_source, _) in tuple(self._missing_messages.items()):
+            if uid >> SEQUENCE_BITS == stream_id and missing_source == source:
+                del self._missing_messages[uid]
+                self._message_timeouts.cancel(uid)
+
+    def _add_parity(self, uid, block, block_size, data):
+        message = self._incomplete_messages[uid]
+        nbytes = message.nbytes
+        try:
+            complete = message.add_parity(block, block_size, data)
+        except ValueError as exc:
+            self.log.warning('ignoring parity frame %d of message %s: %s',
+                             block, hex(uid), exc)
+            return
+        self._incomplete_bytes += message.nbytes - nbytes
+        self._message_updated(uid, message, complete, data)
 
+    def _message_updated(self, uid, message, complete, data):
         # if this was the last frame, complete the message
-        if not self._missing_frames[frame.uid]:
-            all_frames = self._incomplete_messages[frame.uid]
-            topic = all_frames[0].topic
-            body = b''.join([f.body for f in all_frames])
-            self._complete_message(frame.uid, topic, body)
+        if complete:
+            # release the message's accounting before trimming its buffer
+            self._clean_up_message(uid)
+            self.stats.messages_completed += 1
+            self.stats.reassembly_latency.record(self._now -
+                                                 message.start_time)
+            topic, body = message.assemble()
+            if body is None:
+                # passed on in chunks as it arrived
+                return
+            # every frame of a compressed message is flagged
+            self._deliver(uid, topic, body,
+                          data[VERSION_TYPE_BYTE_POSITION] & COMPRESSED)
         else:
-            # not the last frame, so update the timeout that triggers
-            # requesting missing frames
-            self._message_timeouts[frame.uid] = self.loop.time() + self.timeout
-
-    def _complete_message(self, uid, topic, message_body):
+            # not the last frame, so postpone the timeout that triggers
+            # requesting missing frames, unless some are already overdue
+            if not message.gap_detected:
+                self._message_timeouts.schedule(uid, message.request_delay)
+            while self._incomplete_bytes > self._max_incomplete_bytes:
+                self._drop_oldest_message()
+
+    def _complete_message(self, uid, topic, message_body, compressed):
         # clean up multi-framing structures
         self._clean_up_message(uid)
-
-        # cache the complete message's UID to ignore duplicate frames that
-        # may have been slowed on the network
-        self._complete_messages[uid] = None
-        while len(self._complete_messages) > self._max_cache_size:
-            self._complete_messages.popitem(last=False)
+        self.stats.messages_completed += 1
 
         # call the callback with the topic and message contents
-        self.message_cb(topic, message_body)
+        self._deliver(uid, topic, message_body, compressed)
+
+    def _deliver(self, uid, topic, body, compressed):
+        if compressed:
+            try:
+                body = decompress(body, self._max_incomplete_bytes)
+            except ValueError as exc:
+                self.log.warning('cannot decompress message %s: %s',
+                                 hex(uid), exc)
+                self.stats.messages_dropped += 1
+                if self.drop_cb is not None:
+                    self.drop_cb(topic, uid, DROPPED_UNREADABLE)
+                return
+        self.message_cb(topic, body)
+
+    def _wants_chunks(self, topic) -> bool:
+        return self.chunk_cb is not None and (self.chunk_filter is None or
+                                              self.chunk_filter(topic))
+
+    def _deliver_chunk(self, uid, topic, offset, data, last):
+        self.chunk_cb(topic, Chunk(uid, offset, data, last))
+
+    def _drop_message(self, uid, reason):
+        missing = uid in self._missing_messages
+        message = self._clean_up_message(uid)
+        if message is None and not missing:
+            return
+
+        self.log.debug('dropped incomplete message %s (%s)', hex(uid), reason)
+        self.stats.messages_dropped += 1
+        if self.drop_cb is not None:
+            self.drop_cb(None if message is None else message.topic, uid,
+                         reason)
+
+    def _drop_oldest_message(self):
+        uid = next(iter(self._incomplete_messages))
+        self._drop_message(uid, DROPPED_FOR_CAPACITY)
+
+    def _is_unwanted(self, data) -> bool:
+        # decode only the topic from a first frame
+        if self.topic_filter is None:
+            return False
+        header_size = header_size_of(data)
+        if len(data) <= header_size:
+            return False
+        topic_end = header_size + 1 + data[header_size]
+        topic = bytes(data[header_size + 1:topic_end]).decode('utf-8',
+                                                              'replace')
+        return not self.topic_filter(topic)
+
+    def _ignore_message(self, uid):
+        self._ignored_messages.add(uid)
+        self._message_timeouts.cancel(uid)
+        message = self._incomplete_messages.pop(uid)
+        self._incomplete_bytes -= message.nbytes
+
+    def _peer(self, source) -> PeerTiming:
+        peer = self._peers.get(source)
+        if peer is None:
+            peer = self._peers[source] = PeerTiming()
+            while len(self._peers) > MAX_PEERS:
+                self._peers.popitem(last=False)
+        else:
+            self._peers.move_to_end(source)
+        return peer
+
+    def _request_ticks(self, timeout: float) -> int:
+        # plus up to ``nack_jitter``, and a tick for the one under way
+        return (ceil(timeout / self._resolution) + 1 +
+                int(random() * (self._jitter_ticks + 1)))
 
     def _clean_up_message(self, uid):
-        if uid in self._incomplete_messages:
-            self._incomplete_messages.pop(uid)
-        if uid in self._missing_frames:
-            self._missing_frames.pop(uid)
-        if uid in self._message_timeouts:
-            self._message_timeouts.pop(uid)
-
-    def _ensure_message(self, source_address, uid, total_frames):
-        # if the message is complete we're done
-        if uid not in self._message_timeouts:
+        # cache the finished message's UID to ignore duplicate frames that
+        # may have been slowed on the network
+        self._complete_messages.add(uid)
+
+        self._message_timeouts.cancel(uid)
+        self._missing_messages.pop(uid, None)
+        message = self._incomplete_messages.pop(uid, None)
+        if message is not None:
+            self._incomplete_bytes -= message.nbytes
+        return message
+
+    def _start_timer(self):
+        # once the datagrams that may have scheduled timeouts are handled
+        if self._tick_handle is None and self._message_timeouts:
+            self._tick_time = self.loop.time()
+            self._tick_handle = self.loop.call_at(
+                self._tick_time + self._resolution, self._tick)
+
+    def _tick(self):
+        if self.transport is None:
+            self._tick_handle = None
             return
 
-        # if the call time has been updated, call again later
-        if self.loop.time() < self._message_timeouts[uid]:
-            when = self._message_timeouts[uid]
+        # catch up on every tick that has passed, however late this runs
+        now = self.loop.time()
+        ticks = max(int((now - self._tick_time) / self._resolution), 1)
+        self._tick_time += ticks * self._resolution
+        for uid in self._message_timeouts.advance(ticks):
+            self._ensure_message(uid)
+
+        if self._message_timeouts:
+            self._tick_handle = self.loop.call_at(
+                self._tick_time + self._resolution, self._tick)
         else:
-            # timeout triggered: request missing messages and wait again
-            self.log.debug('timed out waiting for frames for message %s',
-                           hex(uid))
-            self._request_missing_frames(source_address, uid, total_frames,
-                                         *self._missing_frames[uid])
-            when = self.loop.time() + self.timeout
+            self._tick_handle = None
+
+    def _ensure_message(self, uid):
+        # if the message is complete we're done
+        message = self._incomplete_messages.get(uid)
+        if message is None:
+            if uid in self._missing_messages:
+                self._ensure_missing_message(uid)
+            return
+
+        if message.request_rounds >= self._max_request_rounds:
+            self._drop_message(uid, DROPPED_AFTER_RETRIES)
+            return
+
+        # timeout triggered: request missing messages and wait again
+        self.log.debug('timed out waiting for frames for message %s', hex(uid))
+        message.request_rounds += 1
+        self._request_missing_frames(message.source, uid, message.total_frames,
+                                     *message.missing_frames())
+        message.request_time = self.loop.time()
+        message.gap_detected = False
+        message.request_delay = self._request_ticks(
+            self._peer(message.source).retry_timeout(message.request_rounds,
+                                                     self.timeout))
+        self._message_timeouts.schedule(uid, message.request_delay)
+
+    def _ensure_missing_message(self, uid):
+        source, rounds = self._missing_messages[uid]
+        if rounds >= self._max_request_rounds:
+            self._drop_message(uid, DROPPED_AFTER_RETRIES)
+            return
+        if self.transport is None:
+            raise NotConnectedError
 
-        self.loop.call_at(when, self._ensure_message, source_address, uid,
-                          total_frames)
+        self.log.debug('requesting missing message %s', hex(uid))
+        rounds += 1
+        self._missing_messages[uid] = (source, rounds)
+        self.transport.sendto(pack_message_request(uid), source)
+        self.stats.nacks_sent += 1
+        self._message_timeouts.schedule(uid, self._request_ticks(
+            self._peer(source).retry_timeout(rounds, self.timeout)))
 
     def _request_missing_frames(self, address, uid, total_frames,
                                 *frame_numbers):
@@ -178,9 +682,9 @@ class SubscribeProtocol(DatagramProtocol):
 
         self.log.debug('requesting missing frames %s for message %s',
                        frame_numbers, hex(uid))
-        for frame_number in frame_numbers:
-            request = pack_request_message(uid, frame_number, total_frames)
-            self.transport.sendto(request, address)
+        request = pack_frames_request(uid, total_frames, frame_numbers)
+        self.transport.sendto(request, address)
+        self.stats.nacks_sent += 1
 
     def _send_igmp(self, address: str, request_type: int):
         group = inet_aton(address)
@@ -0,0 +1,115 @@
+import unittest
+
+from umps import parse
+from umps.cache import RetransmissionCache
+
+
+DESTINATION = ('239.0.0.1', 5000)
+# one byte of topic size, one of topic and the body
+MESSAGE_SIZE = 2 + 100
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def frames_of(uid, body=bytes(100)):
+    return parse.pack_headers(uid, 't', body)
+
+
+def payload(frames):
+    # what the cache keeps of a message: its frames without their headers
+    return b''.join(bytes(header[parse.HEADER_SIZE:]) +
+                    bytes(body) for header, body in frames)
+
+
+class RetransmissionCacheEviction(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = RetransmissionCache(4 * MESSAGE_SIZE - 1, max_age=10,
+                                         clock=self.clock)
+
+    def test_oldest_evicted_first(self):
+        for uid in range(3):
+            self.cache.put(uid, DESTINATION, frames_of(uid))
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.nbytes, 3 * MESSAGE_SIZE)
+        # the fourth wraps round over the first
+        self.cache.put(3, DESTINATION, frames_of(3))
+        self.assertNotIn(0, self.cache)
+        self.assertEqual([uid in self.cache for uid in range(1, 4)],
+                         [True] * 3)
+        self.assertEqual(self.cache.peek(3).offset, 0)
+        self.assertEqual(self.cache.evictions, 1)
+        self.cache.put(4, DESTINATION, frames_of(4))
+        self.assertNotIn(1, self.cache)
+        self.assertEqual(self.cache.evictions, 2)
+
+    def test_wrapped_entries_read_back(self):
+        for uid in range(8):
+            body = bytes([uid]) * 100
+            self.cache.put(uid, DESTINATION, frames_of(uid, body))
+            entry = self.cache.lookup(uid)
+            response, = self.cache.frames(uid, entry, [0])
+            self.assertEqual(bytes(response[1]),
+                             payload(frames_of(uid, body)))
+        self.assertEqual(self.cache.hits, 8)
+        self.assertIsNone(self.cache.lookup(0))
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_too_large_not_cached(self):
+        self.cache.put(0, DESTINATION, frames_of(0))
+        self.cache.put(1, DESTINATION, frames_of(1, bytes(4 * MESSAGE_SIZE)))
+        self.assertNotIn(1, self.cache)
+        self.assertIn(0, self.cache)
+
+    def test_max_messages(self):
+        cache = RetransmissionCache(2 ** 12, max_messages=2)
+        for uid in range(3):
+            cache.put(uid, DESTINATION, frames_of(uid))
+        self.assertEqual(list(cache._entries), [1, 2])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expiry(self):
+        self.cache.put(0, DESTINATION, frames_of(0))
+        self.clock.now = 5
+        self.cache.put(1, DESTINATION, frames_of(1))
+        self.clock.now = 12
+        self.assertIsNone(self.cache.peek(0))
+        self.assertIsNotNone(self.cache.peek(1))
+        self.assertEqual(self.cache.expirations, 1)
+        self.assertEqual(self.cache.evictions, 0)
+
+
+class RetransmissionCacheFrames(unittest.TestCase):
+
+    def test_frames_rebuilt(self):
+        cache = RetransmissionCache(2 ** 12)
+        body = bytes(range(256)) * 4
+        frames = frames_of(7, body)
+        self.assertGreater(len(frames), 2)
+        cache.put(7, DESTINATION, frames)
+        entry = cache.lookup(7)
+        responses = cache.frames(7, entry, range(len(frames)))
+        self.assertEqual(b''.join(bytes(view) for _, view in responses),
+                         payload(frames))
+        for number, (header, view) in enumerate(responses):
+            self.assertEqual(parse.parse_header(header),
+                             (parse.FRAME_RESPONSE, 7, number, len(frames)))
+
+    def test_out_of_range_frames_skipped(self):
+        cache = RetransmissionCache(2 ** 12)
+        frames = frames_of(7, bytes(1000))
+        cache.put(7, DESTINATION, frames)
+        entry = cache.lookup(7)
+        last = len(frames) - 1
+        responses = cache.frames(7, entry, [last, last + 1, 255])
+        self.assertEqual([parse.parse_header(header)[2]
+                          for header, _ in responses], [last])
+        self.assertEqual(cache.frames(7, entry, [last + 1]), [])
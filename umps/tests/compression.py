@@ -0,0 +1,68 @@
+import random
+import unittest
+import zlib
+
+from umps import compression
+
+
+class CompressionRoundTrip(unittest.TestCase):
+
+    def test_round_trip(self):
+        body = b'{"price": 101.5, "size": 300}' * 100
+        compressed = compression.compress(body, compression.ZLIB)
+        self.assertLess(len(compressed), len(body) // 5)
+        self.assertEqual(compressed[0], compression.ZLIB.codec_id)
+        self.assertEqual(compression.decompress(compressed), body)
+        self.assertEqual(compression.decompress(bytearray(compressed)), body)
+
+    def test_not_worth_compressing(self):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        short = b'a' * (compression.COMPRESSION_THRESHOLD - 1)
+        self.assertIsNone(compression.compress(short, compression.ZLIB))
+        self.assertIsNotNone(compression.compress(short, compression.ZLIB,
+                                                  threshold=0))
+        noise = random.getrandbits(8 * 4096).to_bytes(4096, 'little')
+        self.assertIsNone(compression.compress(noise, compression.ZLIB))
+
+    def test_unreadable(self):
+        for body in (b'', b'\xff' + zlib.compress(b'data'),
+                     bytes((compression.ZLIB.codec_id,)) + b'not zlib'):
+            with self.assertRaises(ValueError):
+                compression.decompress(body)
+
+    def test_limit(self):
+        body = b'{"price": 101.5, "size": 300}' * 100
+        compressed = compression.compress(body, compression.ZLIB)
+        self.assertEqual(compression.decompress(compressed, len(body)), body)
+        with self.assertRaises(ValueError):
+            compression.decompress(compressed, len(body) - 1)
+        # stops at the limit however far the body would expand
+        bomb = compression.compress(bytes(2 ** 26), compression.ZLIB)
+        self.assertLess(len(bomb), 2 ** 17)
+        with self.assertRaises(ValueError):
+            compression.decompress(bomb, 2 ** 16)
+
+    def test_truncated(self):
+        body = b'{"price": 101.5, "size": 300}' * 100
+        compressed = compression.compress(body, compression.ZLIB)
+        for end in (len(compressed) - 4, len(compressed) // 2):
+            with self.assertRaises(ValueError):
+                compression.decompress(compressed[:end])
+            with self.assertRaises(ValueError):
+                compression.decompress(compressed[:end], len(body))
+
+    def test_register_codec(self):
+        codec = compression.register_codec(
+            'reversed-test', 200, lambda data: bytes(data)[::-1],
+            lambda data, limit: bytes(data)[::-1])
+        self.assertIs(compression.get_codec('reversed-test'), codec)
+        body = bytes(range(100)) * 10
+        compressed = bytes((200,)) + body[::-1]
+        self.assertEqual(compression.decompress(compressed), body)
+        with self.assertRaises(ValueError):
+            compression.register_codec('other-test', 200, bytes, bytes)
+        with self.assertRaises(ValueError):
+            compression.register_codec('bad-test', 0, bytes, bytes)
+        with self.assertRaises(ValueError):
+            compression.get_codec('no-such-codec')
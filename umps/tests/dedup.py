@@ -0,0 +1,41 @@
+import random
+import unittest
+from collections import deque
+
+from umps.dedup import DuplicateFilter
+
+
+class DuplicateFilterWindow(unittest.TestCase):
+    ITERS = 2**13
+
+    def check_against_window(self, capacity):
+        # Seed generator for reproducible test.
+        random.seed(capacity)
+        duplicates = DuplicateFilter(capacity)
+        window = deque()
+        for i in range(self.ITERS):
+            uid = random.choice((random.getrandbits(64),
+                                 random.randrange(2 * capacity),
+                                 (7 << 32) | i))
+            self.assertEqual(uid in duplicates, uid in window)
+            if uid not in window:
+                window.append(uid)
+                if len(window) > capacity:
+                    window.popleft()
+            duplicates.add(uid)
+            self.assertEqual(len(duplicates), len(window))
+
+    def test_window(self):
+        for capacity in (1, 2, 3, 64, 1000):
+            self.check_against_window(capacity)
+
+    def test_oldest_forgotten(self):
+        duplicates = DuplicateFilter(4)
+        for uid in range(6):
+            duplicates.add(uid)
+        self.assertEqual([uid in duplicates for uid in range(6)],
+                         [False, False, True, True, True, True])
+
+    def test_invalid_capacity(self):
+        with self.assertRaises(ValueError):
+            DuplicateFilter(0)
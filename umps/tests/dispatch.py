@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from umps.dispatch import (CONFLATE, DROP_NEWEST, DROP_OLDEST, Dispatcher,
+                           QueueStats)
+
+
+class DispatcherQueues(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.received = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def callback(self, topic, message):
+        self.received.append((topic, message))
+
+    def dispatch(self, dispatcher, topic, messages, callbacks=None):
+        for message in messages:
+            dispatcher.dispatch(topic, message,
+                                callbacks or [self.callback])
+
+    def run_queued(self, dispatcher):
+        async def wait():
+            while any(queue.task is not None
+                      for queue in dispatcher._queues.values()):
+                await asyncio.sleep(0.001)
+
+        self.loop.run_until_complete(asyncio.wait_for(wait(), 5))
+
+    def test_drop_oldest(self):
+        dispatcher = Dispatcher(self.loop, 2, DROP_OLDEST)
+        self.dispatch(dispatcher, 't', range(5))
+        self.assertEqual(dispatcher.queue_stats('t'), QueueStats(2, 0, 3))
+        self.run_queued(dispatcher)
+        self.assertEqual(self.received, [('t', 3), ('t', 4)])
+        self.assertEqual(dispatcher.queue_stats('t'), QueueStats(0, 2, 3))
+
+    def test_drop_newest(self):
+        dispatcher = Dispatcher(self.loop, 2, DROP_NEWEST)
+        self.dispatch(dispatcher, 't', range(5))
+        self.run_queued(dispatcher)
+        self.assertEqual(self.received, [('t', 0), ('t', 1)])
+        self.assertEqual(dispatcher.queue_stats('t'), QueueStats(0, 2, 3))
+
+    def test_conflate(self):
+        dispatcher = Dispatcher(self.loop, 10, CONFLATE)
+        self.dispatch(dispatcher, 'a', range(3))
+        self.dispatch(dispatcher, 'b', range(2))
+        self.run_queued(dispatcher)
+        self.assertEqual(sorted(self.received), [('a', 2), ('b', 1)])
+        self.assertEqual(dispatcher.queue_stats('a'), QueueStats(0, 1, 2))
+
+    def test_topics_configured_apart(self):
+        dispatcher = Dispatcher(self.loop, 4)
+        dispatcher.configure('small', max_queue_size=1)
+        dispatcher.configure('latest', overflow_policy=CONFLATE)
+        self.dispatch(dispatcher, 'small', range(3))
+        self.dispatch(dispatcher, 'latest', range(3))
+        self.dispatch(dispatcher, 'other', range(3))
+        self.run_queued(dispatcher)
+        self.assertEqual(
+            sorted(self.received),
+            [('latest', 2), ('other', 0), ('other', 1), ('other', 2),
+             ('small', 2)])
+        with self.assertRaises(ValueError):
+            dispatcher.configure('t', overflow_policy='unknown')
+        with self.assertRaises(ValueError):
+            dispatcher.configure('t', max_queue_size=0)
+        with self.assertRaises(ValueError):
+            Dispatcher(self.loop, overflow_policy='unknown')
+
+    def test_coroutine_callbacks_awaited(self):
+        async def callback(topic, message):
+            await asyncio.sleep(0.001)
+            self.received.append(('coroutine', message))
+
+        dispatcher = Dispatcher(self.loop)
+        self.dispatch(dispatcher, 't', range(3), [callback, self.callback])
+        self.run_queued(dispatcher)
+        self.assertEqual(self.received,
+                         [('coroutine', 0), ('t', 0), ('coroutine', 1),
+                          ('t', 1), ('coroutine', 2), ('t', 2)])
+        self.assertEqual(dispatcher.stats.callback_time.count, 6)
+
+    def test_executor_runs_plain_callbacks(self):
+        threads = []
+
+        def callback(topic, message):
+            threads.append(threading.get_ident())
+            self.received.append((topic, message))
+
+        async def coroutine(topic, message):
+            threads.append(threading.get_ident())
+
+        with ThreadPoolExecutor(1) as executor:
+            dispatcher = Dispatcher(self.loop, executor=executor)
+            self.dispatch(dispatcher, 't', range(3), [callback, coroutine])
+            self.run_queued(dispatcher)
+        self.assertEqual(self.received, [('t', 0), ('t', 1), ('t', 2)])
+        main = threading.get_ident()
+        self.assertEqual([thread == main for thread in threads],
+                         [False, True] * 3)
+
+    def test_callback_errors_logged(self):
+        def failing(topic, message):
+            raise RuntimeError(message)
+
+        dispatcher = Dispatcher(self.loop)
+        with self.assertLogs('umps.dispatch') as logs:
+            self.dispatch(dispatcher, 't', range(2), [failing, self.callback])
+            self.run_queued(dispatcher)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(self.received, [('t', 0), ('t', 1)])
+
+    def test_discard_and_close(self):
+        dispatcher = Dispatcher(self.loop)
+        self.dispatch(dispatcher, 'a', range(3))
+        self.dispatch(dispatcher, 'b', range(3))
+        dispatcher.discard('a')
+        self.assertEqual(dispatcher.queue_stats('a'), QueueStats(0, 0, 0))
+        self.loop.run_until_complete(dispatcher.close())
+        # b's task may deliver once before close cancels it
+        self.assertIn(self.received, ([], [('b', 0)]))
+        self.assertEqual(dispatcher.queue_stats('b'), QueueStats(0, 0, 0))
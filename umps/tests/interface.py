@@ -0,0 +1,282 @@
+import asyncio
+import random
+import unittest
+from ipaddress import IPv4Network
+from itertools import islice
+from socket import AF_INET, SOCK_DGRAM, socket
+
+from umps import local, parse
+from umps.interface import Interface, address_of_bin, count_bins
+from umps.publish import PublishProtocol
+from umps.subscribe import SubscribeProtocol
+
+
+NETWORK = IPv4Network('239.11.122.0/24')
+PORT = 19500
+PUBLISHER = ('192.0.2.1', 5000)
+STREAM = 0x1234 << parse.SEQUENCE_BITS
+
+
+def walk_hosts(network, address_bin):
+    # the lookup address_of_bin replaced
+    return str(next(islice(network.hosts(), address_bin, None)))
+
+
+def create_interface(loop, network=NETWORK, **kwargs):
+    # an interface whose sockets are never opened
+    interface = Interface(network, PORT, loop=loop, **kwargs)
+    tasks = list(interface._startup_tasks)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    interface._startup_tasks.clear()
+    return interface
+
+
+class RecordingTransport:
+    # records what is sent; its socket, if any, only takes socket options
+
+    def __init__(self, sock=None):
+        self.sock = sock
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append((bytes(data), address))
+
+    def get_extra_info(self, name):
+        return self.sock if name == 'socket' else None
+
+    def get_write_buffer_size(self):
+        # keeps every datagram on the transport rather than sendmmsg
+        return 1
+
+    def close(self):
+        pass
+
+
+def attach_subscriber(interface):
+    # the protocol the interface would have made, minus the socket
+    protocol = SubscribeProtocol(
+        loop=interface._loop, timeout=0.02, nack_jitter=0,
+        timer_resolution=0.005,
+        message_callback=interface._message_callback,
+        topic_filter=interface._is_subscribed,
+        chunk_callback=interface._chunk_callback,
+        chunk_filter=interface._wants_chunks, stats=interface.stats)
+    protocol.connection_made(RecordingTransport())
+    interface._subscribe_protocol = protocol
+    return protocol
+
+
+def attach_publisher(interface, sock):
+    protocol = PublishProtocol(
+        loop=interface._loop,
+        max_datagram_size=interface._max_datagram_size,
+        compression=interface._compression,
+        compression_threshold=interface._compression_threshold,
+        stats=interface.stats)
+    protocol.connection_made(RecordingTransport(sock))
+    interface._publish_protocol = protocol
+    return protocol
+
+
+class AddressOfBin(unittest.TestCase):
+
+    def test_matches_hosts(self):
+        for prefix in range(24, 33):
+            network = IPv4Network('239.11.0.0/%d' % prefix)
+            nbins = count_bins(network)
+            self.assertEqual(nbins, len(list(network.hosts())))
+            for address_bin in range(nbins):
+                self.assertEqual(address_of_bin(network, address_bin),
+                                 walk_hosts(network, address_bin))
+
+    def test_small_networks(self):
+        self.assertEqual([address_of_bin(IPv4Network('239.0.0.4/31'), n)
+                          for n in range(2)], ['239.0.0.4', '239.0.0.5'])
+        self.assertEqual(address_of_bin(IPv4Network('239.0.0.4/32'), 0),
+                         '239.0.0.4')
+        self.assertEqual(address_of_bin(IPv4Network('239.0.0.4/30'), 1),
+                         '239.0.0.6')
+
+    def test_bins_outside_network(self):
+        for network, nbins in (('239.0.0.0/24', 254), ('239.0.0.0/30', 2),
+                               ('239.0.0.0/31', 2), ('239.0.0.0/32', 1)):
+            network = IPv4Network(network)
+            for address_bin in (-1, nbins, 1000):
+                with self.assertRaises(ValueError):
+                    address_of_bin(network, address_bin)
+
+
+class InterfaceDestinations(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        local._buses.clear()
+        self.loop.close()
+
+    def test_destinations_match_hosts_walk(self):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        for network in ('239.11.122.0/24', '239.11.0.0/20', '239.0.0.8/30',
+                        '239.0.0.8/31', '239.0.0.8/32'):
+            network = IPv4Network(network)
+            interface = create_interface(self.loop, network)
+            for _ in range(50):
+                topic = 'topic-%d' % random.getrandbits(32)
+                address_bin = interface._hash(topic, count_bins(network))
+                self.assertEqual(interface._get_destination(topic),
+                                 (walk_hosts(network, address_bin), PORT))
+
+    def test_destination_cache_bounded(self):
+        interface = create_interface(self.loop, max_destination_cache_size=2)
+        first = interface._get_destination('a')
+        interface._get_destination('b')
+        interface._get_destination('a')
+        interface._get_destination('c')
+        # 'b' was least recently used
+        self.assertEqual(list(interface._destinations), ['a', 'c'])
+        self.assertIs(interface._get_destination('a'), first)
+
+
+class InterfaceTopicFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.interface = create_interface(self.loop)
+        self.protocol = attach_subscriber(self.interface)
+        self.received = []
+
+    def tearDown(self):
+        self.protocol.close()
+        local._buses.clear()
+        self.loop.close()
+
+    def subscribe(self, topic):
+        # no socket to join the group with
+        with self.assertLogs('umps.subscribe', 'ERROR'):
+            self.loop.run_until_complete(self.interface.subscribe(
+                topic, lambda topic, message: self.received.append(
+                    (topic, bytes(message)))))
+
+    def unsubscribe(self, topic):
+        with self.assertLogs('umps.subscribe', 'ERROR'):
+            self.loop.run_until_complete(self.interface.unsubscribe(topic))
+
+    def send(self, frames):
+        for frame in frames:
+            self.protocol.datagram_received(frame, PUBLISHER)
+
+    def wait(self, seconds=0.05):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def frames(self, sequence, topic):
+        return [bytes(frame) for frame in
+                parse.pack(STREAM | sequence, topic, bytes(4000))]
+
+    def test_unsubscribed_topic_ignored(self):
+        frames = self.frames(0, 'topic')
+        self.send(frames[:1] + frames[2:])
+        self.wait()
+        self.assertEqual(self.protocol.transport.sent, [])
+        self.assertEqual(self.interface.stats.nacks_sent, 0)
+        self.assertEqual(len(self.protocol._incomplete_messages), 0)
+        self.assertEqual(self.received, [])
+
+    def test_unsubscribing_ignores_later_messages(self):
+        self.subscribe('topic')
+        self.send(self.frames(0, 'topic'))
+        self.wait()
+        self.unsubscribe('topic')
+        self.send(self.frames(1, 'topic')[:1])
+        self.wait()
+        self.assertEqual(self.received, [('topic', bytes(4000))])
+        self.assertEqual(self.protocol.transport.sent, [])
+
+    def test_subscribing_again_clears_ignored(self):
+        frames = self.frames(0, 'topic')
+        self.send(frames[:1])
+        self.subscribe('topic')
+        self.send(frames[1:])
+        self.assertIn(STREAM, self.protocol._incomplete_messages)
+        # the first frame is requested again and delivered this time
+        self.wait()
+        self.assertTrue(self.protocol.transport.sent)
+        self.send(frames[:1])
+        self.wait()
+        self.assertEqual(self.received, [('topic', bytes(4000))])
+
+
+class InterfaceLocalDelivery(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.received = {}
+
+    def tearDown(self):
+        self.sock.close()
+        local._buses.clear()
+        self.loop.close()
+
+    def interface(self, name, **kwargs):
+        interface = create_interface(self.loop, **kwargs)
+        attach_subscriber(interface)
+        received = self.received[name] = []
+        # no socket to join the group with
+        with self.assertLogs('umps.subscribe', 'ERROR'):
+            self.loop.run_until_complete(interface.subscribe(
+                't', lambda topic, message: received.append(bytes(message))))
+        self.loop.run_until_complete(interface.subscribe_chunks(
+            't', lambda topic, chunk: received.append(chunk)))
+        return interface
+
+    def publish(self, message, **kwargs):
+        # to a local subscriber, and one that only has the network copy
+        publisher = create_interface(self.loop, **kwargs)
+        attach_subscriber(publisher)
+        protocol = attach_publisher(publisher, self.sock)
+        nearby = self.interface('local')
+        remote = self.interface('remote', local_delivery=False)
+        self.loop.run_until_complete(publisher.publish('t', message))
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(nearby.stats.local_messages, 1)
+        self.assertEqual(len(self.received['local']), 1)
+
+        # the multicast loopback copy reaches both
+        for data, _ in protocol.transport.sent:
+            nearby._subscribe_protocol.datagram_received(data, PUBLISHER)
+            remote._subscribe_protocol.datagram_received(data, PUBLISHER)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(len(self.received['local']), 1)
+        self.assertEqual(nearby.stats.duplicate_frames, 0)
+        self.assertEqual(len(nearby._subscribe_protocol._incomplete_messages),
+                         0)
+        return self.received['local'][0], self.received['remote']
+
+    def test_delivered_once(self):
+        message = bytes(range(256)) * 20
+        delivered, remote = self.publish(message)
+        self.assertEqual(delivered, message)
+        self.assertEqual(remote, [message])
+
+    def test_compressed_delivered_whole(self):
+        # long, but short enough to be sent whole once compressed
+        message = bytes(2 * 2 ** 20)
+        delivered, remote = self.publish(message, compression='zlib')
+        self.assertEqual(delivered, message)
+        self.assertEqual(remote, [message])
+
+    def test_streamed_delivered_in_chunks(self):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        message = random.getrandbits(8 * 2 ** 20).to_bytes(2 ** 20, 'little')
+        delivered, remote = self.publish(message, compression='zlib')
+        self.assertEqual(delivered.offset, 0)
+        self.assertTrue(delivered.last)
+        self.assertIs(delivered.data, message)
+        self.assertTrue(remote[-1].last)
+        self.assertEqual(b''.join(bytes(chunk.data) for chunk in remote),
+                         message)
@@ -0,0 +1,44 @@
+import unittest
+
+from umps import local
+
+
+class LocalBusDelivery(unittest.TestCase):
+
+    def tearDown(self):
+        local._buses.clear()
+
+    def test_delivers_to_members_on_loop(self):
+        bus = local.get_bus('net', 1)
+        self.assertIs(local.get_bus('net', 1), bus)
+        got = []
+
+        def first(*args):
+            got.append(('first',) + args)
+
+        def second(*args):
+            got.append(('second',) + args)
+
+        def other(*args):
+            got.append(('other',) + args)
+
+        bus.join('loop', first)
+        bus.join('loop', second)
+        bus.join('other loop', other)
+        message = bytearray(b'body')
+        bus.deliver('loop', 7, 'topic', message, False)
+        self.assertEqual(got, [('first', 7, 'topic', message, False),
+                               ('second', 7, 'topic', message, False)])
+        self.assertIs(got[0][3], message)
+
+        bus.leave('loop', first)
+        bus.leave('loop', first)
+        bus.leave('loop', second)
+        self.assertIs(local.get_bus('net', 1), bus)
+        bus.leave('other loop', other)
+        self.assertEqual(len(bus), 0)
+        self.assertNotIn(('net', 1), local._buses)
+
+    def test_buses_per_network_and_port(self):
+        self.assertIsNot(local.get_bus('net', 1), local.get_bus('net', 2))
+        self.assertIsNot(local.get_bus('net', 1), local.get_bus('other', 1))
@@ -0,0 +1,170 @@
+import heapq
+import unittest
+
+from umps import pacing
+from umps.pacing import Pacer, TokenBucket
+
+
+class Handle:
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ManualLoop:
+    """Event loop whose clock only moves when the test runs it."""
+
+    def __init__(self):
+        self.now = 0
+        self._handles = []
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        handle = Handle(self.now + delay, callback)
+        heapq.heappush(self._handles, handle)
+        return handle
+
+    def run_until(self, when):
+        while self._handles and self._handles[0].when <= when:
+            handle = heapq.heappop(self._handles)
+            if not handle.cancelled:
+                self.now = handle.when
+                handle.callback()
+        self.now = when
+
+
+def datagrams(count, size=100):
+    return [((bytes(size),), ('239.0.0.1', 5000))] * count
+
+
+class TokenBucketRefill(unittest.TestCase):
+
+    def test_refill_and_delay(self):
+        loop = ManualLoop()
+        bucket = TokenBucket(1000, 500, loop.time)
+        self.assertEqual(bucket.delay(500), 0)
+        bucket.tokens -= 500
+        self.assertAlmostEqual(bucket.delay(200), 0.2)
+        # no more than a burst is ever waited for
+        self.assertAlmostEqual(bucket.delay(10 ** 6), 0.5)
+        loop.now = 0.1
+        bucket.refill()
+        self.assertAlmostEqual(bucket.tokens, 100)
+        loop.now = 10
+        bucket.refill()
+        self.assertEqual(bucket.tokens, 500)
+
+
+class PacerRates(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = ManualLoop()
+        self.sent = []
+
+    def pacer(self, **kwargs):
+        return Pacer(self.loop, self.sent.extend, **kwargs)
+
+    def test_needs_a_rate(self):
+        with self.assertRaises(ValueError):
+            self.pacer()
+
+    def test_byte_rate(self):
+        pacer = self.pacer(rate=1000, burst=300, adaptive=False)
+        pacer.send(datagrams(10))
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(pacer.queued_bytes, 700)
+        self.loop.run_until(0.35)
+        self.assertEqual(len(self.sent), 6)
+        self.loop.run_until(1)
+        self.assertEqual(len(self.sent), 10)
+        self.assertEqual(len(pacer), 0)
+        self.assertEqual(pacer.queued_bytes, 0)
+
+    def test_packet_rate(self):
+        pacer = self.pacer(packet_rate=10, packet_burst=2, adaptive=False)
+        pacer.send(datagrams(6))
+        self.assertEqual(len(self.sent), 2)
+        self.loop.run_until(0.25)
+        self.assertEqual(len(self.sent), 4)
+
+    def test_datagram_larger_than_burst(self):
+        pacer = self.pacer(rate=1000, burst=50, adaptive=False)
+        pacer.send(datagrams(2))
+        self.assertEqual(len(self.sent), 1)
+        # the whole datagram is charged, leaving the bucket in debt
+        self.loop.run_until(0.09)
+        self.assertEqual(len(self.sent), 1)
+        self.loop.run_until(0.11)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_close_drops_queue(self):
+        pacer = self.pacer(rate=1000, burst=100, adaptive=False)
+        pacer.send(datagrams(5))
+        pacer.close()
+        self.loop.run_until(1)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(pacer.queued_bytes, 0)
+
+
+class PacerAdaptation(unittest.TestCase):
+    RATE = 10 ** 6
+
+    def setUp(self):
+        self.loop = ManualLoop()
+        self.pacer = Pacer(self.loop, lambda batch: None, rate=self.RATE,
+                           packet_rate=1000)
+
+    def interval(self, requested, sent=100):
+        self.pacer.frames_requested(requested)
+        self.pacer._sent_frames += sent
+        self.loop.run_until(self.loop.now + pacing.ADAPT_INTERVAL)
+        self.pacer.send(datagrams(1))
+
+    def test_decrease_on_requests(self):
+        self.interval(requested=5)
+        self.assertAlmostEqual(self.pacer.rate,
+                               self.RATE * pacing.RATE_DECREASE)
+        self.assertAlmostEqual(self.pacer.packet_rate,
+                               1000 * pacing.RATE_DECREASE)
+
+    def test_floor(self):
+        for _ in range(50):
+            self.interval(requested=50)
+        self.assertAlmostEqual(self.pacer.rate,
+                               self.RATE * pacing.MIN_RATE_FRACTION)
+
+    def test_increase_when_quiet(self):
+        self.interval(requested=5)
+        self.interval(requested=5)
+        decreased = self.pacer.rate
+        self.interval(requested=1)
+        self.assertAlmostEqual(self.pacer.rate,
+                               decreased + self.RATE * pacing.RATE_INCREASE)
+        for _ in range(50):
+            self.interval(requested=0)
+        self.assertEqual(self.pacer.rate, self.RATE)
+
+    def test_idle_intervals_count_as_quiet(self):
+        for _ in range(3):
+            self.interval(requested=50)
+        decreased = self.pacer.rate
+        self.loop.run_until(self.loop.now + 4 * pacing.ADAPT_INTERVAL)
+        self.pacer.send(datagrams(1))
+        self.assertAlmostEqual(self.pacer.rate,
+                               decreased + 4 * self.RATE *
+                               pacing.RATE_INCREASE)
+
+    def test_not_adaptive(self):
+        self.pacer.adaptive = False
+        self.interval(requested=50)
+        self.assertEqual(self.pacer.rate, self.RATE)
@@ -0,0 +1,167 @@
+import random
+import unittest
+
+from umps import parse
+
+
+def random_body(length):
+    return random.getrandbits(8*length).to_bytes(length, 'little')
+
+
+class PackParseRoundTrip(unittest.TestCase):
+    DATAGRAM_SIZES = (parse.MIN_DATAGRAM_SIZE, parse.MAX_UDP_SIZE, 1500, 9000)
+    TOPIC = 'round-trip'
+
+    def round_trip(self, body, max_datagram_size):
+        frames = parse.pack(0x1234, self.TOPIC, body, max_datagram_size)
+        parsed = [parse.parse(bytes(frame)) for frame in frames]
+        for number, frame in enumerate(parsed):
+            self.assertLessEqual(frame.size, max_datagram_size)
+            self.assertEqual(frame.frame_number, number)
+            self.assertEqual(frame.total_frames, len(frames))
+            self.assertEqual(frame.uid, 0x1234)
+        self.assertEqual(parsed[0].topic, self.TOPIC)
+        self.assertEqual(b''.join(f.body for f in parsed), body)
+        return frames
+
+    def test_round_trip(self):
+        random.seed(0)
+        for size in self.DATAGRAM_SIZES:
+            max_size = parse.max_message_size(len(self.TOPIC), size)
+            for length in (0, 1, size, 3*size + 7, max_size):
+                self.round_trip(random_body(length), size)
+
+    def test_frame_count(self):
+        body = bytes(100000)
+        small = self.round_trip(body, 512)
+        jumbo = self.round_trip(body, 9000)
+        self.assertEqual(len(small), 201)
+        self.assertEqual(len(jumbo), 12)
+
+    def test_pack_headers_matches_pack(self):
+        random.seed(0)
+        for size in self.DATAGRAM_SIZES:
+            for length in (0, size, 5*size + 3):
+                body = random_body(length)
+                frames = parse.pack(9, self.TOPIC, body, size)
+                gathered = parse.pack_headers(9, self.TOPIC, bytearray(body),
+                                              size)
+                self.assertEqual([bytes(f) for f in frames],
+                                 [bytes(h) + bytes(b) for h, b in gathered])
+
+    def test_limits(self):
+        topic_size = len(self.TOPIC)
+        for size in self.DATAGRAM_SIZES:
+            too_long = bytes(parse.max_message_size(topic_size, size) + 1)
+            with self.assertRaises(ValueError):
+                parse.pack(1, self.TOPIC, too_long, size)
+        for size in (parse.MIN_DATAGRAM_SIZE - 1, parse.MAX_DATAGRAM_SIZE + 1):
+            with self.assertRaises(ValueError):
+                parse.pack(1, self.TOPIC, b'', size)
+
+    def test_compressed_flag(self):
+        random.seed(0)
+        body = random_body(3000)
+        for packed in (parse.pack(5, self.TOPIC, body, 512, parse.COMPRESSED),
+                       [bytes(h) + bytes(b) for h, b in parse.pack_headers(
+                           5, self.TOPIC, body, 512, parse.COMPRESSED)]):
+            parsed = [parse.parse(bytes(frame)) for frame in packed]
+            self.assertEqual(parsed[0].frame_type, parse.START_FRAME)
+            self.assertEqual(parsed[1].frame_type, parse.CONTINUATION_FRAME)
+            self.assertTrue(all(frame.compressed for frame in parsed))
+            self.assertEqual(parsed[0].topic, self.TOPIC)
+            self.assertEqual(b''.join(f.body for f in parsed), body)
+            self.assertEqual(parse.parse_header(bytes(packed[1]))[0],
+                             parse.CONTINUATION_FRAME)
+        single = parse.pack(5, self.TOPIC, b'x')[0]
+        self.assertFalse(parse.parse(bytes(single)).compressed)
+
+    def test_parity_frames(self):
+        random.seed(0)
+        size = 1500
+        body = random_body(7*size)
+        frames = parse.pack_headers(3, self.TOPIC, body,
+                                    size - parse.PARITY_OVERHEAD)
+        parity = parse.pack_parity_frames(3, frames, 3)
+        self.assertEqual(len(parity), -(-len(frames) // 3))
+        for block, frame in enumerate(parity):
+            parsed = parse.parse(bytes(frame))
+            self.assertEqual(parsed.frame_type, parse.PARITY_FRAME)
+            self.assertEqual(parsed.frame_number, block)
+            self.assertEqual(parsed.total_frames, 3)
+            self.assertEqual(parsed.size, len(frame))
+            self.assertLessEqual(len(frame), size)
+        with self.assertRaises(ValueError):
+            parse.pack_parity_frames(3, frames, 0)
+
+    def test_stream_headers(self):
+        random.seed(0)
+        size = 1500
+        body = random_body(parse.max_message_size(len(self.TOPIC), size) + 1)
+        frames = parse.pack_stream_headers(2, self.TOPIC, body, size)
+        self.assertGreater(len(frames), parse.MAX_FRAMES)
+        payload = b''
+        for number, (header, data) in enumerate(frames):
+            frame = bytes(header) + bytes(data)
+            self.assertLessEqual(len(frame), size)
+            self.assertEqual(parse.header_size_of(frame),
+                             parse.HEADER_SIZE_V2)
+            frame_type, uid, frame_number, total_frames = parse.parse_header(
+                frame)
+            self.assertEqual(frame_type, parse.START_FRAME if number == 0
+                             else parse.CONTINUATION_FRAME)
+            self.assertEqual((uid, frame_number, total_frames),
+                             (2, number, len(frames)))
+            payload += frame[parse.HEADER_SIZE_V2:]
+        self.assertEqual(payload, bytes((len(self.TOPIC),)) +
+                         self.TOPIC.encode() + body)
+        with self.assertRaises(ValueError):
+            too_long = parse.max_stream_message_size(len(self.TOPIC), size)
+            parse.pack_stream_headers(2, self.TOPIC, bytes(too_long + 1),
+                                      size)
+
+    def test_frame_ranges_request(self):
+        total = 1000
+        wanted = (3, 4, 5, 9, 500, 501, 999)
+        request = parse.pack_frames_request(8, total, wanted)
+        self.assertEqual(parse.parse_header(request),
+                         (parse.FRAMES_REQUEST, 8, 0, total))
+        ranges = request[parse.header_size_of(request):]
+        self.assertEqual(parse.unpack_frame_ranges(ranges), wanted)
+        # as many ranges as fit the smallest datagram
+        request = parse.pack_frames_request(8, total, range(0, total, 2))
+        self.assertLessEqual(len(request), parse.MIN_DATAGRAM_SIZE)
+        ranges = request[parse.header_size_of(request):]
+        self.assertEqual(parse.unpack_frame_ranges(ranges),
+                         tuple(range(0, 2 * parse.MAX_REQUEST_RANGES, 2)))
+        # messages of up to MAX_FRAMES frames still take a bitmap
+        request = parse.pack_frames_request(8, 10, (1, 7))
+        self.assertEqual(parse.header_size_of(request), parse.HEADER_SIZE)
+        self.assertEqual(parse.unpack_frames_bitmap(
+            request[parse.HEADER_SIZE:], 10), (1, 7))
+
+    def test_message_request(self):
+        uid = 0xABCD << parse.SEQUENCE_BITS | 41
+        request = parse.pack_message_request(uid)
+        self.assertEqual(len(request), parse.HEADER_SIZE)
+        self.assertEqual(parse.parse_header(request),
+                         (parse.FRAME_REQUEST, uid, 0, 0))
+
+
+if parse._pack is not parse.pack:
+    py_pack = parse._pack
+    c_pack = parse.pack
+
+    class CPackComparison(unittest.TestCase):
+        ITERS = 2**8
+
+        def test_pack_output_match(self):
+            # Seed generator for reproducible test.
+            random.seed(0)
+            for _ in range(self.ITERS):
+                size = random.choice((parse.MAX_UDP_SIZE, 1500, 9000))
+                length = random.randrange(parse.max_message_size(4, size))
+                body = random_body(length)
+                flags = random.choice((0, parse.COMPRESSED))
+                self.assertEqual(list(py_pack(7, 'test', body, size, flags)),
+                                 list(c_pack(7, 'test', body, size, flags)))
@@ -0,0 +1,236 @@
+import asyncio
+import random
+import socket
+import unittest
+
+from umps import mmsg, parse
+from umps.publish import PublishProtocol
+
+
+STREAM_ID = 0x1234
+
+
+class RecordingTransport:
+    # records what is sent through it, but has a real socket for sendmmsg
+
+    def __init__(self, sock, buffered=0):
+        self.sock = sock
+        self.buffered = buffered
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append((bytes(data), address))
+
+    def get_extra_info(self, name):
+        return self.sock if name == 'socket' else None
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def close(self):
+        pass
+
+
+class PublishTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sockets = []
+        self.receiver = self.socket()
+        self.destination = self.receiver.getsockname()
+        self.other = self.socket()
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        self.loop.close()
+
+    def socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(1)
+        self.sockets.append(sock)
+        return sock
+
+    def protocol(self, buffered=0, **kwargs):
+        sender = self.socket()
+        sender.setblocking(False)
+        protocol = PublishProtocol(loop=self.loop, **kwargs)
+        transport = RecordingTransport(sender, buffered)
+        protocol.connection_made(transport)
+        # the same uids from every protocol
+        for index, destination in enumerate((self.destination,
+                                             self.other.getsockname())):
+            protocol._streams[destination] = [STREAM_ID + index, -1]
+        return protocol, transport
+
+    def receive(self, sock, count):
+        return [sock.recvfrom(2 ** 16) for _ in range(count)]
+
+
+class BatchPublishing(PublishTestCase):
+
+    def messages(self):
+        other = self.other.getsockname()
+        return [(self.destination, 'a', b'x' * 10),
+                (self.destination, 'b', bytes(range(256)) * 8),
+                (other, 'a', 'text'),
+                (self.destination, 'a', bytearray(b'y' * 1000))]
+
+    def test_batch_matches_sequential(self):
+        sequential, sequential_transport = self.protocol(buffered=1)
+        published = [sequential.publish(*message)
+                     for message in self.messages()]
+        batched, batched_transport = self.protocol(buffered=1)
+        self.assertEqual(batched.publish_batch(self.messages()), published)
+        self.assertEqual(batched_transport.sent, sequential_transport.sent)
+        uids = [uid for uid, _ in published]
+        self.assertEqual(len(set(uids)), len(uids))
+        # messages are numbered per destination
+        self.assertEqual([uid & parse.SEQUENCE_MASK for uid in uids],
+                         [0, 1, 0, 2])
+        for uid in uids:
+            self.assertIn(uid, batched._message_cache)
+        self.assertEqual(batched.stats.messages_published, 4)
+        self.assertEqual(batched.stats.frames_sent,
+                         len(batched_transport.sent))
+
+    def test_fallback_joins_buffers(self):
+        protocol, transport = self.protocol(buffered=1)
+        protocol.publish_batch(self.messages())
+        for data, _ in transport.sent:
+            header = parse.parse_header(data)
+            self.assertEqual(len(data), int.from_bytes(data[:2], 'big'))
+            self.assertIn(header[0], (parse.START_FRAME,
+                                      parse.CONTINUATION_FRAME))
+
+    @unittest.skipUnless(mmsg.HAVE_SENDMMSG, 'needs sendmmsg')
+    def test_sendmmsg(self):
+        expected, expected_transport = self.protocol(buffered=1)
+        expected.publish_batch(self.messages())
+        protocol, transport = self.protocol()
+        protocol.publish_batch(self.messages())
+        # nothing goes through the transport when it has nothing queued
+        self.assertEqual(transport.sent, [])
+        sent = expected_transport.sent
+        other = self.other.getsockname()
+        received = self.receive(self.receiver, len(sent) - 1)
+        received += self.receive(self.other, 1)
+        self.assertEqual([data for data, _ in received],
+                         [data for data, address in sent
+                          if address != other] +
+                         [data for data, address in sent
+                          if address == other])
+
+    def test_lone_datagram_sent_by_transport(self):
+        protocol, transport = self.protocol()
+        protocol.publish_batch([(self.destination, 'a', b'x')])
+        self.assertEqual(len(transport.sent), 1)
+
+
+class StreamedMessages(PublishTestCase):
+
+    def test_reports_stream_path(self):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        protocol, transport = self.protocol(buffered=1, compression='zlib')
+        limit = parse.max_message_size(1, protocol.max_datagram_size)
+        noise = random.getrandbits(8 * 2 * limit).to_bytes(2 * limit,
+                                                           'little')
+        messages = [(self.destination, 't', bytes(100)),
+                    (self.destination, 't', noise),
+                    # long, but short enough once compressed
+                    (self.destination, 't', bytes(2 * limit))]
+        published = protocol.publish_batch(messages)
+        self.assertEqual([streamed for _, streamed in published],
+                         [False, True, False])
+        for (_, streamed), message in zip(published, messages):
+            self.assertEqual(protocol.publish(*message)[1], streamed)
+
+        protocol, transport = self.protocol(buffered=1)
+        self.assertEqual(protocol.publish(self.destination, 't',
+                                          bytes(2 * limit))[1], True)
+
+
+class RepairAggregation(PublishTestCase):
+    REQUESTERS = [('192.0.2.%d' % host, 5000) for host in range(1, 4)]
+
+    def setUp(self):
+        super().setUp()
+        self.publisher, self.transport = self.protocol(
+            buffered=1, repair_delay=0.02, max_cache_size=1)
+        self.body = bytes(range(256)) * 8
+        self.uid, _ = self.publisher.publish(self.destination, 't', self.body)
+        self.frames = list(self.transport.sent)
+        self.total_frames = len(self.frames)
+        self.transport.sent.clear()
+
+    def request(self, frame_numbers, requester):
+        request = parse.pack_frames_request(self.uid, self.total_frames,
+                                            frame_numbers)
+        self.publisher.datagram_received(bytes(request), requester)
+
+    def wait(self):
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+
+    def test_requests_aggregated(self):
+        self.assertGreater(self.total_frames, 3)
+        for frame_numbers, requester in zip(([1, 2], [2, 3], [1]),
+                                            self.REQUESTERS):
+            self.request(frame_numbers, requester)
+        self.assertEqual(self.transport.sent, [])
+        self.wait()
+        # one multicast of the union of the requested frames
+        sent = self.transport.sent
+        self.assertEqual([address for _, address in sent],
+                         [self.destination] * 3)
+        self.assertEqual([parse.parse_header(data) for data, _ in sent],
+                         [(parse.FRAME_RESPONSE, self.uid, number,
+                           self.total_frames) for number in (1, 2, 3)])
+        for data, _ in sent:
+            number = parse.parse_header(data)[2]
+            self.assertEqual(data[parse.HEADER_SIZE:],
+                             self.frames[number][0][parse.HEADER_SIZE:])
+        self.assertEqual(self.publisher.stats.nacks_received, 3)
+
+        # a later request starts a new round
+        sent.clear()
+        self.request([0], self.REQUESTERS[0])
+        self.wait()
+        self.assertEqual([parse.parse_header(data)[2] for data, _ in sent],
+                         [0])
+
+    def test_whole_message_request(self):
+        request = parse.pack_message_request(self.uid)
+        self.publisher.datagram_received(bytes(request), self.REQUESTERS[0])
+        self.request([1], self.REQUESTERS[1])
+        self.wait()
+        self.assertEqual([parse.parse_header(data)[2]
+                          for data, _ in self.transport.sent],
+                         list(range(self.total_frames)))
+
+    def test_evicted_message_dropped(self):
+        for requester in self.REQUESTERS[:2]:
+            self.request([1], requester)
+        # pushes the requested message out of the one-message cache
+        self.publisher.publish(self.destination, 't', b'newer')
+        self.transport.sent.clear()
+        self.wait()
+        sent = self.transport.sent
+        self.assertEqual(sorted(address for _, address in sent),
+                         self.REQUESTERS[:2])
+        for data, _ in sent:
+            self.assertEqual(parse.parse_header(data),
+                             (parse.MESSAGE_DROPPED, self.uid, 0, 0))
+        self.assertEqual(self.publisher.stats.drop_notices_sent, 2)
+
+    def test_unicast_without_delay(self):
+        publisher, transport = self.protocol(buffered=1, repair_delay=0)
+        uid, _ = publisher.publish(self.destination, 't', self.body)
+        transport.sent.clear()
+        request = parse.pack_frames_request(uid, self.total_frames, [2])
+        publisher.datagram_received(bytes(request), self.REQUESTERS[0])
+        self.assertEqual([(parse.parse_header(data), address)
+                          for data, address in transport.sent],
+                         [((parse.FRAME_RESPONSE, uid, 2, self.total_frames),
+                           self.REQUESTERS[0])])
@@ -0,0 +1,313 @@
+import random
+import unittest
+
+from umps import parse, reassembly
+
+
+def random_body(length):
+    return random.getrandbits(8*length).to_bytes(length, 'little')
+
+
+def random_frames(length, max_datagram_size=parse.MAX_UDP_SIZE):
+    frames = parse.pack(5, 'reassembly', random_body(length),
+                        max_datagram_size)
+    return [bytes(frame) for frame in frames]
+
+
+def random_parity(length, block_size, max_datagram_size=parse.MAX_UDP_SIZE):
+    # frames and parity frames as a publisher with parity sends them
+    size = max_datagram_size - parse.PARITY_OVERHEAD
+    frames = parse.pack_headers(5, 'reassembly', random_body(length), size)
+    parity = parse.pack_parity_frames(5, frames, block_size)
+    return ([bytes(header) + bytes(body) for header, body in frames],
+            [bytes(frame) for frame in parity])
+
+
+def feed(message_type, frames, order):
+    # add frames in the given order, recording what each addition reports
+    message = message_type(len(frames))
+    events = []
+    for number in order:
+        if not message.is_missing(number):
+            events.append(('duplicate', number))
+            continue
+        try:
+            complete = message.add_frame(number, frames[number])
+        except ValueError:
+            events.append(('rejected', number))
+        else:
+            events.append((complete, message.nbytes,
+                           message.missing_frames()))
+    topic = message.topic
+    result = message.assemble() if message.complete else None
+    return events, topic, result
+
+
+class PartialMessageReassembly(unittest.TestCase):
+    message_type = reassembly._PartialMessage
+
+    def check_order(self, length, order_fn):
+        frames = random_frames(length)
+        order = order_fn(list(range(len(frames))))
+        _, topic, (assembled_topic, body) = feed(self.message_type, frames,
+                                                 order)
+        self.assertEqual(topic, 'reassembly')
+        self.assertEqual(assembled_topic, 'reassembly')
+        self.assertEqual(bytes(body),
+                         b''.join(parse.parse(f).body for f in frames))
+
+    def test_in_order(self):
+        random.seed(0)
+        self.check_order(5000, lambda order: order)
+
+    def test_reversed(self):
+        random.seed(0)
+        self.check_order(5000, lambda order: order[::-1])
+
+    def test_shuffled_with_duplicates(self):
+        random.seed(0)
+        for _ in range(32):
+            def shuffled(order):
+                order = order + random.sample(order, len(order) // 2)
+                random.shuffle(order)
+                return order
+            self.check_order(random.randrange(500, 20000), shuffled)
+
+    def test_missing_frames(self):
+        frames = random_frames(3000)
+        message = self.message_type(len(frames))
+        for number in (0, 2, 5):
+            self.assertFalse(message.add_frame(number, frames[number]))
+        self.assertEqual(message.missing_frames(),
+                         tuple(n for n in range(len(frames))
+                               if n not in (0, 2, 5)))
+        self.assertEqual(message.topic, 'reassembly')
+        self.assertFalse(message.complete)
+
+    def test_inconsistent_frames(self):
+        frames = random_frames(3000)
+        message = self.message_type(len(frames))
+        with self.assertRaises(ValueError):
+            message.add_frame(len(frames), frames[0])
+        message.add_frame(1, frames[1])
+        with self.assertRaises(ValueError):
+            message.add_frame(2, frames[2][:-1])
+        self.assertTrue(message.is_missing(2))
+
+    def check_recovery(self, length, block_size, lost, parity_first=False):
+        frames, parity = random_parity(length, block_size)
+        message = self.message_type(len(frames))
+        for block, frame in enumerate(parity if parity_first else ()):
+            message.add_parity(block, block_size, frame)
+        for number, frame in enumerate(frames):
+            if number not in lost:
+                message.add_frame(number, frame)
+        for block, frame in enumerate(() if parity_first else parity):
+            message.add_parity(block, block_size, frame)
+        return message, message.complete, frames
+
+    def test_parity_recovery(self):
+        random.seed(0)
+        for block_size in (1, 2, 4, 255):
+            for _ in range(16):
+                length = random.randrange(500, 20000)
+                frames, _ = random_parity(length, block_size)
+                # one frame lost from each block, possibly the last
+                lost = {random.choice(range(start, min(start + block_size,
+                                                       len(frames))))
+                        for start in range(0, len(frames), block_size)}
+                for parity_first in (False, True):
+                    message, complete, frames = self.check_recovery(
+                        length, block_size, lost, parity_first)
+                    self.assertTrue(complete)
+                    _, body = message.assemble()
+                    self.assertEqual(
+                        bytes(body),
+                        b''.join(parse.parse(f).body for f in frames))
+
+    def test_parity_recovers_first_and_last(self):
+        random.seed(0)
+        for lost in ({0}, {9}, {0, 9}):
+            message, complete, frames = self.check_recovery(4700, 10, lost)
+            self.assertEqual(len(frames), 10)
+            self.assertEqual(complete, len(lost) == 1)
+            self.assertEqual(message.missing_frames(),
+                             () if len(lost) == 1 else (0, 9))
+            if complete:
+                topic, body = message.assemble()
+                self.assertEqual(topic, 'reassembly')
+                self.assertEqual(
+                    bytes(body),
+                    b''.join(parse.parse(f).body for f in frames))
+
+    def test_inconsistent_parity(self):
+        frames, parity = random_parity(3000, 2)
+        message = self.message_type(len(frames))
+        with self.assertRaises(ValueError):
+            message.add_parity(len(frames), 2, parity[0])
+        with self.assertRaises(ValueError):
+            message.add_parity(0, 2, parity[0][:parse.HEADER_SIZE])
+        message.add_parity(0, 2, parity[0])
+        with self.assertRaises(ValueError):
+            message.add_parity(1, 3, parity[1])
+
+    def test_parity_shorter_than_frames(self):
+        random.seed(0)
+        frames, parity = random_parity(3000, 2)
+        message = self.message_type(len(frames))
+        message.add_parity(0, 2, parity[0][:-1])
+        message.add_frame(1, frames[1])
+        self.assertEqual(message.missing_frames()[0], 0)
+        message.add_frame(0, frames[0])
+        self.assertFalse(message.is_missing(0))
+
+
+def stream_frames(length, max_datagram_size=parse.MIN_DATAGRAM_SIZE):
+    body = random_body(length)
+    frames = parse.pack_stream_headers(5, 'reassembly', body,
+                                       max_datagram_size)
+    return [bytes(header) + bytes(body) for header, body in frames], body
+
+
+class StreamingMessageReassembly(unittest.TestCase):
+
+    def stream(self, frames, order, chunked=True):
+        chunks = []
+        message = reassembly.StreamingMessage(
+            len(frames), wants_chunks=lambda topic: chunked,
+            on_chunk=lambda *chunk: chunks.append(chunk))
+        for number in order:
+            message.add_frame(number, frames[number])
+        return message, chunks
+
+    def check_chunks(self, chunks, body):
+        offset = 0
+        for topic, chunk_offset, data, last in chunks:
+            self.assertEqual(topic, 'reassembly')
+            self.assertEqual(chunk_offset, offset)
+            offset += len(data)
+            self.assertEqual(last, offset == len(body))
+        self.assertEqual(b''.join(chunk[2] for chunk in chunks), body)
+
+    def test_in_order(self):
+        random.seed(0)
+        frames, body = stream_frames(100000)
+        self.assertGreater(len(frames), parse.MAX_FRAMES)
+        message, chunks = self.stream(frames, range(len(frames)))
+        self.assertTrue(message.complete)
+        self.assertEqual(len(chunks), len(frames))
+        self.check_chunks(chunks, body)
+        self.assertEqual(message.assemble(), ('reassembly', None))
+        self.assertEqual(message.nbytes, 0)
+
+    def test_shuffled_with_duplicates(self):
+        random.seed(0)
+        frames, body = stream_frames(100000)
+        order = list(range(len(frames))) * 2
+        random.shuffle(order)
+        message, chunks = self.stream(frames, order)
+        self.assertTrue(message.complete)
+        self.check_chunks(chunks, body)
+
+    def test_held_behind_missing_frame(self):
+        random.seed(0)
+        frames, body = stream_frames(100000)
+        message, chunks = self.stream(frames, [0, 1, 3, 4, 7])
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(message.missing_frames(), (2, 5, 6))
+        self.assertEqual(message.nbytes,
+                         3 * (len(frames[3]) - parse.HEADER_SIZE_V2))
+        message.add_frame(2, frames[2])
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(message.missing_frames(), (5, 6))
+        message.add_frame(5, frames[5])
+        message.add_frame(6, frames[6])
+        self.assertEqual(message.missing_frames(),
+                         tuple(range(8, len(frames))))
+        self.assertEqual(message.nbytes, 0)
+
+    def test_gathered_when_declined(self):
+        random.seed(0)
+        frames, body = stream_frames(100000)
+        order = list(range(len(frames)))
+        random.shuffle(order)
+        message, chunks = self.stream(frames, order, chunked=False)
+        self.assertEqual(chunks, [])
+        topic, gathered = message.assemble()
+        self.assertEqual(topic, 'reassembly')
+        self.assertEqual(bytes(gathered), body)
+
+    def test_inconsistent_frames(self):
+        random.seed(0)
+        frames, _ = stream_frames(100000)
+        message = reassembly.StreamingMessage(len(frames))
+        with self.assertRaises(ValueError):
+            message.add_frame(len(frames), frames[0])
+        message.add_frame(1, frames[1])
+        with self.assertRaises(ValueError):
+            message.add_frame(2, frames[2][:-1])
+        with self.assertRaises(ValueError):
+            message.add_parity(0, 2, frames[2])
+        self.assertTrue(message.is_missing(2))
+
+
+if reassembly._PartialMessage is not reassembly.PartialMessage:
+    py_message = reassembly._PartialMessage
+    c_message = reassembly.PartialMessage
+
+    class CPartialMessageReassembly(PartialMessageReassembly):
+        message_type = c_message
+
+    class CReassemblyComparison(unittest.TestCase):
+        ITERS = 2**8
+
+        def test_reassembly_output_match(self):
+            # Seed generator for reproducible test.
+            random.seed(0)
+            for _ in range(self.ITERS):
+                size = random.choice((parse.MAX_UDP_SIZE, 1500, 9000))
+                # single-frame messages are never reassembled
+                length = random.randrange(size,
+                                          parse.max_message_size(10, size))
+                frames = random_frames(length, size)
+                if random.random() < 0.1:
+                    # a short final frame sent in place of a full one
+                    frames[-1] = frames[-1][:-1]
+                order = list(range(len(frames))) * 2
+                random.shuffle(order)
+                order = order[:random.randrange(len(order) + 1)]
+                self.assertEqual(feed(py_message, frames, order),
+                                 feed(c_message, frames, order))
+
+        def test_parity_output_match(self):
+            # Seed generator for reproducible test.
+            random.seed(0)
+            for _ in range(self.ITERS):
+                block_size = random.choice((2, 4, 16))
+                frames, parity = random_parity(random.randrange(600, 20000),
+                                               block_size)
+                # parity frames cut short no longer cover their blocks
+                parity = [frame[:random.randrange(parse.HEADER_SIZE + 3,
+                                                  len(frame))]
+                          if random.random() < 0.3 else frame
+                          for frame in parity]
+                order = [('frame', number) for number in range(len(frames))
+                         if random.random() < 0.8]
+                order += [('parity', block) for block in range(len(parity))]
+                random.shuffle(order)
+                messages = py_message(len(frames)), c_message(len(frames))
+                for kind, number in order:
+                    events = []
+                    for message in messages:
+                        try:
+                            if kind == 'frame':
+                                message.add_frame(number, frames[number])
+                            else:
+                                message.add_parity(number, block_size,
+                                                   parity[number])
+                        except ValueError:
+                            events.append('rejected')
+                        events.append((message.complete, message.nbytes,
+                                       message.missing_frames()))
+                    self.assertEqual(events[:len(events) // 2],
+                                     events[len(events) // 2:])
@@ -0,0 +1,55 @@
+import random
+import unittest
+
+from umps import rtt
+
+
+class EstimateTracking(unittest.TestCase):
+
+    def test_default_until_sampled(self):
+        estimate = rtt.Estimate()
+        self.assertEqual(estimate.bound(0.5), 0.5)
+        estimate.update(0.1)
+        self.assertAlmostEqual(estimate.bound(0.5),
+                               0.1 + rtt.DEVIATION_FACTOR * 0.05)
+
+    def test_converges(self):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        estimate = rtt.Estimate()
+        for _ in range(200):
+            estimate.update(random.uniform(0.009, 0.011))
+        self.assertAlmostEqual(estimate.mean, 0.01, delta=0.001)
+        self.assertLess(estimate.deviation, 0.001)
+        self.assertGreater(estimate.bound(0), estimate.mean)
+
+
+class PeerTimingBackoff(unittest.TestCase):
+
+    def test_backoff_doubles_to_cap(self):
+        random.seed(0)
+        peer = rtt.PeerTiming()
+        for _ in range(20):
+            peer.rtt.update(0.05)
+        base = peer.rtt.bound(0)
+        for rounds in range(1, 8):
+            timeout = peer.retry_timeout(rounds, 1.0)
+            expected = min(base * 2 ** (rounds - 1), 1.0)
+            self.assertGreaterEqual(timeout, expected)
+            self.assertLessEqual(timeout, expected * (1 + rtt.RETRY_JITTER))
+        self.assertLessEqual(peer.retry_timeout(1000, 1.0),
+                             1 + rtt.RETRY_JITTER)
+
+    def test_floor_and_initial_timeouts(self):
+        random.seed(0)
+        peer = rtt.PeerTiming()
+        self.assertEqual(peer.gap_timeout(3), rtt.INITIAL_GAP_TIMEOUT)
+        self.assertGreaterEqual(peer.retry_timeout(1, 3),
+                                rtt.INITIAL_RETRY_TIMEOUT)
+        for _ in range(20):
+            peer.rtt.update(0.0001)
+            peer.gap.update(0.0001)
+        self.assertGreaterEqual(peer.retry_timeout(1, 3),
+                                rtt.MIN_RETRY_TIMEOUT)
+        self.assertLess(peer.gap_timeout(3), 0.001)
+        self.assertEqual(peer.gap_timeout(0.00001), 0.00001)
@@ -0,0 +1,165 @@
+import asyncio
+import random
+import unittest
+from collections import Counter
+from ipaddress import IPv4Network
+from socket import AF_INET, SOCK_DGRAM, socket
+
+from umps import parse, shard
+from umps.hash import hash_v1
+from umps.interface import address_of_bin, count_bins
+
+
+NETWORK = IPv4Network('239.11.124.0/24')
+PORT = 19531
+
+
+class WorkerOfBin(unittest.TestCase):
+
+    def test_bins_spread_evenly(self):
+        for nbins in (1, 254, 1022):
+            for workers in (1, 3, 4, 16):
+                counts = Counter(shard.worker_of_bin(address_bin, workers)
+                                 for address_bin in range(nbins))
+                self.assertLessEqual(set(counts), set(range(workers)))
+                self.assertEqual(len(counts), min(nbins, workers))
+                self.assertLessEqual(max(counts.values()) -
+                                     min(counts.values()), 1)
+
+    def test_topics_spread_over_workers(self):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        nbins, workers, ntopics = 254, 4, 2 ** 12
+        counts = Counter(
+            shard.worker_of_bin(hash_v1('topic-%d' % random.getrandbits(64),
+                                        nbins), workers)
+            for _ in range(ntopics))
+        for count in counts.values():
+            self.assertAlmostEqual(count, ntopics / workers,
+                                   delta=ntopics / workers / 4)
+
+
+@unittest.skipIf(shard._context is None, 'needs the forkserver')
+class MessageRingQueue(unittest.TestCase):
+    SIZE = 64
+
+    def setUp(self):
+        self.ring = shard._MessageRing(self.SIZE)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_round_trip(self):
+        self.assertEqual(self.ring.drain(), [])
+        self.assertTrue(self.ring.put('t', b'one'))
+        self.assertTrue(self.ring.put('topic', bytearray(b'two')))
+        self.assertEqual(self.ring.drain(), [('t', b'one'),
+                                             ('topic', b'two')])
+        self.assertEqual(self.ring.drain(), [])
+
+    def test_wrap_around(self):
+        # records of 24 bytes leave 16 at the end of the ring
+        body = bytes(range(18))
+        for _ in range(2):
+            self.assertTrue(self.ring.put('t', body))
+        self.assertEqual(len(self.ring.drain()), 2)
+        self.assertTrue(self.ring.put('t', body[::-1]))
+        self.assertEqual(self.ring.head.value, self.SIZE + 24)
+        self.assertEqual(self.ring.drain(), [('t', body[::-1])])
+        for count in range(20):
+            self.assertTrue(self.ring.put('t', bytes([count]) * 18))
+            self.assertEqual(self.ring.drain(), [('t', bytes([count]) * 18)])
+
+    def test_full_ring_drops(self):
+        body = bytes(10)
+        for _ in range(self.SIZE // 16):
+            self.assertTrue(self.ring.put('t', body))
+        self.assertFalse(self.ring.put('t', body))
+        self.assertFalse(self.ring.put('t', bytes(self.SIZE)))
+        self.assertEqual(self.ring.dropped.value, 2)
+        self.assertEqual(len(self.ring.drain()), self.SIZE // 16)
+        # room again once read
+        self.assertTrue(self.ring.put('t', body))
+        self.assertEqual(self.ring.drain(), [('t', body)])
+
+    def test_size_must_be_aligned(self):
+        with self.assertRaises(ValueError):
+            shard._MessageRing(self.SIZE + 1)
+
+
+@unittest.skipIf(shard._context is None, 'needs the forkserver')
+class ShardedLoopback(unittest.TestCase):
+    WORKERS = 2
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sender = socket(AF_INET, SOCK_DGRAM)
+        self.received = []
+        # one topic for each worker
+        nbins = count_bins(NETWORK)
+        self.topics = {}
+        count = 0
+        while len(self.topics) < self.WORKERS:
+            topic = 'topic-%d' % count
+            address_bin = hash_v1(topic, nbins)
+            self.topics.setdefault(
+                shard.worker_of_bin(address_bin, self.WORKERS),
+                (topic, address_of_bin(NETWORK, address_bin)))
+            count += 1
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.subscriber.terminate())
+        self.sender.close()
+        self.loop.close()
+
+    async def start(self):
+        # created while the loop runs, as an application would; batch
+        # receiving binds its own sockets, sharing the port
+        self.subscriber = shard.ShardedSubscriber(
+            NETWORK, PORT, workers=self.WORKERS, loop=self.loop,
+            batch_receive=True)
+        for topic, _ in self.topics.values():
+            await self.subscriber.subscribe(
+                topic, lambda topic, message: self.received.append(
+                    (topic, message)))
+
+    async def wait_for(self, count, timeout):
+        deadline = self.loop.time() + timeout
+        while len(self.received) < count and self.loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+    def send(self, uid, topic, address, body):
+        for frame in parse.pack(uid, topic, body):
+            self.sender.sendto(frame, (address, PORT))
+
+    def wait_until_joined(self):
+        # probe every worker until each has joined its group
+        probe = 0xff << parse.SEQUENCE_BITS
+        for sequence in range(100):
+            for topic, address in self.topics.values():
+                self.send(probe | sequence, topic, address, b'')
+            self.loop.run_until_complete(self.wait_for(self.WORKERS, 0.1))
+            if {topic for topic, _ in self.received} == {
+                    topic for topic, _ in self.topics.values()}:
+                break
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        del self.received[:]
+
+    def test_messages_through_workers(self):
+        self.loop.run_until_complete(self.start())
+        self.wait_until_joined()
+
+        # Seed generator for reproducible test.
+        random.seed(0)
+        expected = []
+        for index, (topic, address) in sorted(self.topics.items()):
+            stream = (index + 1) << parse.SEQUENCE_BITS
+            for sequence, length in enumerate((50, 5000)):
+                body = random.getrandbits(8 * length).to_bytes(length,
+                                                               'little')
+                expected.append((topic, body))
+                self.send(stream | sequence, topic, address, body)
+
+        self.loop.run_until_complete(self.wait_for(len(expected), 10))
+        self.assertEqual(sorted(self.received), sorted(expected))
+        self.assertEqual(self.subscriber.dropped, 0)
@@ -0,0 +1,71 @@
+import random
+import unittest
+
+from umps import stats
+
+
+class HistogramRecording(unittest.TestCase):
+
+    def test_buckets_cover_values(self):
+        histogram = stats.Histogram()
+        for units in list(range(1000)) + [2 ** n + k for n in range(10, 40)
+                                          for k in (-1, 0, 1)]:
+            index = histogram._index(units)
+            self.assertLessEqual(histogram._lowest(index), units)
+            self.assertGreater(histogram._lowest(index + 1), units)
+
+    def test_percentiles_within_precision(self):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        histogram = stats.Histogram()
+        values = sorted(random.expovariate(1000) for _ in range(10000))
+        for value in values:
+            histogram.record(value)
+        error = 2 ** -(stats.HISTOGRAM_PRECISION - 1)
+        for percent in stats.PERCENTILES:
+            exact = values[int(len(values) * percent / 100) - 1]
+            self.assertAlmostEqual(histogram.percentile(percent), exact,
+                                   delta=exact * error + stats.HISTOGRAM_UNIT)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], len(values))
+        self.assertEqual(snapshot['max'], values[-1])
+        self.assertAlmostEqual(snapshot['mean'], sum(values) / len(values))
+
+    def test_clamps_and_resets(self):
+        histogram = stats.Histogram(max_value=1)
+        histogram.record(-1)
+        histogram.record(100)
+        self.assertEqual(histogram.percentile(0), 0)
+        self.assertLessEqual(histogram.percentile(100), 1)
+        histogram.reset()
+        self.assertEqual(histogram.snapshot()['count'], 0)
+        self.assertEqual(histogram.percentile(50), 0)
+
+
+class StatsSnapshot(unittest.TestCase):
+
+    def test_snapshot_and_reset(self):
+        counters = stats.Stats()
+        counters.frames_received += 3
+        counters.callback_time.record(0.001)
+        depth = [5]
+        counters.add_gauge('depth', lambda: depth[0])
+        snapshot = counters.snapshot()
+        self.assertEqual(snapshot['frames_received'], 3)
+        self.assertEqual(snapshot['depth'], 5)
+        self.assertEqual(snapshot['callback_time']['count'], 1)
+        self.assertEqual(set(stats.Stats.COUNTERS) - set(snapshot), set())
+        counters.reset()
+        depth[0] = 2
+        snapshot = counters.snapshot()
+        self.assertEqual(snapshot['frames_received'], 0)
+        self.assertEqual(snapshot['depth'], 2)
+        self.assertEqual(snapshot['callback_time']['count'], 0)
+
+    def test_sampling(self):
+        counters = stats.Stats()
+        counters.set_profiler(lambda stage, seconds: None, 4)
+        self.assertEqual([counters.sample() for _ in range(8)],
+                         [False, False, False, True] * 2)
+        with self.assertRaises(ValueError):
+            counters.set_profiler(None, 0)
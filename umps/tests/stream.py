@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+
+from umps.dispatch import CONFLATE, DROP_NEWEST, DROP_OLDEST
+from umps.stream import MessageStream
+
+
+class MessageStreamRing(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def stream(self, maxsize=4, policy=None):
+        return MessageStream(maxsize, policy, loop=self.loop)
+
+    def read(self, stream, max_items=None):
+        return self.loop.run_until_complete(stream.get_batch(max_items))
+
+    def test_ring_wraps(self):
+        stream = self.stream()
+        for turn in range(5):
+            messages = [('t', bytes([turn, index])) for index in range(3)]
+            for topic, message in messages:
+                stream.put(topic, message)
+            self.assertEqual(len(stream), 3)
+            self.assertEqual(self.read(stream, 2), messages[:2])
+            self.assertEqual(self.read(stream), messages[2:])
+        self.assertEqual(stream.dropped, 0)
+
+    def test_drop_oldest(self):
+        stream = self.stream(policy=DROP_OLDEST)
+        for index in range(6):
+            stream.put('t', index)
+        self.assertEqual(stream.dropped, 2)
+        self.assertEqual(self.read(stream), [('t', index)
+                                             for index in range(2, 6)])
+
+    def test_drop_newest(self):
+        stream = self.stream(policy=DROP_NEWEST)
+        for index in range(6):
+            stream.put('t', index)
+        self.assertEqual(stream.dropped, 2)
+        self.assertEqual(self.read(stream), [('t', index)
+                                             for index in range(4)])
+
+    def test_conflate(self):
+        stream = self.stream(policy=CONFLATE)
+        for index in range(3):
+            stream.put('a', index)
+            stream.put('b', index)
+        self.assertEqual(stream.dropped, 4)
+        self.assertEqual(self.read(stream), [('a', 2), ('b', 2)])
+        # a topic read already is queued anew
+        stream.put('a', 3)
+        for topic in 'cdef':
+            stream.put(topic, 0)
+        self.assertEqual(stream.dropped, 5)
+        self.assertEqual(self.read(stream), [('c', 0), ('d', 0), ('e', 0),
+                                             ('f', 0)])
+
+    def test_close_ends_iteration(self):
+        stream = self.stream()
+        stream.put('t', 1)
+        stream.put('t', 2)
+        stream.close()
+        stream.put('t', 3)
+
+        async def read_all():
+            return [message async for message in stream]
+
+        self.assertEqual(self.loop.run_until_complete(read_all()),
+                         [('t', 1), ('t', 2)])
+        with self.assertRaises(StopAsyncIteration):
+            self.loop.run_until_complete(stream.get())
+
+    def test_close_wakes_reader(self):
+        stream = self.stream()
+        reader = self.loop.create_task(stream.get())
+        self.loop.call_soon(stream.close)
+        with self.assertRaises(StopAsyncIteration):
+            self.loop.run_until_complete(reader)
+
+    def test_batch_size_checked(self):
+        stream = self.stream()
+        stream.put('t', 1)
+        with self.assertRaises(ValueError):
+            self.read(stream, 0)
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(stream.batches(0).__anext__())
+        self.assertEqual(len(stream), 1)
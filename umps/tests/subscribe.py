@@ -0,0 +1,271 @@
+import asyncio
+import unittest
+
+from umps import compression, parse
+from umps.subscribe import SubscribeProtocol
+
+
+PUBLISHER = ('192.0.2.1', 5000)
+STREAM = 0x1234 << parse.SEQUENCE_BITS
+OTHER_STREAM = 0x5678 << parse.SEQUENCE_BITS
+
+
+class RecordingTransport:
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append((bytes(data), address))
+
+    def get_extra_info(self, name):
+        return None
+
+    def close(self):
+        pass
+
+
+class SequenceGapRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.received = []
+        self.protocol = SubscribeProtocol(
+            loop=self.loop, timeout=0.02, nack_jitter=0,
+            timer_resolution=0.005,
+            message_callback=lambda topic, body: self.received.append(topic),
+            topic_filter=lambda topic: topic == 'want')
+        self.transport = RecordingTransport()
+        self.protocol.connection_made(self.transport)
+
+    def tearDown(self):
+        self.protocol.close()
+        self.loop.close()
+
+    def receive(self, topics, lost=(), stream=STREAM):
+        for sequence, topic in enumerate(topics):
+            if sequence not in lost:
+                frame = parse.pack(stream | sequence, topic, b'body')[0]
+                self.protocol.datagram_received(bytes(frame), PUBLISHER)
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        return [parse.parse_header(data) for data, _ in self.transport.sent]
+
+    def test_gap_requested(self):
+        requests = self.receive(['want'] * 4, lost={2})
+        self.assertEqual(requests[0], (parse.FRAME_REQUEST, STREAM | 2, 0, 0))
+        self.assertEqual(self.received, ['want'] * 3)
+
+    def test_gap_not_requested_on_filtered_stream(self):
+        self.assertEqual(self.receive(['other'] * 4, lost={2}), [])
+        self.assertEqual(self.receive(['want', 'other', 'want', 'other',
+                                       'want'], lost={3},
+                                      stream=OTHER_STREAM), [])
+        self.assertEqual(self.protocol.stats.nacks_sent, 0)
+        self.assertEqual(self.received, ['want'] * 3)
+
+
+class IncompleteStateBounds(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.received = []
+        self.dropped = []
+
+    def tearDown(self):
+        self.protocol.close()
+        self.loop.close()
+
+    def subscriber(self, **kwargs):
+        self.protocol = SubscribeProtocol(
+            loop=self.loop, timeout=0.02, nack_jitter=0,
+            timer_resolution=0.005,
+            message_callback=lambda topic, body: self.received.append(topic),
+            drop_callback=lambda *drop: self.dropped.append(drop), **kwargs)
+        self.transport = RecordingTransport()
+        self.protocol.connection_made(self.transport)
+        return self.protocol
+
+    def frames(self, sequence, length=1500, topic='t'):
+        return [bytes(frame) for frame in
+                parse.pack(STREAM | sequence, topic, bytes(length))]
+
+    def wait(self, seconds=0.2):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_evicted_by_count(self):
+        protocol = self.subscriber(max_incomplete_messages=3)
+        for sequence in range(5):
+            protocol.datagram_received(self.frames(sequence)[0], PUBLISHER)
+            self.assertLessEqual(len(protocol._incomplete_messages), 3)
+        self.assertEqual(self.dropped,
+                         [('t', STREAM | 0, 'capacity'),
+                          ('t', STREAM | 1, 'capacity')])
+        self.assertEqual(list(protocol._incomplete_messages),
+                         [STREAM | 2, STREAM | 3, STREAM | 4])
+        # frames of a dropped message are not gathered again
+        for frame in self.frames(0)[1:]:
+            protocol.datagram_received(frame, PUBLISHER)
+        self.assertNotIn(STREAM | 0, protocol._incomplete_messages)
+
+    def test_evicted_by_bytes(self):
+        protocol = self.subscriber(max_incomplete_bytes=2000)
+        frames = [self.frames(sequence) for sequence in range(4)]
+        for message in frames:
+            for frame in message[:-1]:
+                protocol.datagram_received(frame, PUBLISHER)
+                self.assertLessEqual(protocol._incomplete_bytes, 2000)
+        self.assertTrue(self.dropped)
+        self.assertEqual({reason for _, _, reason in self.dropped},
+                         {'capacity'})
+        # the newest message survives and completes
+        protocol.datagram_received(frames[-1][-1], PUBLISHER)
+        self.assertEqual(self.received, ['t'])
+        self.assertEqual(protocol._incomplete_bytes, 0)
+
+    def test_given_up_after_retries(self):
+        protocol = self.subscriber(max_request_rounds=2)
+        protocol.datagram_received(self.frames(0)[0], PUBLISHER)
+        self.wait()
+        self.assertEqual(self.dropped, [('t', STREAM, 'retries')])
+        self.assertEqual(protocol.stats.nacks_sent, 2)
+        self.assertEqual(len(protocol._incomplete_messages), 0)
+        self.assertEqual(protocol._incomplete_bytes, 0)
+
+    def test_missing_message_given_up_after_retries(self):
+        protocol = self.subscriber(max_request_rounds=1)
+        for sequence in (0, 2):
+            protocol.datagram_received(self.frames(sequence, 10)[0],
+                                       PUBLISHER)
+        self.wait()
+        self.assertEqual(self.dropped, [(None, STREAM | 1, 'retries')])
+        self.assertEqual(protocol.stats.nacks_sent, 1)
+        self.assertEqual(len(protocol._missing_messages), 0)
+
+    def test_missing_messages_evicted_by_count(self):
+        protocol = self.subscriber(max_incomplete_messages=2)
+        for sequence in (0, 5):
+            protocol.datagram_received(self.frames(sequence, 10)[0],
+                                       PUBLISHER)
+        self.assertEqual(self.dropped,
+                         [(None, STREAM | 1, 'capacity'),
+                          (None, STREAM | 2, 'capacity')])
+        self.assertEqual(list(protocol._missing_messages),
+                         [STREAM | 3, STREAM | 4])
+
+    def test_dropped_by_publisher(self):
+        protocol = self.subscriber()
+        protocol.datagram_received(self.frames(0)[0], PUBLISHER)
+        protocol.datagram_received(
+            bytes(parse.pack_drop_message(STREAM, 0, 0)), PUBLISHER)
+        self.assertEqual(self.dropped, [('t', STREAM, 'publisher')])
+        self.assertEqual(protocol.stats.drop_notices_received, 1)
+        # notices of messages not being gathered are not reported
+        protocol.datagram_received(
+            bytes(parse.pack_drop_message(STREAM | 9, 0, 0)), PUBLISHER)
+        self.assertEqual(len(self.dropped), 1)
+
+    def test_unreadable(self):
+        protocol = self.subscriber()
+        frame = parse.pack(STREAM, 't', b'\x01not zlib',
+                           flags=parse.COMPRESSED)[0]
+        with self.assertLogs('umps.subscribe', 'WARNING'):
+            protocol.datagram_received(bytes(frame), PUBLISHER)
+        self.assertEqual(self.dropped, [('t', STREAM, 'unreadable')])
+        self.assertEqual(self.received, [])
+        self.assertEqual(protocol.stats.messages_dropped, 1)
+
+    def test_expands_beyond_limit(self):
+        protocol = self.subscriber(max_incomplete_bytes=2 ** 16)
+        body = compression.compress(bytes(2 ** 20), compression.ZLIB)
+        with self.assertLogs('umps.subscribe', 'WARNING'):
+            for frame in parse.pack(STREAM, 't', body,
+                                    flags=parse.COMPRESSED):
+                protocol.datagram_received(bytes(frame), PUBLISHER)
+        self.assertEqual(self.dropped, [('t', STREAM, 'unreadable')])
+        self.assertEqual(self.received, [])
+        # a body that fits is delivered
+        body = compression.compress(bytes(2 ** 16), compression.ZLIB)
+        for frame in parse.pack(STREAM | 1, 't', body,
+                                flags=parse.COMPRESSED):
+            protocol.datagram_received(bytes(frame), PUBLISHER)
+        self.assertEqual(self.received, ['t'])
+
+
+class TopicFiltering(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.topics = {'want'}
+        self.received = []
+        self.protocol = SubscribeProtocol(
+            loop=self.loop, timeout=0.02, nack_jitter=0,
+            timer_resolution=0.005, topic_filter=self.topics.__contains__,
+            message_callback=lambda topic, body: self.received.append(
+                (topic, bytes(body))),
+            drop_callback=lambda *drop: self.fail('dropped %r' % (drop,)))
+        self.transport = RecordingTransport()
+        self.protocol.connection_made(self.transport)
+
+    def tearDown(self):
+        self.protocol.close()
+        self.loop.close()
+
+    def frames(self, sequence, topic):
+        return [bytes(frame) for frame in
+                parse.pack(STREAM | sequence, topic, bytes(4000))]
+
+    def wait(self, seconds=0.1):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_unwanted_message_not_requested(self):
+        frames = self.frames(0, 'skip')
+        self.assertGreater(len(frames), 2)
+        # a frame lost after the first is never asked for
+        for frame in frames[:1] + frames[2:]:
+            self.protocol.datagram_received(frame, PUBLISHER)
+        self.wait()
+        self.assertEqual(self.transport.sent, [])
+        self.assertEqual(self.protocol.stats.nacks_sent, 0)
+        self.assertEqual(len(self.protocol._incomplete_messages), 0)
+        self.assertEqual(self.protocol._incomplete_bytes, 0)
+        self.assertEqual(self.received, [])
+
+    def test_later_frames_ignored(self):
+        frames = self.frames(0, 'skip')
+        self.protocol.datagram_received(frames[0], PUBLISHER)
+        for frame in frames[1:]:
+            self.protocol.datagram_received(frame, PUBLISHER)
+            self.assertNotIn(STREAM, self.protocol._incomplete_messages)
+        self.assertEqual(self.protocol.stats.duplicate_frames, 0)
+
+    def test_frames_ahead_of_first_released(self):
+        frames = self.frames(0, 'skip')
+        self.protocol.datagram_received(frames[1], PUBLISHER)
+        self.assertIn(STREAM, self.protocol._incomplete_messages)
+        self.protocol.datagram_received(frames[0], PUBLISHER)
+        self.assertNotIn(STREAM, self.protocol._incomplete_messages)
+        self.assertEqual(self.protocol._incomplete_bytes, 0)
+        for frame in frames[2:]:
+            self.protocol.datagram_received(frame, PUBLISHER)
+        self.wait()
+        self.assertEqual(self.transport.sent, [])
+
+    def test_wanted_messages_still_received(self):
+        self.protocol.datagram_received(self.frames(0, 'skip')[0], PUBLISHER)
+        for frame in self.frames(1, 'want'):
+            self.protocol.datagram_received(frame, PUBLISHER)
+        self.assertEqual(self.received, [('want', bytes(4000))])
+
+    def test_forget_ignored(self):
+        frames = self.frames(0, 'skip')
+        self.protocol.datagram_received(frames[0], PUBLISHER)
+        self.topics.add('skip')
+        self.protocol.forget_ignored()
+        for frame in frames[1:]:
+            self.protocol.datagram_received(frame, PUBLISHER)
+        self.assertIn(STREAM, self.protocol._incomplete_messages)
+        # the first frame is asked for again, and its repair completes it
+        self.wait(0.05)
+        self.assertTrue(self.transport.sent)
+        self.protocol.datagram_received(frames[0], PUBLISHER)
+        self.assertEqual(self.received, [('skip', bytes(4000))])
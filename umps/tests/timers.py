@@ -0,0 +1,94 @@
+import random
+import unittest
+
+from umps.timers import TimerWheel
+
+
+class TimerWheelExpiry(unittest.TestCase):
+
+    def advance_until(self, wheel, tick):
+        expired = dict()
+        while wheel.tick < tick:
+            for key in wheel.advance():
+                self.assertNotIn(key, expired)
+                expired[key] = wheel.tick
+        return expired
+
+    def test_expires_on_deadline(self):
+        wheel = TimerWheel(8)
+        wheel.schedule('a', 3)
+        wheel.schedule('b', 1)
+        wheel.schedule('c', 0)
+        self.assertEqual(len(wheel), 3)
+        self.assertEqual(wheel.advance(), ['b', 'c'])
+        self.assertEqual(wheel.advance(), [])
+        self.assertEqual(wheel.advance(), ['a'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel(self):
+        wheel = TimerWheel(8)
+        wheel.schedule('a', 2)
+        wheel.schedule('b', 2)
+        wheel.cancel('a')
+        wheel.cancel('missing')
+        self.assertNotIn('a', wheel)
+        self.assertEqual(wheel.advance(2), ['b'])
+
+    def test_reschedule(self):
+        wheel = TimerWheel(8)
+        wheel.schedule('later', 2)
+        wheel.schedule('sooner', 5)
+        wheel.schedule('later', 6)
+        wheel.schedule('sooner', 1)
+        self.assertEqual(self.advance_until(wheel, 20),
+                         {'sooner': 1, 'later': 6})
+
+    def test_stale_entries_ignored(self):
+        wheel = TimerWheel(8)
+        wheel.schedule('a', 5)
+        wheel.schedule('a', 2)
+        self.assertEqual(wheel.advance(2), ['a'])
+        # the entry left in the slot of tick 5 belongs to the old deadline
+        wheel.schedule('a', 3)
+        self.assertEqual(self.advance_until(wheel, 20), {'a': 5})
+        self.assertEqual(len(wheel), 0)
+
+    def test_deadlines_beyond_one_revolution(self):
+        wheel = TimerWheel(8)
+        wheel.schedule('a', 20)
+        wheel.schedule('b', 4)
+        wheel.schedule('c', 8 * 3 + 4)
+        self.assertEqual(self.advance_until(wheel, 40),
+                         {'b': 4, 'a': 20, 'c': 28})
+
+    def test_long_advance(self):
+        wheel = TimerWheel(8)
+        wheel.schedule('a', 3)
+        wheel.schedule('b', 2)
+        wheel.schedule('c', 50)
+        self.assertEqual(wheel.advance(20), ['b', 'a'])
+        self.assertEqual(wheel.tick, 20)
+        self.assertEqual(wheel.advance(100), ['c'])
+        self.assertEqual(wheel.tick, 120)
+
+    def test_random_schedules(self):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        wheel = TimerWheel(16)
+        deadlines = dict()
+        for tick in range(200):
+            for _ in range(3):
+                key = random.randrange(50)
+                if random.random() < 0.2:
+                    wheel.cancel(key)
+                    deadlines.pop(key, None)
+                else:
+                    ticks = random.randrange(1, 60)
+                    wheel.schedule(key, ticks)
+                    deadlines[key] = tick + ticks
+            expired = wheel.advance()
+            due = sorted(key for key, deadline in deadlines.items()
+                         if deadline == wheel.tick)
+            self.assertEqual(sorted(expired), due)
+            for key in expired:
+                del deadlines[key]
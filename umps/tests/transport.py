@@ -0,0 +1,184 @@
+import asyncio
+import random
+import unittest
+from socket import AF_INET, SOCK_DGRAM, socket
+
+from umps import parse
+from umps.mmsg import HAVE_RECVMMSG
+from umps.subscribe import create_subscribe_socket
+from umps.transport import BatchDatagramTransport
+
+
+LOOPBACK = ('127.0.0.1', 0)
+
+
+class RecordingProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self):
+        self.transport = None
+        self.batches = []
+        self.errors = []
+        self.lost = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.lost = True
+
+    def error_received(self, exc):
+        self.errors.append(exc)
+
+    def datagrams_received(self, datagrams):
+        # the views are only valid until the next batch
+        self.batches.append([(bytes(data), address)
+                             for data, address in datagrams])
+
+
+class BatchReceiving(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(LOOPBACK)
+        self.address = self.sock.getsockname()
+        self.sender = socket(AF_INET, SOCK_DGRAM)
+        self.sender.bind(LOOPBACK)
+        self.protocol = RecordingProtocol()
+
+    def tearDown(self):
+        if not self.transport.is_closing():
+            self.transport.close()
+            self.wait()
+        self.sender.close()
+        self.loop.close()
+
+    def transport_for(self, max_datagram_size=100, batch_size=4,
+                      fallback=False):
+        self.transport = BatchDatagramTransport(
+            self.loop, self.sock, self.protocol, max_datagram_size,
+            batch_size)
+        if fallback:
+            self.transport._receive = self.transport._recvfrom_into
+        self.wait()
+        return self.transport
+
+    def wait(self, seconds=0.02):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def datagrams(self, count):
+        # Seed generator for reproducible test.
+        random.seed(0)
+        return [random.getrandbits(8 * n).to_bytes(n, 'little')
+                for n in (random.randint(1, 100) for _ in range(count))]
+
+    def check_batches(self, fallback):
+        self.transport_for(fallback=fallback)
+        self.assertIs(self.protocol.transport, self.transport)
+        sent = self.datagrams(10)
+        for data in sent:
+            self.sender.sendto(data, self.address)
+        self.wait()
+
+        source = self.sender.getsockname()
+        received = [pair for batch in self.protocol.batches for pair in batch]
+        self.assertEqual(received, [(data, source) for data in sent])
+        # drained a batch at a time
+        self.assertGreaterEqual(len(self.protocol.batches), 3)
+        self.assertTrue(all(len(batch) <= 4
+                            for batch in self.protocol.batches))
+
+    @unittest.skipUnless(HAVE_RECVMMSG, 'recvmmsg not available')
+    def test_recvmmsg(self):
+        self.check_batches(fallback=False)
+
+    def test_recvfrom_into(self):
+        self.check_batches(fallback=True)
+
+    def check_truncation(self, fallback):
+        self.transport_for(max_datagram_size=10, fallback=fallback)
+        self.sender.sendto(bytes(range(20)), self.address)
+        self.sender.sendto(bytes(range(5)), self.address)
+        self.wait()
+        [batch] = self.protocol.batches
+        self.assertEqual([data for data, _ in batch],
+                         [bytes(range(11)), bytes(range(5))])
+
+    @unittest.skipUnless(HAVE_RECVMMSG, 'recvmmsg not available')
+    def test_recvmmsg_truncates(self):
+        self.check_truncation(fallback=False)
+
+    def test_recvfrom_into_truncates(self):
+        self.check_truncation(fallback=True)
+
+    def test_sendto(self):
+        transport = self.transport_for()
+        transport.sendto(b'request', self.sender.getsockname())
+        self.assertEqual(self.sender.recvfrom(100), (b'request', self.address))
+
+    def test_close(self):
+        transport = self.transport_for()
+        transport.close()
+        self.wait()
+        self.assertTrue(transport.is_closing())
+        self.assertTrue(self.protocol.lost)
+        self.assertEqual(self.sock.fileno(), -1)
+        # nothing is sent or received once closed
+        transport.sendto(b'request', self.sender.getsockname())
+        self.sender.sendto(b'late', self.address)
+        self.wait()
+        self.assertEqual(self.protocol.batches, [])
+
+
+class BatchSubscribing(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sender = socket(AF_INET, SOCK_DGRAM)
+        self.sender.bind(LOOPBACK)
+        self.received = []
+
+    def tearDown(self):
+        self.protocol.close()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.sender.close()
+        self.loop.close()
+
+    def check_messages(self, fallback):
+        self.protocol = self.loop.run_until_complete(create_subscribe_socket(
+            LOOPBACK, loop=self.loop, batch_receive=True,
+            receive_batch_size=8,
+            message_callback=lambda topic, body: self.received.append(
+                (topic, bytes(body)))))
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        transport = self.protocol.transport
+        if fallback:
+            transport._receive = transport._recvfrom_into
+        address = transport.get_extra_info('sockname')
+
+        # Seed generator for reproducible test.
+        random.seed(0)
+        stream = 0x1234 << parse.SEQUENCE_BITS
+        messages = [random.getrandbits(8 * n).to_bytes(n, 'little')
+                    for n in (100, 3000, 10, 5000)]
+        for sequence, body in enumerate(messages):
+            for frame in parse.pack(stream | sequence, 'topic', body):
+                self.sender.sendto(frame, address)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+
+        self.assertEqual(self.received,
+                         [('topic', body) for body in messages])
+        stats = self.protocol.stats
+        self.assertEqual(stats.messages_completed, len(messages))
+        self.assertEqual(stats.frames_received,
+                         sum(len(parse.pack(0, 'topic', body))
+                             for body in messages))
+        self.assertEqual(stats.nacks_sent, 0)
+
+    @unittest.skipUnless(HAVE_RECVMMSG, 'recvmmsg not available')
+    def test_recvmmsg(self):
+        self.check_messages(fallback=False)
+
+    def test_recvfrom_into(self):
+        self.check_messages(fallback=True)
@@ -0,0 +1,72 @@
+from typing import Hashable, List
+
+
+WHEEL_SLOTS = 2 ** 9
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel for many coarse, frequently postponed timeouts.
+
+    Time advances in whole ticks driven by the owner.  Each key sits in the
+    slot of its deadline tick.  Postponing a key only records its new
+    deadline; the key moves to its new slot when its old slot comes round.
+    Advancing therefore costs time in proportion to the keys found in the
+    slots passed over, not to the number of pending timeouts.
+    """
+
+    def __init__(self, slots: int = WHEEL_SLOTS):
+        self.tick = 0
+        self._slots = [[] for _ in range(slots)]
+        self._deadlines = dict()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable):
+        return key in self._deadlines
+
+    def schedule(self, key: Hashable, ticks: int):
+        """
+        Set a key to expire a number of ticks from now.
+
+        Any earlier deadline for the key is replaced.
+        """
+        deadline = self.tick + max(ticks, 1)
+        previous = self._deadlines.get(key)
+        self._deadlines[key] = deadline
+        if previous is None or deadline < previous:
+            self._slots[deadline % len(self._slots)].append(key)
+
+    def cancel(self, key: Hashable):
+        self._deadlines.pop(key, None)
+
+    def advance(self, ticks: int = 1) -> List[Hashable]:
+        """
+        Move time forward and return the keys that expired, oldest first.
+        """
+        nslots = len(self._slots)
+        if ticks > nslots:
+            # every slot is visited once, at its last tick in the range
+            self.tick += ticks - nslots
+            ticks = nslots
+
+        expired = []
+        for _ in range(ticks):
+            self.tick += 1
+            index = self.tick % nslots
+            bucket = self._slots[index]
+            if not bucket:
+                continue
+            self._slots[index] = []
+            for key in bucket:
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    # cancelled, or a stale entry for a key already expired
+                    continue
+                if deadline <= self.tick:
+                    del self._deadlines[key]
+                    expired.append(key)
+                else:
+                    self._slots[deadline % nslots].append(key)
+        return expired
@@ -0,0 +1,130 @@
+"""
+High-throughput receiving for subscribe sockets.
+
+asyncio's datagram transport makes one ``recvfrom`` call, one new ``bytes``
+object and one ``datagram_received`` call per datagram.  The transport here
+instead drains a batch of datagrams into preallocated buffers each time the
+socket is readable -- with one ``recvmmsg`` call where available, otherwise
+with repeated ``recvfrom_into`` -- and hands the whole batch to its
+protocol's ``datagrams_received``.
+"""
+from asyncio import DatagramTransport
+from logging import getLogger
+from socket import AF_INET
+
+from .mmsg import HAVE_RECVMMSG, ReceiveBuffers
+
+
+RECEIVE_BATCH_SIZE = 64
+
+
+class BatchDatagramTransport(DatagramTransport):
+    """
+    Datagram transport that delivers received datagrams in batches.
+
+    The protocol's ``datagrams_received(datagrams)`` is given a list of
+    ``(data, address)`` pairs, where each ``data`` is a view of a buffer that
+    is reused for the next batch; anything kept beyond the call must be
+    copied.  Datagrams that can't be sent at once are dropped rather than
+    buffered, as subscribers only send retransmission requests, which are
+    repeated if lost.
+
+    Parameters
+    ----------
+    loop : AbstractEventLoop
+        Loop to watch the socket on.
+    sock : socket
+        Bound, non-blocking UDP socket.
+    protocol : DatagramProtocol
+        Protocol with a ``datagrams_received`` method.
+    max_datagram_size : int
+        Largest datagram the protocol accepts.  Longer datagrams are
+        truncated to one byte more, so the protocol sees they are too large.
+    batch_size : int, optional
+        Most datagrams received per batch.
+    """
+
+    def __init__(self, loop, sock, protocol, max_datagram_size: int,
+                 batch_size: int = None):
+        super().__init__(extra={'socket': sock,
+                                'sockname': sock.getsockname()})
+        self.log = getLogger(__name__)
+        self._loop = loop
+        self._sock = sock
+        self._fileno = sock.fileno()
+        self._protocol = protocol
+        self._closing = False
+        batch_size = RECEIVE_BATCH_SIZE if batch_size is None else batch_size
+        self._buffers = ReceiveBuffers(batch_size, max_datagram_size + 1)
+        if HAVE_RECVMMSG and sock.family == AF_INET:
+            self._receive = self._buffers.recvmmsg
+        else:
+            self._receive = self._recvfrom_into
+        self._loop.call_soon(self._protocol.connection_made, self)
+        self._loop.call_soon(self._add_reader)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fileno)
+        self._loop.call_soon(self._call_connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+    def get_protocol(self):
+        return self._protocol
+
+    def set_protocol(self, protocol):
+        self._protocol = protocol
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+        try:
+            self._sock.sendto(data, addr)
+        except (BlockingIOError, InterruptedError):
+            self.log.debug('socket busy; dropped datagram to %s', addr)
+        except OSError as exc:
+            self._protocol.error_received(exc)
+
+    def _add_reader(self):
+        # the transport may have been closed before the loop got here
+        if not self._closing:
+            self._loop.add_reader(self._fileno, self._read_ready)
+
+    def _read_ready(self):
+        try:
+            datagrams = self._receive(self._fileno)
+        except OSError as exc:
+            self._protocol.error_received(exc)
+            return
+        if datagrams:
+            self._protocol.datagrams_received(datagrams)
+
+    def _recvfrom_into(self, fileno):
+        buffers = self._buffers
+        size = buffers.size
+        datagrams = []
+        for i in range(len(buffers)):
+            start = i * size
+            slot = buffers.view[start:start + size]
+            try:
+                nbytes, address = self._sock.recvfrom_into(slot)
+            except (BlockingIOError, InterruptedError):
+                break
+            datagrams.append((slot[:nbytes], address))
+        return datagrams
+
+    def _call_connection_lost(self, exc):
+        try:
+            self._protocol.connection_lost(exc)
+        finally:
+            self._sock.close()